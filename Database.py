@@ -1,33 +1,119 @@
 from typing import Optional
+import bson
 from bson import ObjectId
+from pymongo import ReturnDocument
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import bcrypt
 import os
+import threading
+import time
 import datetime
 import pytz
 from Models import GitHubReviewCache, User , CodeReviewResult, UserOut
+from metrics import MongoCommandMetrics
+from review_compression import compress_review, decompress_review
+from tracing import TRACING_ENABLED, MongoCommandTracing
 
 
 load_dotenv()
 
 uri = os.getenv("MONGODB_URI")
-client = MongoClient(uri, server_api=ServerApi('1'))
+DB_NAME = "User_Data"
 
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
-    
+# MongoClient is not fork-safe: it is created on first use in each process
+# (gunicorn preloads the app in the master, then forks workers)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                listeners = [MongoCommandMetrics()] + ([MongoCommandTracing()] if TRACING_ENABLED else [])
+                _client = MongoClient(uri, server_api=ServerApi('1'), event_listeners=listeners)
+    return _client
+
+
+def _reset_client_after_fork():
+    # The parent's client (sockets, monitor threads) must not be used or closed in the child
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+
+def ping():
+    try:
+        get_client().admin.command('ping')
+        print("Pinged your deployment. You successfully connected to MongoDB!")
+    except Exception as e:
+        print(e)
+
+
+# Index builders of each module that owns a collection. They run once from
+# the app's startup hook (or a deploy step), never at import: a cold start
+# must not block on Mongo round trips before serving its first request
+_index_builders = []
+
+
+def register_indexes(fn):
+    _index_builders.append(fn)
+    return fn
+
+
+def ensure_indexes():
+    for fn in _index_builders:
+        fn()
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
 
-db = client['User_Data']
+
+class _LazyDatabase:
+    def __getitem__(self, name: str):
+        return _LazyCollection(name)
+
+    def __getattr__(self, name: str):
+        return getattr(get_client()[DB_NAME], name)
+
+
+class _LazyCollection:
+    """Module-level collection handle that resolves against this process's client."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __getattr__(self, attr: str):
+        return getattr(get_client()[DB_NAME][self._name], attr)
+
+
+db = _LazyDatabase()
 users_collection = db['users']
 code_reviews_collection = db['code_reviews']
 refresh_tokens = db["refresh_tokens"]
 otp_collection = db["otps"]
 github_review_collection = db["github_reviews"]
+github_review_bodies = db["github_review_bodies"]
+review_leases = db["review_leases"]
+images_collection = db["images"]
+prewarm_budgets = db["prewarm_budgets"]
+image_extractions = db["image_extractions"]
+profiles = db["profiles"]
 
 def create_user(user_data : dict):
     hashed_password = bcrypt.hashpw(user_data["password"].encode(), bcrypt.gensalt()).decode()
@@ -97,12 +183,16 @@ def change_user_password(email: str, new_password: str):
     )
     return result.modified_count
 
-def store_review(code_review_data: dict):
-    # Validate using correct output model
-    review = CodeReviewResult(**code_review_data)
+def store_review(code_review_data: CodeReviewResult | dict):
+    # Results from the review pipeline are already validated models; only
+    # plain dicts (legacy callers) go through validation here
+    if isinstance(code_review_data, CodeReviewResult):
+        review = code_review_data
+    else:
+        review = CodeReviewResult(**code_review_data)
 
-    # Prepare mongo-safe dict
-    review_dict = review.dict()
+    # Prepare mongo-safe dict; large code fields are stored compressed
+    review_dict = compress_review(review.model_dump())
 
     result = code_reviews_collection.insert_one(review_dict)
     print("Code review stored with id:", result.inserted_id)
@@ -111,8 +201,8 @@ def store_review(code_review_data: dict):
     
 def store_img_review(metadata: dict):
     final_dict = CodeReviewResult(**metadata)
-    data = final_dict.dict()
-    result = db['images'].insert_one(data)
+    data = compress_review(final_dict.dict())
+    result = images_collection.insert_one(data)
     print("Image stored with id:", result.inserted_id)
     return str(result.inserted_id)
 
@@ -154,93 +244,231 @@ def is_valid_refresh_token(email: str, token: str) -> bool:
     return token_entry is not None
 
 def delete_refresh_token(email: str):
-    result = refresh_tokens.delete_one({
-        "email": email,
-    })
-    return result.deleted_count
+    return revoke_refresh_tokens(email)
 
 def delete_all_refresh_tokens(email: str):
+    revoke_refresh_tokens(email)
+
+def revoke_refresh_tokens(email: str):
+    # Revoke in place instead of deleting so other workers polling
+    # `updated_at` see the revocation; the TTL index removes it later.
     email = normalize_email(email)
-    refresh_tokens.delete_many({"email": email})
+    result = refresh_tokens.update_many(
+        {"email": email},
+        {"$set": {"jti": None, "token": None},
+         "$currentDate": {"updated_at": True}}
+    )
+    return result.modified_count
     
-def upsert_refresh_token(email: str, token: str):
+def upsert_refresh_token(email: str, jti: str):
     email = normalize_email(email)
     refresh_tokens.update_one(
         {"email": email},
         {"$set": {
             "email": email,
-            "token": token,
+            "jti": jti,
             "created_at": datetime.datetime.utcnow(),
             "expires_at": datetime.datetime.utcnow() + datetime.timedelta(days=7)
-        }},
+        },
+         "$unset": {"token": ""},
+         "$currentDate": {"updated_at": True}},
         upsert=True
     )
 
-def store_otp(email: str, otp: str):
-    ist = pytz.timezone('Asia/Kolkata')
-    now_ist = datetime.datetime.now(ist)
-    expiry_time = now_ist + datetime.timedelta(minutes=10)
+def rotate_refresh_token(email: str, old_jti: str, new_jti: str) -> bool:
+    """
+    Compare-and-swap rotation: only succeeds if `old_jti` is still the live
+    token for this email, so validation and rotation cost a single write.
+    """
     email = normalize_email(email)
-
-    otp_collection.update_one(
-        {"email": email},
+    now = datetime.datetime.utcnow()
+    result = refresh_tokens.update_one(
+        {"email": email, "jti": old_jti, "expires_at": {"$gt": now}},
         {"$set": {
-            "email": email,
-            "otp": otp,
-            'attempt': 0,
-            "expires_at": expiry_time
-    }}
-    , upsert=True
+            "jti": new_jti,
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(days=7)
+        },
+         "$currentDate": {"updated_at": True}}
     )
-
-def verify_otp(email: str, otp: str) -> bool:
-    email = normalize_email(email)
-    record = otp_collection.find_one({"email": email})
-    if not record:
-        return False
-    if record["expires_at"] < datetime.datetime.now(pytz.timezone('Asia/Kolkata')):
-        return False
-    if record["attempt"] >= 5:
-        return False
-    if not bcrypt.checkpw(otp.encode(), record["otp"].encode()):
-        otp_collection.update_one(
-            {"email": email},
-            {"$inc": {"attempt": 1}}
-        )
-        return False
-    return True
-
-def delete_otp(email: str):
-    result = otp_collection.delete_one({
-        "email": email,
-    })
-    return result.deleted_count
+    return result.modified_count == 1
 
 def normalize_email(email: str) -> str:
     return email.strip().lower()
 
-def get_cached_review(user_id: str, repo: str, file_path: str, commit_sha: str) -> Optional[GitHubReviewCache]:
+def get_cached_review(user_id: str, owner: str, repo: str, file_path: str, commit_sha: str,
+                      models: list[str]) -> Optional[GitHubReviewCache]:
+    """The newest link written by one of `models` (or answered locally, with no model)."""
     doc = github_review_collection.find_one({
         "user_id": user_id,
+        "owner": owner,
         "repo": repo,
         "file_path": file_path,
-        "commit_sha": commit_sha
-    })
-    
-    if doc:
-        # Convert MongoDB doc to Pydantic model
-        return GitHubReviewCache(**doc)
+        "commit_sha": commit_sha,
+        "model": {"$in": [*models, None]}
+    }, sort=[("created_at", -1)])
+    if not doc:
+        return None
+
+    # Links only point at the shared body; join it in
+    if doc.get("result") is None and doc.get("body_id"):
+        body = github_review_bodies.find_one({"_id": doc["body_id"]}, {"result": 1})
+        if body is None:
+            return None
+        doc["result"] = body["result"]
+    doc["result"] = decompress_review(doc["result"])
+
+    # Convert MongoDB doc to Pydantic model
+    return GitHubReviewCache(**doc)
+
+def find_review_body(body_ids: list[str]) -> Optional[dict]:
+    """The first of `body_ids` that is stored, in one query."""
+    bodies = {body["_id"]: body for body in github_review_bodies.find({"_id": {"$in": body_ids}})}
+    for body_id in body_ids:
+        if body_id in bodies:
+            body = bodies[body_id]
+            body["result"] = decompress_review(body["result"])
+            return body
     return None
 
-def store_github_review(review_cache: GitHubReviewCache):
-    github_review_collection.update_one(
+def store_review_body(body_id: str, body: dict) -> bool:
+    """Inserts a shared review body once; returns False if it already existed."""
+    result = compress_review(body["result"])
+    body = dict(body, result=result, stored_bytes=len(bson.encode(result)))
+    result = github_review_bodies.update_one(
+        {"_id": body_id},
+        {"$setOnInsert": body},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+def record_review_body_hit(body_id: str):
+    github_review_bodies.update_one(
+        {"_id": body_id},
+        {"$inc": {"hits": 1}, "$set": {"last_hit_at": datetime.datetime.utcnow()}}
+    )
+
+def store_github_review(review_cache: GitHubReviewCache) -> str:
+    """
+    Upserts the per-user link for (user, owner, repo, file, commit, model) and
+    returns its review_id, which stays stable if the link already existed.
+    """
+    link = review_cache.model_dump(exclude_none=True)
+    doc = github_review_collection.find_one_and_update(
         {
-            "review_id": review_cache.review_id,
             "user_id": review_cache.user_id,
+            "owner": review_cache.owner,
             "repo": review_cache.repo,
             "file_path": review_cache.file_path,
-            "commit_sha": review_cache.commit_sha
+            "commit_sha": review_cache.commit_sha,
+            "model": review_cache.model
         },
-        {"$set": review_cache.dict()},
+        {"$setOnInsert": link},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if doc["review_id"] == review_cache.review_id and review_cache.body_id:
+        github_review_bodies.update_one({"_id": review_cache.body_id}, {"$inc": {"link_count": 1}})
+    return doc["review_id"]
+
+def recent_repo_reviewers(owner: str, repo: str, limit: int) -> list[str]:
+    """Users who most recently reviewed files of owner/repo, newest first."""
+    rows = github_review_collection.aggregate([
+        {"$match": {"owner": owner, "repo": repo}},
+        {"$group": {"_id": "$user_id", "last": {"$max": "$created_at"}}},
+        {"$sort": {"last": -1}},
+        {"$limit": limit},
+    ])
+    return [row["_id"] for row in rows]
+
+def take_prewarm_budget(owner: str, repo: str, budget: int, window_seconds: int) -> bool:
+    """Counts one pre-warm review against owner/repo's budget for the current window."""
+    window = int(time.time() // window_seconds)
+    doc = prewarm_budgets.find_one_and_update(
+        {"_id": f"{owner}/{repo}:{window}"},
+        {"$inc": {"used": 1},
+         "$setOnInsert": {"expires_at": datetime.datetime.utcfromtimestamp((window + 1) * window_seconds)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["used"] <= budget
+
+def review_cache_stats() -> dict:
+    """Size of the shared GitHub review cache and what sharing saved."""
+    totals = list(github_review_bodies.aggregate([
+        {"$group": {
+            "_id": "$scope",
+            "bodies": {"$sum": 1},
+            "links": {"$sum": "$link_count"},
+            "hits": {"$sum": "$hits"},
+            "body_bytes": {"$sum": "$size_bytes"},
+            "stored_bytes": {"$sum": "$stored_bytes"},
+            "bytes_saved": {"$sum": {"$multiply": ["$size_bytes", {"$max": [{"$subtract": ["$link_count", 1]}, 0]}]}},
+            "prompt_tokens_spent": {"$sum": "$prompt_tokens"},
+            "prompt_tokens_saved": {"$sum": {"$multiply": ["$prompt_tokens", {"$max": [{"$subtract": ["$link_count", 1]}, 0]}]}},
+        }}
+    ]))
+    return {
+        "scopes": {row.pop("_id"): row for row in totals},
+        "link_documents": github_review_collection.count_documents({"body_id": {"$exists": True}}),
+    }
+
+@register_indexes
+def ensure_review_cache_indexes():
+    try:
+        github_review_collection.create_index([("user_id", 1), ("owner", 1), ("repo", 1), ("file_path", 1), ("commit_sha", 1)])
+        github_review_collection.create_index([("owner", 1), ("repo", 1), ("created_at", -1)])
+        prewarm_budgets.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        print(e)
+
+# Code extracted from an image, keyed by model + image hash: re-uploaded screenshots skip the model
+IMAGE_EXTRACTION_TTL_DAYS = int(os.getenv("IMAGE_EXTRACTION_TTL_DAYS", "30"))
+
+def get_image_extraction(keys: list[str]) -> Optional[str]:
+    """The extraction stored under the first of `keys` (in order of preference) that has one."""
+    found = {doc["_id"]: doc["code"] for doc in image_extractions.find({"_id": {"$in": keys}}, {"code": 1})}
+    return next((found[key] for key in keys if key in found), None)
+
+def store_image_extraction(key: str, code: str):
+    image_extractions.update_one(
+        {"_id": key},
+        {"$set": {
+            "code": code,
+            "expires_at": datetime.datetime.utcnow() + datetime.timedelta(days=IMAGE_EXTRACTION_TTL_DAYS),
+        }},
         upsert=True
-    )
\ No newline at end of file
+    )
+
+@register_indexes
+def ensure_image_extraction_indexes():
+    try:
+        image_extractions.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        print(e)
+
+
+PROFILE_TTL_DAYS = int(os.getenv("PROFILE_TTL_DAYS", "7"))
+
+# Profile documents keep their pstats/folded blobs out of listings
+PROFILE_BLOBS = {"pstats": 0, "folded": 0}
+
+def store_profile(doc: dict):
+    now = datetime.datetime.utcnow()
+    profiles.insert_one(dict(doc, created_at=now, expires_at=now + datetime.timedelta(days=PROFILE_TTL_DAYS)))
+
+def get_profile(profile_id: str, with_blobs: bool = False) -> Optional[dict]:
+    return profiles.find_one({"_id": profile_id}, None if with_blobs else PROFILE_BLOBS)
+
+def recent_profiles(route: Optional[str] = None, limit: int = 50) -> list[dict]:
+    """Newest first, without blobs; optionally for one route template."""
+    query = {"route": route} if route else {}
+    return list(profiles.find(query, PROFILE_BLOBS).sort("created_at", -1).limit(limit))
+
+@register_indexes
+def ensure_profile_indexes():
+    try:
+        profiles.create_index("expires_at", expireAfterSeconds=0)
+        profiles.create_index([("route", 1), ("created_at", -1)])
+    except Exception as e:
+        print(e)
@@ -1,46 +1,213 @@
+from functools import lru_cache
+import json
 from pathlib import Path
 import time
 import logging
 from google.genai import errors as genai_errors
 import dotenv
 import os
-from google import genai
 from google.genai import types
 
+from pydantic import BaseModel, ValidationError, create_model
+
+from llm_backend import get_backend
+from metrics import (GEMINI_REQUEST_DURATION, GEMINI_RETRIES, REVIEW_PARSE_FAILURES, REVIEW_PARSE_WASTED_TOKENS,
+                     REVIEW_PARSES, record_gemini_usage)
+from model_router import available, failover
+from prompt_budget import estimate_tokens
+from tracing import span, traced_sleep
+
 env_path = Path(__file__).parent / ".env"
 dotenv.load_dotenv(dotenv_path=env_path)
 
 MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-api_key = os.getenv("GEMINI_API_KEY")
-
-
-if not api_key:
-    print(f"DEBUG: Searching for .env at {env_path.absolute()}")
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
 
-client = genai.Client(api_key=api_key)
 
-
-def _call_gemini_with_retries(parts_or_contents, model=MODEL, max_attempts=5, base_delay=1.0):
+def _call_gemini_with_retries(parts_or_contents, model=MODEL, max_attempts=5, base_delay=1.0, schema=None):
     """
-    Try calling client.models.generate_content with exponential backoff.
-    Returns response on success, raises last exception on permanent failure.
+    Try calling the active LLM backend's generate_content with exponential backoff.
+    Returns `(response, model that answered)` on success, raises last exception on permanent failure.
+    `schema` (a Pydantic model) constrains the JSON reply through response_schema.
+    A 429 moves the request to the model's alternate (model_router) instead of failing.
     """
     attempt = 0
+    last_error = None
+    model = available(model)
+    tried = {model}
     while attempt < max_attempts:
+        start = time.perf_counter()
         try:
-            resp = client.models.generate_content(model=model, contents=parts_or_contents , config= types.GenerateContentConfig(
-                response_mime_type="application/json",))
-            return resp
+            # One child span per attempt (and per failover), so retries show up in the trace
+            with span("gemini.generate_content", kind="CLIENT", **{
+                    "gen_ai.system": "gemini", "gen_ai.request.model": model, "gemini.attempt": attempt + 1}) as s:
+                resp = get_backend().generate_content(model=model, contents=parts_or_contents , config= types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=response_schema(schema) if schema is not None else None,))
+                if s is not None:
+                    usage = getattr(resp, "usage_metadata", None)
+                    s.set(**{"gen_ai.usage.input_tokens": getattr(usage, "prompt_token_count", None),
+                             "gen_ai.usage.output_tokens": getattr(usage, "candidates_token_count", None)})
+            GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model=model, call="review", outcome="ok")
+            record_gemini_usage(model, "review", resp)
+            return resp, model
         except genai_errors.ServerError as e:
             # 503 or other server-side transient errors
+            last_error = e
+            GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model=model, call="review", outcome="server_error")
             attempt += 1
             wait = base_delay * (2 ** (attempt - 1))
             logging.warning("Gemini ServerError attempt %d/%d: %s — retrying in %.1fs", attempt, max_attempts, str(e), wait)
-            time.sleep(wait)
+            if attempt < max_attempts:
+                GEMINI_RETRIES.inc(model=model, call="review")
+            traced_sleep(wait)
         except Exception as e:
+            GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model=model, call="review", outcome="error")
+            alternate = failover(model, e, tried)
+            if alternate:
+                model = alternate
+                tried.add(model)
+                continue
             # Non-retryable error — rethrow
             logging.exception("Non-retryable error calling Gemini: %s", e)
             raise
     # If we exit loop, we exhausted retries
-    raise genai_errors.ServerError(503, {"error": {"message": "exhausted retries"}}, None)
+    raise last_error
+
+
+
+# --- Structured output ---
+
+_GEMINI_TYPES = {"string": "STRING", "integer": "INTEGER", "number": "NUMBER", "boolean": "BOOLEAN",
+                 "array": "ARRAY", "object": "OBJECT"}
+
+
+def _gemini_schema(node: dict, defs: dict) -> dict:
+    # Gemini takes an OpenAPI subset of JSON Schema: no $ref, and anyOf only as `nullable`
+    if "$ref" in node:
+        node = defs[node["$ref"].rsplit("/", 1)[-1]]
+    if "anyOf" in node:
+        options = [option for option in node["anyOf"] if option.get("type") != "null"]
+        out = _gemini_schema(options[0], defs)
+        if len(options) < len(node["anyOf"]):
+            out["nullable"] = True
+        return out
+    out = {"type": _GEMINI_TYPES[node["type"]]}
+    if "enum" in node:
+        out.update(format="enum", enum=[str(value) for value in node["enum"]])
+    if "items" in node:
+        out["items"] = _gemini_schema(node["items"], defs)
+    if "properties" in node:
+        out["properties"] = {name: _gemini_schema(prop, defs) for name, prop in node["properties"].items()}
+        out["required"] = node.get("required", [])
+        out["property_ordering"] = list(node["properties"])
+    return out
+
+
+@lru_cache(maxsize=None)
+def response_schema(model: type[BaseModel]) -> types.Schema:
+    """Gemini response_schema for a Pydantic model."""
+    schema = model.model_json_schema()
+    return types.Schema.model_validate(_gemini_schema(schema, schema.get("$defs", {})))
+
+
+@lru_cache(maxsize=None)
+def _portion_model(model: type[BaseModel], fields: tuple[str, ...]) -> type[BaseModel]:
+    return create_model(f"{model.__name__}Retry", **{name: (model.model_fields[name].annotation, ...) for name in fields})
+
+
+def _failed_portions(model: type[BaseModel], data) -> tuple[set, dict]:
+    """`(fields, {list field: bad item indexes})` of `data` that don't validate against `model`."""
+    if not isinstance(data, dict):
+        return set(model.model_fields), {}
+    try:
+        model.model_validate(data)
+        return set(), {}
+    except ValidationError as e:
+        fields, items = set(), {}
+        for error in e.errors():
+            loc = error["loc"]
+            if len(loc) > 1 and isinstance(loc[1], int) and isinstance(data.get(loc[0]), list):
+                items.setdefault(loc[0], set()).add(loc[1])
+            else:
+                fields.add(loc[0])
+        return fields, {name: bad for name, bad in items.items() if name not in fields}
+
+
+def _parse(response):
+    try:
+        return json.loads(getattr(response, "text", "") or "")
+    except json.JSONDecodeError:
+        return None
+
+
+def _output_tokens(response) -> int:
+    return getattr(getattr(response, "usage_metadata", None), "candidates_token_count", None) or 0
+
+
+def generate_structured(contents: list, model: type[BaseModel], call: str = "review",
+                        model_name: str = MODEL) -> tuple[dict, int, str]:
+    """
+    One schema-constrained request to `model_name`, validated against `model`;
+    returns `(data, output tokens of every request made, model that answered)`.
+
+    Only what failed is asked for again, once: an unparseable reply is
+    requested whole; otherwise a follow-up names the missing or invalid
+    fields (and, for list fields, just the invalid entries) and the answers
+    are merged in. Failed portions and the output tokens they wasted are
+    counted per call. Raises ValueError if the reply is still invalid.
+    """
+    with span("gemini.generate_structured", **{"gemini.call": call, "gemini.schema": model.__name__}) as s:
+        data, output_tokens, model_name = _generate_structured(contents, model, call, model_name)
+        if s is not None:
+            s.set(**{"gen_ai.response.model": model_name, "gen_ai.usage.output_tokens": output_tokens})
+        return data, output_tokens, model_name
+
+
+def _generate_structured(contents: list, model: type[BaseModel], call: str, model_name: str) -> tuple[dict, int, str]:
+    response, model_name = _call_gemini_with_retries(contents, model=model_name, schema=model)
+    output_tokens = _output_tokens(response)
+    data = _parse(response)
+    if data is None:
+        REVIEW_PARSE_FAILURES.inc(call=call, portion="response")
+        REVIEW_PARSE_WASTED_TOKENS.inc(output_tokens, call=call)
+        response, model_name = _call_gemini_with_retries(contents, model=model_name, schema=model)
+        output_tokens += _output_tokens(response)
+        data = _parse(response)
+
+    fields, items = _failed_portions(model, data)
+    if data is not None and (fields or items):
+        for name in fields:
+            REVIEW_PARSE_FAILURES.inc(call=call, portion=name)
+            if name in data:
+                REVIEW_PARSE_WASTED_TOKENS.inc(estimate_tokens(json.dumps(data[name], default=str)), call=call)
+        invalid = {name: [data[name][i] for i in sorted(bad)] for name, bad in items.items()}
+        for name, entries in invalid.items():
+            REVIEW_PARSE_FAILURES.inc(len(entries), call=call, portion=name)
+            REVIEW_PARSE_WASTED_TOKENS.inc(estimate_tokens(json.dumps(entries, default=str)), call=call)
+
+        follow_up = (
+            "Your previous JSON reply was incomplete or invalid. Reply with a JSON object holding only the "
+            f"fields {', '.join(sorted(set(fields) | set(invalid)))}, complete and valid."
+        )
+        for name, entries in invalid.items():
+            follow_up += (f"\nFor \"{name}\", return only corrected versions of these invalid entries "
+                          f"(the others were fine): {json.dumps(entries, default=str)}")
+        response, model_name = _call_gemini_with_retries(
+            list(contents) + [follow_up], model=model_name, schema=_portion_model(model, tuple(sorted(set(fields) | set(invalid)))))
+        output_tokens += _output_tokens(response)
+        portion = _parse(response)
+        if isinstance(portion, dict):
+            for name in fields:
+                data[name] = portion.get(name)
+            for name, bad in items.items():
+                kept = [entry for i, entry in enumerate(data[name]) if i not in bad]
+                data[name] = kept + list(portion.get(name) or [])
+        REVIEW_PARSES.inc(call=call, outcome="retried")
+    elif data is not None:
+        REVIEW_PARSES.inc(call=call, outcome="ok")
+
+    try:
+        return model.model_validate(data).model_dump(), output_tokens, model_name
+    except ValidationError as e:
+        REVIEW_PARSES.inc(call=call, outcome="failed")
+        raise ValueError(f"Gemini reply does not match {model.__name__}: {e.error_count()} error(s)") from e
@@ -1,29 +1,42 @@
 import hashlib
 import logging
+import time
 from dotenv import load_dotenv
 import os
 from pathlib import Path
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
 # Removed unused imports: from Gemini import _call_gemini_with_retries, time, json, List
 # Removed unused/problematic imports: from google.api_core import retry (only need tenacity)
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential
 
 # NEW SDK imports
-from google import genai
 from google.genai import errors as genai_errors
 from google.genai.types import Part
 from google.genai import types
 
-from LLM import code_review
-from Models import CodeReviewResult, ImageReview, Summary
-from Database import store_review # Assume this is where you implement caching
+from fastapi import HTTPException
+
+from Gemini import generate_structured
+from LLM import CODE_REVIEW_SYSTEM_PROMPT, _build_result, code_review
+from Models import CodeReviewResult, ImageReview, ImageReviewOutput
+from Database import get_image_extraction, store_image_extraction
+from llm_backend import get_backend
+from metrics import GEMINI_REQUEST_DURATION, GEMINI_RETRIES, counter, record_gemini_usage
+from model_router import FAILOVER_MODELS, IMAGE_MODEL, available, failover
+from prompt_budget import MinimizedCode, estimate_tokens
+from static_analysis import analyze_code
+from tracing import propagate, span, traced_sleep
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 
-# Model and client config
-MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Model and client config: screenshots go to GEMINI_IMAGE_MODEL (model_router)
+MODEL = IMAGE_MODEL
+# fused: one request sends the images with the review prompt and gets the
+# extracted code and its review back together. two_step: extract each image,
+# then review the stitched code (also the fallback when a fused reply is unusable)
+IMAGE_REVIEW_MODE = os.getenv("IMAGE_REVIEW_MODE", "fused").strip().lower()
 
 
 # --- UTILITIES MOVED TO TOP ---
@@ -57,112 +70,272 @@ def is_resource_exhausted(exception) -> bool:
         return "RESOURCE_EXHAUSTED" in error_message or "429" in error_message
     return False
 
+
+def _retryable(retry_state) -> bool:
+    """
+    Retry on the base APIError (4xx and 5xx), except a 429 from a model with
+    an alternate: that fails over (in _extract_code) instead of backing off.
+    """
+    error = retry_state.outcome.exception()
+    if not isinstance(error, genai_errors.APIError):
+        return False
+    return not (is_resource_exhausted(error) and FAILOVER_MODELS.get(retry_state.kwargs.get("model")))
+
 @retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(min=1, max=60), 
-    # CRITICAL CHANGE: Only retry on the base APIError. 
-    # This catches 4xx and 5xx errors, including the 429/ResourceExhausted.
-    retry=retry_if_exception_type(genai_errors.APIError),
+    retry=_retryable,
+    before_sleep=lambda retry_state: GEMINI_RETRIES.inc(model=retry_state.kwargs["model"], call="image_extract"),
+    sleep=traced_sleep,
     reraise=True 
 )
 def _call_gemini_extract_code(client, contents, model, config):
     """
     Internal function that makes the actual API call, wrapped by tenacity.
     """
-    return client.models.generate_content(
-        contents=contents,
-        model=model,
-        config=config,
-    )
+    start = time.perf_counter()
+    try:
+        with span("gemini.generate_content", kind="CLIENT", **{
+                "gen_ai.system": "gemini", "gen_ai.request.model": model, "gemini.call": "image_extract"}):
+            response = client.generate_content(
+                contents=contents,
+                model=model,
+                config=config,
+            )
+    except Exception:
+        GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model=model, call="image_extract", outcome="error")
+        raise
+    GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model=model, call="image_extract", outcome="ok")
+    record_gemini_usage(model, "image_extract", response)
+    return response
 
-# --- MAIN FUNCTION ---
-def img_code(user_id: str, img_path: str) -> Dict[str, Any]:
-    """
-    Extract code from image -> run code review -> store ImageReview.
-    """
+# --- EXTRACTION (cached per image) ---
+IMAGE_EXTRACT_WORKERS = int(os.getenv("IMAGE_EXTRACT_WORKERS", "4"))
+# Longest run of lines two consecutive screenshots are expected to share
+STITCH_MAX_OVERLAP_LINES = int(os.getenv("STITCH_MAX_OVERLAP_LINES", "60"))
 
-    # --- 1. Prepare Image and Caching Key ---
-    img_bytes = Path(img_path).read_bytes()
-    img_hash = hashlib.sha256(img_bytes).hexdigest()
+IMAGE_EXTRACTIONS = counter(
+    "image_extractions_total", "Code extractions from images, by cache result.", ("result",))
 
-    # NOTE: You MUST implement 'get_from_cache' and 'store_to_cache' 
-    # to avoid repeated API calls and save quota.
-    # cached_review = get_from_cache(img_hash)
-    # if cached_review:
-    #     logging.info(f"Cache hit for hash: {img_hash}")
-    #     return cached_review # Return ImageReview dict directly
+EXTRACTION_INSTRUCTION = (
+    "Extract ONLY the code from this image. Preserve exact indentation. "
+    "Return exactly one markdown code block, nothing else. "
+    "If unreadable, mark lines with [UNREADABLE]."
+)
 
-    image_part = types.Part.from_bytes(data=img_bytes, mime_type=_guess_mime_type(img_path))
 
-    extraction_instruction = (
-        "Extract ONLY the code from this image. Preserve exact indentation. "
-        "Return exactly one markdown code block, nothing else. "
-        "If unreadable, mark lines with [UNREADABLE]."
-    )
+class ExtractionError(Exception):
+    pass
+
 
+def _extract_code(img_bytes: bytes, mime_type: str) -> tuple[str, str]:
+    """`(code, model that transcribed it)`; the model differs from MODEL after a failover."""
+    image_part = types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
     config = types.GenerateContentConfig(
         response_mime_type="application/json",
     )
-
-    # --- 2. Call Gemini with Retry Wrapper ---
+    model = available(MODEL)
+    tried = {model}
     try:
-        response = _call_gemini_extract_code(
-            client=client,
-            contents=[image_part, extraction_instruction],
-            model=MODEL,
-            config=config,
-        )
+        while True:
+            try:
+                response = _call_gemini_extract_code(
+                    client=get_backend(),
+                    contents=[image_part, EXTRACTION_INSTRUCTION],
+                    model=model,
+                    config=config,
+                )
+                break
+            except genai_errors.APIError as e:
+                alternate = failover(model, e, tried)
+                if not alternate:
+                    raise
+                model = alternate
+                tried.add(model)
     except genai_errors.APIError as e:
-        error_message = str(e)
-        if "RESOURCE_EXHAUSTED" in error_message or "429" in error_message:
+        if is_resource_exhausted(e):
             # Catches the 429 error after all 5 retries have failed
             logging.error(f"Gemini quota exhausted after retries: {e}")
-            return {"error": "Image extraction failed (Quota Exhausted)."}
-        
+            raise ExtractionError("Image extraction failed (Quota Exhausted).")
         # Handle other API errors (like bad requests, 5xx that tenacity didn't fix)
         logging.exception(f"Gemini API error after retries: {e}")
-        return {"error": "Image extraction failed (API Error)."}
-        
+        raise ExtractionError("Image extraction failed (API Error).")
     except Exception:
-        # Catches other non-API errors
         logging.exception("Gemini extraction failed permanently due to unexpected error.")
-        return {"error": "Image extraction failed (unexpected error)."}
+        raise ExtractionError("Image extraction failed (unexpected error).")
 
-    # --- 3. Process Response ---
     raw_text = getattr(response, "text", "") or ""
     code_text = _extract_code_from_markdown(raw_text)
+    if not code_text.strip():
+        logging.error("No code extracted from Gemini response: %s", raw_text[:500])
+        raise ExtractionError("No code extracted from image")
+    return code_text, model
+
+
+def _extraction_key(images: List[bytes], model: str) -> str:
+    return f"{model}:" + ":".join(hashlib.sha256(img_bytes).hexdigest() for img_bytes in images)
+
+
+def _cached_extraction(images: List[bytes]) -> str | None:
+    """A stored transcription of `images` by the image model or, failing that, its failover alternate."""
+    models = [MODEL, FAILOVER_MODELS[MODEL]] if MODEL in FAILOVER_MODELS else [MODEL]
+    return get_image_extraction([_extraction_key(images, model) for model in models])
+
 
+def extract_code(img_path: str) -> str:
+    """Code in one image; the same image (by content hash) is only sent to the model once."""
+    img_bytes = Path(img_path).read_bytes()
+    cached = _cached_extraction([img_bytes])
+    if cached is not None:
+        IMAGE_EXTRACTIONS.inc(result="hit")
+        return cached
+    IMAGE_EXTRACTIONS.inc(result="miss")
+    code_text, model = _extract_code(img_bytes, _guess_mime_type(img_path))
+    # Keyed on the model that answered, as reviews are (CodeReviewResult.model)
+    store_image_extraction(_extraction_key([img_bytes], model), code_text)
+    return code_text
+
+
+def _normalize_line(line: str) -> str:
+    return "".join(line.split())
+
+
+def stitch_fragments(fragments: List[str]) -> str:
+    """
+    Joins code extracted from consecutive screenshots. Each fragment drops
+    its longest leading run of lines (up to STITCH_MAX_OVERLAP_LINES) that
+    repeats the end of the code so far; lines are compared ignoring
+    whitespace, and an overlap of blank lines only is kept.
+    """
+    lines: List[str] = []
+    for fragment in fragments:
+        new = fragment.splitlines()
+        limit = min(len(lines), len(new), STITCH_MAX_OVERLAP_LINES)
+        tail = [_normalize_line(line) for line in lines[len(lines) - limit:]]
+        head = [_normalize_line(line) for line in new[:limit]]
+        overlap = next((k for k in range(limit, 0, -1) if tail[limit - k:] == head[:k] and any(head[:k])), 0)
+        lines.extend(new[overlap:])
+    return "\n".join(lines)
+
+
+# --- FUSED EXTRACT + REVIEW ---
+FUSED_IMAGE_INSTRUCTION = """
+The code to review is in the attached image(s), not in text. When there are
+several, they are consecutive screenshots of one file in reading order.
+
+Start the JSON object with one more field, "extracted_code": the code transcribed
+exactly (indentation preserved, lines shown on two screenshots written once,
+unreadable lines marked [UNREADABLE]). Review that code: issue line numbers
+refer to lines of extracted_code and improved_code rewrites it.
+"""
+
+IMAGE_REVIEWS = counter(
+    "image_reviews_total", "Image code reviews by pipeline and outcome.", ("mode", "outcome"))
+
+
+class FusedReplyError(Exception):
+    pass
+
+
+def _fused_review(user_id: str, img_paths: List[str]) -> CodeReviewResult:
+    """
+    Extraction and review in a single model request. Raises FusedReplyError
+    if the reply can't be used (the caller falls back to two steps) and
+    HTTPException(429) when the quota is exhausted.
+    """
+    images = [Path(img_path).read_bytes() for img_path in img_paths]
+    parts = [types.Part.from_bytes(data=img_bytes, mime_type=_guess_mime_type(img_path))
+             for img_bytes, img_path in zip(images, img_paths)]
+    try:
+        parsed, _, model = generate_structured(parts + [CODE_REVIEW_SYSTEM_PROMPT, FUSED_IMAGE_INSTRUCTION],
+                                               ImageReviewOutput, call="image_review", model_name=MODEL)
+    except genai_errors.APIError as e:
+        if is_resource_exhausted(e):
+            raise HTTPException(status_code=429, detail="AI Quota exhausted. Please try again later.")
+        raise FusedReplyError(f"fused request failed: {e}")
+    except ValueError as e:
+        raise FusedReplyError(str(e))
+    code_text = _extract_code_from_markdown(parsed.pop("extracted_code"))
     if not code_text.strip():
-        logging.error("No code extracted from Gemini response.")
-        return {"error": "No code extracted from image", "raw": raw_text[:500]}
+        raise FusedReplyError("reply has no extracted_code")
 
-    # --- 4. Run existing code review pipeline (Assuming 'code_review' uses a different model/call) ---
+    # The transcription is as good as a two-step extraction of the same images
+    store_image_extraction(_extraction_key(images, model), code_text)
+    analysis = analyze_code(code_text, None)
+    tokens = estimate_tokens(code_text)
     try:
-        review_payload = code_review(user_id,code_text)
-        review_obj = CodeReviewResult(**review_payload)
-    except Exception:
-        # ... (fallback review object creation remains the same) ...
-        logging.exception("Code review validation failed; creating fallback review.")
-        summary = Summary(issueCount=0, criticalCount=0, warningCount=0)
-        review_obj = CodeReviewResult(
-            summary=summary,
-            issues=[],
-            codeLength=len(code_text),
-            codeLanguage="unknown",
-            suggestions=[],
-            issuesFound=0,
-            raw_code=code_text,
-            user_id="",
-        )
-    
-    # --- 5. Finalize and Cache Result ---
-    # Convert CodeReviewResult to the final ImageReview dict format (assuming ImageReview is the final type)
+        return _build_result(parsed, code_text, None, user_id,
+                             MinimizedCode(text=code_text, tokens_before=tokens, tokens_after=tokens), analysis.issues,
+                             model)
+    except (TypeError, ValueError) as e:
+        raise FusedReplyError(f"reply is not a review: {e}")
+
+
+def _transcribed(img_paths: List[str]) -> bool:
+    images = [Path(img_path).read_bytes() for img_path in img_paths]
+    if _cached_extraction(images) is not None:
+        return True
+    return all(_cached_extraction([img_bytes]) is not None for img_bytes in images)
+
+
+def _two_step_review(user_id: str, img_paths: List[str]) -> CodeReviewResult:
+    images = [Path(img_path).read_bytes() for img_path in img_paths]
+    if len(images) > 1:
+        # A fused review of the same screenshots stored their transcription as a whole
+        cached = _cached_extraction(images)
+        if cached is not None:
+            IMAGE_EXTRACTIONS.inc(result="hit")
+            return code_review(code=cached, user_id=user_id)
+    with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_EXTRACT_WORKERS, len(img_paths)))) as pool:
+        fragments = list(pool.map(propagate(extract_code), img_paths))
+    return code_review(code=stitch_fragments(fragments), user_id=user_id)
+
+
+# --- MAIN FUNCTION ---
+def img_code_many(user_id: str, img_paths: List[str], mode: str | None = None) -> Dict[str, Any]:
+    """
+    Screenshots of one file (in order) -> ImageReview dict (or {"error": ...}).
+    Fused mode makes one model request for extraction and review; images
+    whose extraction is cached, and fused replies without usable code, take
+    the two-step path: extract each concurrently, stitch, one code review.
+    """
+    mode = mode or IMAGE_REVIEW_MODE
+    if mode == "fused" and _transcribed(img_paths):
+        # These images were transcribed before: a text-only review is cheaper than resending them
+        mode = "two_step"
+
+    review_obj = None
+    try:
+        if mode == "fused":
+            try:
+                review_obj = _fused_review(user_id, img_paths)
+                IMAGE_REVIEWS.inc(mode="fused", outcome="ok")
+            except FusedReplyError as e:
+                IMAGE_REVIEWS.inc(mode="fused", outcome="fallback")
+                logging.warning("Fused image review unusable, falling back to two steps: %s", e)
+        if review_obj is None:
+            review_obj = _two_step_review(user_id, img_paths)
+            IMAGE_REVIEWS.inc(mode="two_step", outcome="ok")
+    except ExtractionError as e:
+        IMAGE_REVIEWS.inc(mode="two_step", outcome="error")
+        return {"error": str(e)}
+    except HTTPException:
+        # Quota (429) and failed reviews (502) keep their status; never cache an empty review
+        IMAGE_REVIEWS.inc(mode=mode, outcome="error")
+        raise
+
+    # Convert CodeReviewResult to the final ImageReview dict format
     final_review_dict = ImageReview(
-        # Assuming ImageReview is a wrapper around the code review result
         review=review_obj,
-        image_path=img_path,
+        image_path=img_paths[0],
+        image_paths=img_paths,
     ).dict()
 
-    # store_to_cache(img_hash, final_review_dict) # Conceptual: Store the final result
+    return final_review_dict
 
-    return final_review_dict
\ No newline at end of file
+
+def img_code(user_id: str, img_path: str, mode: str | None = None) -> Dict[str, Any]:
+    """
+    Extract code from image -> run code review -> ImageReview dict.
+    """
+    return img_code_many(user_id, [img_path], mode)
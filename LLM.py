@@ -1,26 +1,43 @@
 from datetime import datetime
 import logging
-import uuid
-import dotenv
 from fastapi import HTTPException
-import json
-from Gemini import _call_gemini_with_retries
-from Models import CodeReviewResult, GitHubReviewCache
-from Database import get_cached_review, store_github_review, store_review
+from Gemini import generate_structured
+from Models import CodeReviewResult, DiffReviewOutput, Issue, ReviewOutput
 from typing import Any, Dict, List
-from pathlib import Path
-from google import genai
-from google.genai import types
+from pathlib import PurePosixPath
 import os
 from dotenv import load_dotenv
 
 from github import get_file_content, get_latest_commit_sha, parseUrl
+from metrics import REVIEW_EDITS, REVIEW_GENERATION_SECONDS, REVIEW_OUTPUT_TOKENS
+from model_router import route
+from patching import apply_minimized_edits, unified_diff
+from prompt_budget import OMITTED_MARKER, MinimizedCode, estimate_tokens, minimize_code
+from review_cache import body_id_for, cache_github_review, link_github_review, lookup_github_review, review_scope
+from singleflight import review_key, single_flight
+from static_analysis import STATIC_FAST_PATH, analyze_code, merge_issues
 
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# full: the model rewrites the file into improved_code. diff: it returns
+# find/replace edits, applied locally and returned as a unified diff
+REVIEW_OUTPUT_MODE = os.getenv("REVIEW_OUTPUT_MODE", "full").strip().lower()
+
+# Repository files are reviewed with the language implied by their extension,
+# on every path that shares the GitHub review cache (single, batch, pre-warm)
+EXTENSION_LANGUAGES = {
+    ".py": "python", ".js": "javascript", ".jsx": "javascript", ".ts": "typescript", ".tsx": "typescript",
+    ".java": "java", ".kt": "kotlin", ".go": "go", ".rs": "rust", ".rb": "ruby", ".php": "php",
+    ".c": "c", ".h": "c", ".cpp": "cpp", ".cc": "cpp", ".hpp": "cpp", ".cs": "csharp", ".swift": "swift",
+    ".dart": "dart", ".scala": "scala", ".sh": "shell", ".yml": "yaml", ".yaml": "yaml", ".toml": "toml",
+    ".json": "json", ".jsonc": "jsonc", ".md": "markdown", ".html": "html", ".css": "css", ".sql": "sql",
+}
+
+
+def language_for(path: str) -> str | None:
+    return EXTENSION_LANGUAGES.get(PurePosixPath(path).suffix.lower())
 
 
 
@@ -57,7 +74,7 @@ with ALL fields present:
   "codeLanguage": "if not given decide otherwise string",
   "suggestions": ["list", "of", "general", "suggestions"],
   "issuesFound": number,
-  "improved_code": "string",
+  "improved_code": "string"
 }
 
 Rules:
@@ -66,14 +83,32 @@ Rules:
 - Do NOT include any text before or after the JSON.
 """
 
+CODE_REVIEW_DIFF_SYSTEM_PROMPT = CODE_REVIEW_SYSTEM_PROMPT.replace(
+    '  "improved_code": "string"\n',
+    '  "edits": [{"find": "exact snippet copied from the code", "replace": "what it becomes"}]\n',
+) + """
+Edits:
+- Do NOT rewrite the whole file; express every change to the code as an edit.
+- "find" must be whole lines copied verbatim from the code (indentation included)
+  and must occur exactly once; add a neighbouring line if needed to make it unique.
+- Keep edits small and never include the omitted-region marker lines.
+"""
 
 
 
+
+def _line_number(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
 def _normalize_issue(raw: Dict[str, Any], idx: int) -> Dict[str, Any]:
     """Ensure each issue is a dict with required keys and sensible defaults."""
     return {
         "id": str(raw.get("id") or str(idx + 1)),
-        "line": str(raw.get("line") or "0"),  # STRING for Flutter
+        "line": _line_number(raw.get("line")),
         "severity": str(raw.get("severity") or "info"),
         "category": str(raw.get("category") or "other"),
         "title": str(raw.get("title") or "Issue"),
@@ -104,67 +139,152 @@ def _normalize_payload(data: Dict[str, Any], code: str, language: str | None, us
         "issues": issues,
         "suggestions": data.get("suggestions") or [],
         "improved_code": data.get("improved_code") or "",
+        "improved_diff": data.get("improved_diff"),
         "created_at": datetime.utcnow()
     }
 
-def code_review(code: str, user_id: str, language: str | None = None) -> dict:
-    user_prompt = f"Code language: {language or 'auto'}\n\nCode:\n```{code}```"
+def code_review(code: str, user_id: str, language: str | None = None, output: str | None = None) -> CodeReviewResult:
+    # Empty or tiny unparseable code is fully answered by local analysis
+    analysis = analyze_code(code, language)
+    if analysis.trivial:
+        STATIC_FAST_PATH.inc(reason=analysis.reason)
+        nothing_sent = MinimizedCode(text="", tokens_before=estimate_tokens(code), tokens_after=0)
+        parsed = {"codeLanguage": analysis.language, "suggestions": analysis.suggestions}
+        return _build_result(parsed, code, language, user_id, nothing_sent, analysis.issues)
+
+    minimized = minimize_code(code, language)
+    user_prompt = (
+        f"Code language: {language or 'auto'}\n"
+        f"Markers starting with '{OMITTED_MARKER}' replace regions removed before review; do not report issues on them "
+        f"and copy each marker line unchanged into improved_code.\n\n"
+        f"Code:\n```{minimized.text}```"
+    )
+
+    mode = output or REVIEW_OUTPUT_MODE
+    system_prompt = CODE_REVIEW_DIFF_SYSTEM_PROMPT if mode == "diff" else CODE_REVIEW_SYSTEM_PROMPT
 
     try:
-        # Call with your retry logic
-        response = _call_gemini_with_retries([CODE_REVIEW_SYSTEM_PROMPT, user_prompt])
-        raw_text = response.text if response.text else "{}"
-        parsed = json.loads(raw_text)
-    except (json.JSONDecodeError, Exception) as e:
+        # Schema-constrained reply; only portions that fail validation are requested again
+        with REVIEW_GENERATION_SECONDS.time(mode=mode):
+            parsed, output_tokens, model = generate_structured(
+                [system_prompt, user_prompt], DiffReviewOutput if mode == "diff" else ReviewOutput,
+                model_name=route(code))
+        if output_tokens:
+            REVIEW_OUTPUT_TOKENS.observe(output_tokens, mode=mode)
+        if mode == "diff":
+            parsed = _apply_model_edits(parsed, code, minimized)
+    except Exception as e:
         if "429" in str(e):
             raise HTTPException(status_code=429, detail="AI Quota exhausted. Please try again later.")
         logging.error(f"AI Review Error: {e}")
-        parsed = {} # Fallback to empty if AI fails
+        # No empty fallback: an empty review would be coalesced to every
+        # waiting request and cached as if it were real
+        raise HTTPException(status_code=502, detail="AI review failed. Please try again.")
+
+    return _build_result(parsed, code, language, user_id, minimized, analysis.issues, model)
+
+
+def _apply_model_edits(parsed: Dict[str, Any], code: str, minimized: MinimizedCode) -> Dict[str, Any]:
+    """Diff mode: applies the model's edits (made to the minimized code) to the submitted code and keeps only the diff."""
+    patched, applied, rejected = apply_minimized_edits(code, minimized, parsed.get("edits") or [])
+    REVIEW_EDITS.inc(applied, outcome="applied")
+    REVIEW_EDITS.inc(rejected, outcome="rejected")
+    parsed = {k: v for k, v in parsed.items() if k not in ("edits", "improved_code")}
+    parsed["improved_diff"] = unified_diff(code, patched)
+    return parsed
+
+
+def _build_result(parsed: Dict[str, Any], code: str, language: str | None, user_id: str,
+                  minimized: MinimizedCode, local_issues: List[Issue] | None = None,
+                  model: str | None = None) -> CodeReviewResult:
+    # Model line numbers refer to the minimized code; map them back before merging local findings
+    parsed = dict(parsed)
+    model_issues = [
+        dict(issue, line=minimized.original_line(issue.get("line")))
+        for issue in parsed.get("issues") or [] if isinstance(issue, dict)
+    ]
+    parsed["issues"] = merge_issues(model_issues, local_issues or [], language or parsed.get("codeLanguage"))
+
+    # improved_code is a rewrite of the minimized text: put the omitted regions
+    # back, or drop it rather than return a file with code missing
+    if parsed.get("improved_code") and minimized.omitted:
+        parsed["improved_code"] = minimized.expand(str(parsed["improved_code"])) or ""
 
     # Normalize including the user context
     final_payload = _normalize_payload(parsed, code, language, user_id)
+    final_payload["promptTokensBefore"] = minimized.tokens_before
+    final_payload["promptTokensAfter"] = minimized.tokens_after
+    final_payload["model"] = model
 
-    
-    from fastapi.encoders import jsonable_encoder
+    # The only validation pass: storage and the response reuse this model as-is
+    return CodeReviewResult.model_validate(final_payload)
 
-    return jsonable_encoder(final_payload)
 
 
+def coalesced_code_review(code: str, user_id: str, language: str | None = None,
+                          output: str | None = None) -> tuple[CodeReviewResult, bool]:
+    """
+    code_review, but concurrent identical submissions (double-submits) share
+    one Gemini call. Returns `(result, shared)`; only the caller with
+    shared=False should persist the result.
+    """
+    key = review_key("code", user_id, language or "", output or REVIEW_OUTPUT_MODE, route(code), code)
+    return single_flight.do(
+        key,
+        lambda: code_review(code, user_id, language, output),
+        kind="code",
+        to_doc=lambda review: review.model_dump(),
+        from_doc=CodeReviewResult.model_validate,
+    )
 
-def get_code_review(url: str, file_path: str, user_id: str):
-    
+
+def find_code_review(url: str, file_path: str, user_id: str) -> tuple[dict | None, tuple[str, str, str]]:
+    """
+    The user's cached review of the file at its latest commit (None on a
+    miss), and the `(owner, repo, commit_sha)` a miss is reviewed at with
+    `coalesced_github_review`.
+    """
     owner, repo = parseUrl(url)
     
     commit_sha = get_latest_commit_sha(owner, repo, file_path)
     
-    cached = get_cached_review(user_id, repo, file_path, commit_sha)
+    cached = lookup_github_review(user_id, owner, repo, file_path, commit_sha)
     if cached:
         print(f"✨ Cache Hit for {file_path}")
-        return {
-            "review_id": cached.review_id,
-            "result": cached.result,
-            "status": "cached"
-        }
-    
-    print(f"🤖 Cache Miss. Requesting Gemini review for {file_path}...")
-    
-    content = get_file_content(owner, repo, file_path)
-    review_result = code_review(content, user_id, language=None)
-    
-    new_review_id = str(uuid.uuid4())
-    review_cache = GitHubReviewCache(
-        user_id=user_id,
-        repo=repo,
-        file_path=file_path,
-        commit_sha=commit_sha,
-        result=review_result,
-        review_id=new_review_id
+    else:
+        print(f"🤖 Cache Miss. Requesting Gemini review for {file_path}...")
+    return cached, (owner, repo, commit_sha)
+
+
+def coalesced_github_review(owner: str, repo: str, file_path: str, commit_sha: str, user_id: str):
+    """Reviews and caches a file after a cache miss, sharing the work with identical in-flight misses."""
+    # Identical misses share one Gemini call: across users for public repos,
+    # per user for private ones (the scope is part of the key)
+    scope = review_scope(user_id, owner, repo)
+    review, shared = single_flight.do(
+        github_review_key(scope, owner, repo, file_path, commit_sha),
+        lambda: review_github_file(owner, repo, file_path, commit_sha, user_id),
+        kind="github",
     )
-    
-    store_github_review(review_cache)
-    
-    return {
-        "review_id": new_review_id,
-        "result": review_result,
-        "status": "new"
-    }
\ No newline at end of file
+    if shared:
+        return link_shared_github_review(scope, user_id, owner, repo, file_path, commit_sha, review)
+    return review
+
+
+def github_review_key(scope: str, owner: str, repo: str, file_path: str, commit_sha: str) -> str:
+    return review_key("github", scope, owner, repo, file_path, commit_sha)
+
+
+def link_shared_github_review(scope: str, user_id: str, owner: str, repo: str, file_path: str,
+                              commit_sha: str, review: dict) -> dict:
+    """Links a review another caller produced under the same single-flight key into this user's cache."""
+    body_id = body_id_for(scope, owner, repo, file_path, commit_sha, review["result"].get("model"))
+    return link_github_review(user_id, owner, repo, file_path, commit_sha, body_id, review["result"], "new")
+
+
+def review_github_file(owner: str, repo: str, file_path: str, commit_sha: str, user_id: str,
+                       content: str | None = None):
+    if content is None:
+        content = get_file_content(owner, repo, file_path)
+    review = code_review(content, user_id, language=language_for(file_path))
+    return cache_github_review(user_id, owner, repo, file_path, commit_sha, review)
@@ -1,6 +1,6 @@
 from symtable import Class
-from pydantic import BaseModel, Field, EmailStr
-from typing import Any, Optional, List
+from pydantic import BaseModel, Field, EmailStr, create_model
+from typing import Any, Literal, Optional, List
 from datetime import datetime
 from bson import ObjectId
 from pydantic import ConfigDict
@@ -39,12 +39,21 @@ class UserOut(BaseModel):
 class CodeReviewRequest(BaseModel):
     code: str
     language: str | None = None
+    output: Literal["full", "diff"] | None = None   # None: REVIEW_OUTPUT_MODE
+
+class ImprovedCodeRequest(BaseModel):
+    raw_code: str
+    improved_diff: str
+
+SEVERITIES = ["critical", "warning", "info"]
+CATEGORIES = ["bug", "security", "performance", "style", "maintainability", "other"]
 
 class Issue(BaseModel):
     id: str
     line: int
-    severity: str
-    category: str
+    # The enums only constrain what Gemini may write (response_schema); stored values stay free-form
+    severity: str = Field(..., json_schema_extra={"enum": SEVERITIES})
+    category: str = Field(..., json_schema_extra={"enum": CATEGORIES})
     title: str
     explanation: str
     suggestedFix: str
@@ -65,14 +74,55 @@ class CodeReviewResult(BaseModel):
     raw_code: str
     user_id: str
     improved_code: Optional[str] = None
+    improved_diff: Optional[str] = None       # diff mode: unified diff against raw_code instead of improved_code
+    promptTokensBefore: Optional[int] = None  # local estimate of the code as submitted
+    promptTokensAfter: Optional[int] = None   # local estimate of what was actually sent
+    model: Optional[str] = None               # Gemini model that wrote the review (None: answered locally)
     
     model_config = ConfigDict(
         populate_by_name=True, # This allows you to pass 'issues_found' or 'issuesFound'
         from_attributes=True
     )
 
+# --- What Gemini writes (response_schema); the server fills in the rest of CodeReviewResult ---
+
+def output_model(name: str, base: type[BaseModel], fields: tuple[str, ...], **extra) -> type[BaseModel]:
+    """`fields` of `base` with the same types, plus `extra` name=type fields; all required."""
+    definitions = {field: (base.model_fields[field].annotation, ...) for field in fields}
+    definitions.update({field: (annotation, ...) for field, annotation in extra.items()})
+    return create_model(name, **definitions)
+
+class ReviewEdit(BaseModel):
+    find: str
+    replace: str
+
+REVIEW_OUTPUT_FIELDS = ("summary", "issues", "codeLanguage", "suggestions")
+ReviewOutput = output_model("ReviewOutput", CodeReviewResult, REVIEW_OUTPUT_FIELDS, improved_code=str)
+DiffReviewOutput = output_model("DiffReviewOutput", CodeReviewResult, REVIEW_OUTPUT_FIELDS, edits=List[ReviewEdit])
+# Transcription first: the review refers to its lines
+ImageReviewOutput = create_model("ImageReviewOutput", extracted_code=(str, ...),
+                                 **{name: (field.annotation, ...) for name, field in ReviewOutput.model_fields.items()})
+BatchFileOutput = output_model("BatchFileOutput", CodeReviewResult, ("codeLanguage", "suggestions"),
+                               path=str, improved_code=str)
+BatchIssueOutput = output_model("BatchIssueOutput", Issue, tuple(Issue.model_fields), file=str)
+BatchReviewOutput = output_model("BatchReviewOutput", CodeReviewResult, (),
+                                 files=List[BatchFileOutput], issues=List[BatchIssueOutput])
+
+class GitHubReviewResponse(BaseModel):
+    review_id: str
+    result: CodeReviewResult
+    status: str
+
+class GitHubBatchReviewRequest(BaseModel):
+    url: str
+    file_paths: List[str] = Field(..., min_length=1, max_length=100)
+
+class GitHubFileReviewResponse(GitHubReviewResponse):
+    file_path: str
+
 class ImageReview(BaseModel):
     image_path: str
+    image_paths: list[str] = Field(default_factory=list)
     review: CodeReviewResult | None = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -105,9 +155,12 @@ class RefreshRequest(BaseModel):
 
 class GitHubReviewCache(BaseModel):
     user_id: str
+    owner: Optional[str] = None
     repo: str
     file_path: str
     commit_sha: str
     review_id : str = Field(default_factory=lambda: str(uuid.uuid4()))
-    result : Any
+    body_id: Optional[str] = None   # shared review body in github_review_bodies
+    model: Optional[str] = None     # Gemini model that wrote the review
+    result : Any = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
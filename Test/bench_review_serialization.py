@@ -0,0 +1,97 @@
+"""
+Per-request CPU and allocation cost of building, storing and serializing a
+review for a ~2,000-line file, comparing the old dict pipeline
+(jsonable_encoder -> response_model validation -> CodeReviewResult(**).dict()
+in store_review) with the single-validation pipeline (model_validate once,
+model_dump for storage, model_dump_json for the response).
+
+    python Test/bench_review_serialization.py [--lines 2000] [--iterations 50]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.encoders import jsonable_encoder
+
+from Models import CodeReviewResult
+from fakes import SAMPLE_CODE, SAMPLE_REVIEW
+
+
+def build_payload(lines: int) -> dict:
+    code = (SAMPLE_CODE * (lines // SAMPLE_CODE.count("\n") + 1))
+    code = "\n".join(code.splitlines()[:lines])
+    issues = [dict(SAMPLE_REVIEW["issues"][0], id=str(i), line=str(i * 10 + 1)) for i in range(40)]
+    return {
+        "user_id": "bench-user",
+        "raw_code": code,
+        "codeLanguage": "python",
+        "codeLength": len(code),
+        "issuesFound": len(issues),
+        "summary": {"issueCount": len(issues), "criticalCount": 0, "warningCount": len(issues)},
+        "issues": issues,
+        "suggestions": SAMPLE_REVIEW["suggestions"],
+        "improved_code": code,
+        "created_at": datetime.datetime(2025, 1, 1),
+    }
+
+
+def old_pipeline(payload: dict):
+    encoded = jsonable_encoder(payload)                                # code_review
+    response = CodeReviewResult.model_validate(encoded)                # response_model
+    body = json.dumps(jsonable_encoder(response, by_alias=True)).encode()
+    stored = CodeReviewResult(**encoded).dict()                        # store_review
+    return body, stored
+
+
+def new_pipeline(payload: dict):
+    review = CodeReviewResult.model_validate(payload)                  # code_review
+    body = review.model_dump_json(by_alias=True).encode()              # model_response
+    stored = review.model_dump()                                       # store_review
+    return body, stored
+
+
+def measure(fn, payload: dict, iterations: int) -> dict:
+    fn(payload)  # warm up
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        fn(payload)
+    cpu = (time.process_time() - start_cpu) / iterations
+    wall = (time.perf_counter() - start_wall) / iterations
+
+    tracemalloc.start()
+    fn(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_ms": round(cpu * 1000, 3), "wall_ms": round(wall * 1000, 3), "peak_alloc_kb": round(peak / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)  # .dict() in the old pipeline
+
+    payload = build_payload(args.lines)
+    old_body, _ = old_pipeline(payload)
+    new_body, _ = new_pipeline(payload)
+    assert json.loads(old_body) == json.loads(new_body), "pipelines disagree on the response body"
+
+    results = {
+        "lines": args.lines,
+        "raw_code_bytes": len(payload["raw_code"]),
+        "old": measure(old_pipeline, payload, args.iterations),
+        "new": measure(new_pipeline, payload, args.iterations),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Offline stand-ins for the services the backend talks to, so the app can be
+driven in-process without network access or API keys:
+
+- FakeGemini: an LLMBackend with configurable latency and 429s
+- FakeGitHub: a local HTTP server speaking the few GitHub REST routes we use
+- use_mongomock(): swaps pymongo's MongoClient for mongomock (no mongod needed)
+
+Call `prepare_environment()` BEFORE importing any app module: Database,
+github and Gemini read their configuration at import time.
+"""
+import base64
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm_backend import LLMBackend, set_backend
+
+
+SAMPLE_CODE = '''def add(a, b):
+    return a + b
+
+
+def divide(a, b):
+    return a / b
+'''
+
+SAMPLE_REVIEW = {
+    "summary": {"issueCount": 1, "criticalCount": 0, "warningCount": 1},
+    "issues": [{
+        "id": "1",
+        "line": 5,
+        "severity": "warning",
+        "category": "bug",
+        "title": "Possible division by zero",
+        "explanation": "`divide` does not guard against b == 0.",
+        "suggestedFix": "if b == 0:\n    raise ValueError('b must be non-zero')",
+    }],
+    "codeLength": len(SAMPLE_CODE),
+    "codeLanguage": "python",
+    "suggestions": ["Add type hints"],
+    "issuesFound": 1,
+    "improved_code": SAMPLE_CODE,
+}
+
+# 1x1 transparent PNG; Image_LLM only forwards the bytes, it never decodes them
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+def _quota_error():
+    from google.genai import errors as genai_errors
+    body = {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}}
+    return genai_errors.ClientError(429, SimpleNamespace(body_segments=[body]))
+
+
+def _schema_reply(fields: list[str], contents: list) -> dict:
+    if "files" in fields:
+        # Packed batch: one entry per "=== FILE: path (...)" header, every issue of SAMPLE_REVIEW in each
+        prompt = "\n".join(part for part in contents if isinstance(part, str))
+        paths = re.findall(r"^=== FILE: (.+?) \(language:", prompt, re.MULTILINE)
+        return {
+            "files": [{"path": path, "codeLanguage": SAMPLE_REVIEW["codeLanguage"],
+                       "suggestions": SAMPLE_REVIEW["suggestions"], "improved_code": SAMPLE_CODE} for path in paths],
+            "issues": [dict(issue, file=path) for path in paths for issue in SAMPLE_REVIEW["issues"]],
+        }
+    sample = dict(SAMPLE_REVIEW, edits=[], extracted_code=SAMPLE_CODE)
+    return {field: sample[field] for field in fields if field in sample}
+
+
+class FakeGemini(LLMBackend):
+    """
+    Synthetic LLM backend. Requests with a response_schema get a JSON reply
+    holding exactly the schema's top-level fields (reviews, fused image
+    reviews, packed batches, partial retries); other image requests get a
+    markdown code block (extraction). Latency is gaussian around `latency` seconds, and
+    `rate_limit_ratio` of the calls fail with a 429 RESOURCE_EXHAUSTED, as do
+    all calls to a model in `exhausted_models`. `model_calls` counts calls per model.
+    """
+
+    def __init__(self, latency: float = 0.8, jitter: float = 0.2, rate_limit_ratio: float = 0.0, seed: int | None = None,
+                 exhausted_models: tuple[str, ...] = ()):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.exhausted_models = set(exhausted_models)
+        self.calls = 0
+        self.model_calls: dict[str, int] = {}
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, model=None, contents=None, config=None):
+        with self._lock:
+            self.calls += 1
+            self.model_calls[model] = self.model_calls.get(model, 0) + 1
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter))
+            limited = self._random.random() < self.rate_limit_ratio or model in self.exhausted_models
+            if limited:
+                self.rate_limited += 1
+        time.sleep(delay)
+        if limited:
+            raise _quota_error()
+
+        contents = contents if isinstance(contents, list) else [contents]
+        has_image = any(getattr(part, "inline_data", None) is not None for part in contents)
+        schema = getattr(config, "response_schema", None)
+        if schema is None:
+            text = f"```python\n{SAMPLE_CODE}```" if has_image else json.dumps(SAMPLE_REVIEW)
+        else:
+            text = json.dumps(_schema_reply(list(schema.properties), contents))
+
+        prompt_chars = sum(len(part) for part in contents if isinstance(part, str))
+        prompt_tokens = prompt_chars // 4 + (258 if has_image else 0)
+        output_tokens = len(text) // 4
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+
+def install_fake_gemini(fake: LLMBackend):
+    """Makes `fake` the active LLM backend for every Gemini call site."""
+    set_backend(fake)
+
+
+class _GitHubHandler(BaseHTTPRequestHandler):
+    server_version = "FakeGitHub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload):
+        fake = self.server.fake
+        token = self.headers.get("Authorization", "")
+        with fake.lock:
+            fake.requests += 1
+            fake.token_requests[token] = fake.token_requests.get(token, 0) + 1
+            remaining = fake.remaining.get(token, fake.rate_limit)
+            if remaining <= 0:
+                status, payload = 403, {"message": "API rate limit exceeded"}
+            fake.remaining[token] = remaining = max(0, remaining - 1)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", str(fake.rate_limit))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(fake.reset_at))
+        self.send_header("X-RateLimit-Resource", "core")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip("/").split("/")
+        query = parse_qs(parsed.query)
+        if len(parts) < 3 or parts[0] != "repos":
+            return self._send(404, {"message": "Not Found"})
+
+        owner, repo, rest = parts[1], parts[2], parts[3:]
+        files = fake.repos.get(f"{owner}/{repo}")
+        if files is None:
+            return self._send(404, {"message": "Not Found"})
+
+        if not rest:
+            return self._send(200, {"full_name": f"{owner}/{repo}", "default_branch": fake.default_branch,
+                                    "private": f"{owner}/{repo}" in fake.private})
+
+        if rest[0] == "branches":
+            if rest[1:] != [fake.default_branch]:
+                return self._send(404, {"message": "Branch not found"})
+            return self._send(200, {"name": fake.default_branch, "commit": {
+                "sha": fake.head_sha, "commit": {"tree": {"sha": fake.tree_sha("")}}}})
+
+        if rest[:2] == ["git", "trees"]:
+            directory = fake.tree_directory(files, "/".join(rest[2:]))
+            if directory is None:
+                return self._send(404, {"message": "Not Found"})
+            recursive = bool(query.get("recursive"))
+            tree = fake.tree(files, directory, recursive)
+            truncated = recursive and fake.truncate_trees_at is not None and len(tree) > fake.truncate_trees_at
+            if truncated:
+                tree = tree[:fake.truncate_trees_at]
+            with fake.lock:
+                fake.tree_requests += 1
+            return self._send(200, {"sha": fake.tree_sha(directory), "tree": tree, "truncated": truncated})
+
+        if rest[0] == "contents":
+            path = "/".join(rest[1:])
+            if path not in files:
+                return self._send(404, {"message": "Not Found"})
+            content = base64.b64encode(files[path].encode()).decode()
+            return self._send(200, {"path": path, "type": "file", "size": len(files[path]),
+                                    "sha": fake.blob_sha(path), "encoding": "base64", "content": content})
+
+        if rest[0] == "commits":
+            path = query.get("path", [None])[0]
+            if path is not None and path not in files:
+                return self._send(200, [])
+            return self._send(200, [{"sha": fake.head_sha}])
+
+        return self._send(404, {"message": "Not Found"})
+
+
+class FakeGitHub:
+    """
+    Local GitHub REST stand-in. `repos` maps "owner/repo" to {path: content};
+    repos named in `private` report "private": true. Every response carries X-RateLimit-* headers counting
+    down from `rate_limit` per Authorization header (token); a token with none left gets 403s until `reset_at`.
+    Recursive tree listings longer than `truncate_trees_at` entries come back
+    truncated, like GitHub's for very large repos.
+    """
+
+    def __init__(self, repos: dict[str, dict[str, str]] | None = None, latency: float = 0.0,
+                 head_sha: str = "0" * 40, private: set[str] | None = None, default_branch: str = "main",
+                 truncate_trees_at: int | None = None, rate_limit: int = 5000):
+        self.repos = repos or {"bench/repo": {"src/app.py": SAMPLE_CODE, "README.md": "# bench\n"}}
+        self.private = private or set()
+        self.default_branch = default_branch
+        self.truncate_trees_at = truncate_trees_at
+        self.latency = latency
+        self.head_sha = head_sha
+        self.requests = 0
+        self.tree_requests = 0
+        self.rate_limit = rate_limit
+        self.reset_at = int(time.time()) + 3600
+        self.remaining: dict[str, int] = {}
+        self.token_requests: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def blob_sha(path: str) -> str:
+        import hashlib
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    def tree_sha(self, directory: str) -> str:
+        import hashlib
+        return hashlib.sha1(f"tree:{self.head_sha}:{directory}".encode()).hexdigest()
+
+    def tree(self, files: dict[str, str], directory: str, recursive: bool) -> list[dict]:
+        """Git tree entries of `directory` ("" = root), paths relative to it."""
+        base = directory + "/" if directory else ""
+        entries: dict[str, dict] = {}
+        for path, content in files.items():
+            if not path.startswith(base):
+                continue
+            parts = path[len(base):].split("/")
+            dirs = range(1, len(parts)) if recursive else range(1, min(len(parts), 2))
+            for depth in dirs:
+                name = "/".join(parts[:depth])
+                entries.setdefault(name, {"path": name, "type": "tree", "sha": self.tree_sha(base + name)})
+            if recursive or len(parts) == 1:
+                name = "/".join(parts)
+                entries[name] = {"path": name, "type": "blob", "size": len(content), "sha": self.blob_sha(path)}
+        return [entries[name] for name in sorted(entries)]
+
+    def tree_directory(self, files: dict[str, str], sha: str) -> str | None:
+        if sha in (self.head_sha, self.default_branch, self.tree_sha("")):
+            return ""
+        for path in files:
+            parts = path.split("/")
+            for depth in range(1, len(parts)):
+                directory = "/".join(parts[:depth])
+                if self.tree_sha(directory) == sha:
+                    return directory
+        return None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _GitHubHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def use_mongomock():
+    """Replaces pymongo's MongoClient with mongomock before Database imports it."""
+    import mongomock
+    import pymongo
+    import pymongo.mongo_client
+
+    class MongomockClient(mongomock.MongoClient):
+        def __init__(self, *args, **kwargs):
+            # Options mongomock doesn't understand (server_api, event_listeners, ...)
+            super().__init__()
+
+    pymongo.MongoClient = MongomockClient
+    pymongo.mongo_client.MongoClient = MongomockClient
+
+
+def prepare_environment(github: FakeGitHub, mongo_uri: str | None = None, workdir: str | None = None):
+    """
+    Configures env vars for an offline run and chdirs into `workdir` (main.py
+    mounts ./uploads relative to the working directory).
+    """
+    os.environ.setdefault("GEMINI_API_KEY", "offline-fake-key")
+    os.environ.setdefault("OTP_SECRET", "offline-otp-secret")
+    os.environ["GITHUB_API_URL"] = github.url
+    if mongo_uri:
+        os.environ["MONGODB_URI"] = mongo_uri
+    else:
+        os.environ["MONGODB_URI"] = "mongodb://mongomock.invalid:27017"
+        use_mongomock()
+
+    if workdir:
+        os.makedirs(os.path.join(workdir, "uploads"), exist_ok=True)
+        os.chdir(workdir)
@@ -0,0 +1,143 @@
+"""
+Latency and quota benchmark: fused image review (one Gemini request) vs the
+two-step path (extract, then review).
+
+Offline (default) both modes review the same screenshots against FakeGemini,
+whose latency is per request, so the comparison shows what the saved round
+trip is worth at a given model latency:
+
+    python Test/image_review_benchmark.py --runs 20 --images 1
+    python Test/image_review_benchmark.py --runs 20 --images 3 --gemini-latency 2.5
+
+With --live the real Gemini backend (GEMINI_API_KEY) reviews your own
+screenshots; Mongo stays mongomock unless --mongo-uri is given:
+
+    python Test/image_review_benchmark.py --live shot1.png shot2.png --runs 5
+
+The extraction cache is cleared before every review so each one pays for
+its model calls. Reports per mode: p50/p95 latency, Gemini requests and
+tokens per review, and the fused saving.
+
+Needs `mongomock` (see Test/requirements-bench.txt).
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fakes import TINY_PNG, FakeGemini, FakeGitHub, install_fake_gemini, prepare_environment
+from load_benchmark import percentile
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+MODES = ("two_step", "fused")
+
+
+def screenshots(args, workdir: str) -> list[str]:
+    if args.live:
+        return [os.path.abspath(path) for path in args.live]
+    paths = []
+    for i in range(args.images):
+        path = os.path.join(workdir, f"shot{i}.png")
+        with open(path, "wb") as f:
+            # Distinct bytes per screenshot: each has its own extraction
+            f.write(TINY_PNG + bytes([i]))
+        paths.append(path)
+    return paths
+
+
+def gemini_totals(gemini) -> dict:
+    from metrics import GEMINI_TOKENS
+    tokens = {kind: sum(GEMINI_TOKENS.value(model=model, call=call, kind=kind)
+                        for (model, call, k) in list(GEMINI_TOKENS._values) if k == kind)
+              for kind in ("prompt", "output")}
+    return {"requests": gemini.calls if gemini else None, **tokens}
+
+
+def run_mode(mode: str, paths: list[str], runs: int, gemini) -> dict:
+    import Database
+    import Image_LLM
+
+    latencies, errors = [], 0
+    before = gemini_totals(gemini)
+    for _ in range(runs):
+        Database.image_extractions.delete_many({})
+        start = time.perf_counter()
+        try:
+            result = Image_LLM.img_code_many(user_id="bench", img_paths=paths, mode=mode)
+            errors += "error" in result
+        except Exception as e:
+            print(f"{mode}: {e}")
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    after = gemini_totals(gemini)
+
+    latencies.sort()
+    per_review = {key: round((after[key] - before[key]) / runs, 1) if after[key] is not None else None
+                  for key in after}
+    return {
+        "runs": runs,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "gemini_per_review": per_review,
+    }
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="codereview-image-bench-")
+    github = FakeGitHub().start()
+    prepare_environment(github, mongo_uri=args.mongo_uri, workdir=workdir)
+    gemini = None
+    if not args.live:
+        gemini = FakeGemini(latency=args.gemini_latency, jitter=args.gemini_latency / 10, seed=7)
+        install_fake_gemini(gemini)
+
+    paths = screenshots(args, workdir)
+    report = {mode: run_mode(mode, paths, args.runs, gemini) for mode in MODES}
+    github.stop()
+    two_step, fused = report["two_step"]["p50_ms"], report["fused"]["p50_ms"]
+    report["fused_p50_saving_pct"] = round((two_step - fused) / two_step * 100, 1) if two_step else 0.0
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'requests':>10}{'prompt tok':>12}{'output tok':>12}{'err':>5}")
+    for mode in MODES:
+        stats = report[mode]
+        gemini = stats["gemini_per_review"]
+        requests = "-" if gemini["requests"] is None else f"{gemini['requests']:.1f}"
+        print(f"{mode:<10}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{requests:>10}"
+              f"{gemini['prompt']:>12.0f}{gemini['output']:>12.0f}{stats['errors']:>5}")
+    print(f"\nfused p50 is {report['fused_p50_saving_pct']:.1f}% faster than two-step")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="reviews per mode")
+    parser.add_argument("--images", type=int, default=1, help="offline: screenshots per review")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="offline: fake Gemini latency per request (s)")
+    parser.add_argument("--live", nargs="+", default=None, metavar="IMAGE", help="review these images with real Gemini")
+    parser.add_argument("--mongo-uri", default=None, help="use this Mongo instead of mongomock")
+    parser.add_argument("--out", default=None, help="where to write the JSON report")
+    args = parser.parse_args()
+
+    report = {"started_at": datetime.datetime.utcnow().isoformat() + "Z", "config": vars(args), **run(args)}
+    out = os.path.abspath(args.out) if args.out else os.path.join(
+        RESULTS_DIR, f"image_review_{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"\nSaved report to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Cold/warm start benchmark for the Lambda entrypoint (lambda_handler.handler).
+
+By default every cold start is a fresh Python process, the way Lambda starts
+a new container: it sets up the offline fakes (mongomock, FakeGitHub,
+FakeGemini), imports lambda_handler (the init phase), then invokes the
+handler with API Gateway HTTP API (v2) events: the container's first
+request, then --warm more. Reported per first route: init, first request,
+warm p50/p95 and the modules the first request had to import.
+
+    python Test/lambda_cold_start_benchmark.py --cold-starts 5 --warm 20
+    python Test/lambda_cold_start_benchmark.py --compare Test/bench_results/lambda_<old>.json
+
+With --rie the same events are posted to the AWS Lambda Runtime Interface
+Emulator instead (a container image with CMD ["lambda_handler.handler"],
+started with `-p 9000:8080`, its env pointing at a real Mongo that holds
+the bench@example.com / bench-password user). Restart the container for each
+cold sample; the emulator logs the Init Duration itself.
+
+    python Test/lambda_cold_start_benchmark.py --rie http://localhost:9000
+
+Needs `mongomock` (see Test/requirements-bench.txt).
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from load_benchmark import percentile
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+ROUTES = ("login", "profile", "code_review", "github_review")
+_RESULT_PREFIX = "LAMBDA_BENCH_RESULT "
+
+
+def http_event(method: str, path: str, body: dict | None = None, token: str | None = None,
+               query: str = "") -> dict:
+    """API Gateway HTTP API (payload v2.0) event, as Lambda delivers it."""
+    now = datetime.datetime.utcnow()
+    headers = {"host": "bench.lambda-url.local", "content-type": "application/json"}
+    if token:
+        headers["authorization"] = f"Bearer {token}"
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": query,
+        "headers": headers,
+        "requestContext": {
+            "accountId": "123456789012",
+            "apiId": "bench",
+            "domainName": "bench.lambda-url.local",
+            "http": {"method": method, "path": path, "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1",
+                     "userAgent": "lambda-bench"},
+            "requestId": f"bench-{time.perf_counter_ns()}",
+            "stage": "$default",
+            "time": now.strftime("%d/%b/%Y:%H:%M:%S +0000"),
+            "timeEpoch": int(now.timestamp() * 1000),
+        },
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+    }
+
+
+def route_event(route: str, token: str | None, n: int) -> dict:
+    if route == "login":
+        return http_event("POST", "/auth/login", {"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    if route == "profile":
+        return http_event("GET", "/auth/profile", token=token)
+    if route == "code_review":
+        # Distinct code per call so warm invocations are not coalesced or cached
+        code = f"def handler_{n}(event):\n    return event['value'] / {n + 1}\n"
+        return http_event("POST", "/code-review/", {"code": code, "language": "python"}, token=token)
+    if route == "github_review":
+        return http_event("GET", "/github/review", token=token,
+                          query="url=https://github.com/bench/repo&file_path=src/app.py")
+    raise ValueError(route)
+
+
+def summarize(samples_ms: list[float]) -> dict:
+    values = sorted(samples_ms)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "max_ms": round(values[-1], 2) if values else 0.0,
+    }
+
+
+# --- one simulated container (child process) ---
+
+def run_container(route: str, warm: int, gemini_latency: float):
+    from fakes import FakeGemini, FakeGitHub, install_fake_gemini, prepare_environment
+
+    github = FakeGitHub().start()
+    workdir = tempfile.mkdtemp(prefix="codereview-lambda-")
+    prepare_environment(github, workdir=workdir)
+    os.environ["LAMBDA_WORKDIR"] = workdir
+    install_fake_gemini(FakeGemini(latency=gemini_latency, jitter=0))
+
+    before = set(sys.modules)
+    import lambda_handler
+    init_ms = lambda_handler.INIT_SECONDS * 1000
+
+    # Seeding is not part of init; it also opens the (mongomock) client early
+    import auth
+    import Database
+    Database.create_user({"username": "bench", "email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    token = auth.create_access_token({"sub": BENCH_EMAIL}, expires_minutes=15)
+
+    def invoke(n: int) -> tuple[float, int]:
+        start = time.perf_counter()
+        response = lambda_handler.handler(route_event(route, token, n), None)
+        return (time.perf_counter() - start) * 1000, response["statusCode"]
+
+    loaded = set(sys.modules)
+    first_ms, status = invoke(0)
+    lazily_imported = sorted(m for m in set(sys.modules) - loaded if "." not in m and not m.startswith("_"))
+    warm_ms, statuses = [], [status]
+    for n in range(1, warm + 1):
+        elapsed, status = invoke(n)
+        warm_ms.append(elapsed)
+        statuses.append(status)
+
+    github.stop()
+    return {
+        "init_ms": round(init_ms, 2),
+        "init_modules": len(loaded - before),
+        "first_ms": round(first_ms, 2),
+        "warm_ms": warm_ms,
+        "errors": sum(1 for s in statuses if s >= 400),
+        "lazy_imports": lazily_imported,
+    }
+
+
+def cold_start(route: str, warm: int, gemini_latency: float) -> dict:
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", route, "--warm", str(warm),
+         "--gemini-latency", str(gemini_latency)],
+        capture_output=True, text=True, timeout=300,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(_RESULT_PREFIX):
+            return json.loads(line[len(_RESULT_PREFIX):])
+    raise RuntimeError(f"Container run for {route} failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-4000:]}")
+
+
+# --- AWS Lambda Runtime Interface Emulator ---
+
+def rie_invoke(base_url: str, event: dict) -> tuple[float, dict]:
+    request = urllib.request.Request(f"{base_url.rstrip('/')}/2015-03-31/functions/function/invocations",
+                                     data=json.dumps(event).encode(), method="POST")
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as res:
+        payload = json.loads(res.read())
+    return (time.perf_counter() - start) * 1000, payload
+
+
+def run_rie(args) -> dict:
+    _, login = rie_invoke(args.rie, route_event("login", None, 0))
+    if login.get("statusCode") != 200:
+        raise SystemExit(f"Login through the emulator failed: {login}")
+    body = login["body"]
+    token = json.loads(base64.b64decode(body) if login.get("isBase64Encoded") else body)["access_token"]
+    routes = {}
+    for route in args.routes:
+        samples = [rie_invoke(args.rie, route_event(route, token, n)) for n in range(args.warm + 1)]
+        routes[route] = {
+            "first_ms": round(samples[0][0], 2),
+            "warm": summarize([ms for ms, _ in samples[1:]]),
+            "errors": sum(1 for _, payload in samples if payload.get("statusCode", 500) >= 400),
+        }
+    return {"mode": "rie", "routes": routes}
+
+
+def run(args) -> dict:
+    routes = {}
+    for route in args.routes:
+        runs = [cold_start(route, args.warm, args.gemini_latency) for _ in range(args.cold_starts)]
+        routes[route] = {
+            "init": summarize([r["init_ms"] for r in runs]),
+            "first_request": summarize([r["first_ms"] for r in runs]),
+            "warm": summarize([ms for r in runs for ms in r["warm_ms"]]),
+            "errors": sum(r["errors"] for r in runs),
+            "lazy_imports": runs[0]["lazy_imports"],
+        }
+    return {"mode": "emulated", "routes": routes}
+
+
+def print_report(report: dict, baseline: dict | None = None):
+    print(f"{'first route':<15}{'init p50':>10}{'first p50':>11}{'warm p50':>10}{'warm p95':>10}{'err':>5}")
+    for route, stats in report["routes"].items():
+        init = stats.get("init", {}).get("p50_ms")
+        first = stats["first_request"]["p50_ms"] if "first_request" in stats else stats["first_ms"]
+        line = (f"{route:<15}{(f'{init:.1f}' if init is not None else '-'):>10}{first:>11.1f}"
+                f"{stats['warm']['p50_ms']:>10.1f}{stats['warm']['p95_ms']:>10.1f}{stats['errors']:>5}")
+        old = (baseline or {}).get("routes", {}).get(route, {})
+        if init is not None and old.get("init", {}).get("p50_ms"):
+            change = (init - old["init"]["p50_ms"]) / old["init"]["p50_ms"] * 100
+            line += f"   init {change:+.1f}% vs baseline"
+        print(line)
+        if stats.get("lazy_imports"):
+            print(f"{'':<15}first request imported: {', '.join(stats['lazy_imports'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=ROUTES,
+                        help="first request of each simulated container")
+    parser.add_argument("--cold-starts", type=int, default=5, help="fresh containers per route")
+    parser.add_argument("--warm", type=int, default=20, help="warm invocations after the first request")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="fake Gemini latency (s)")
+    parser.add_argument("--rie", default=None, metavar="URL", help="post to a Lambda Runtime Interface Emulator")
+    parser.add_argument("--out", default=None, help="where to write the JSON report")
+    parser.add_argument("--compare", default=None, help="previous JSON report to compare init time against")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_container(args.child, args.warm, args.gemini_latency)
+        print(_RESULT_PREFIX + json.dumps(result), flush=True)
+        return
+
+    out = os.path.abspath(args.out) if args.out else os.path.join(
+        RESULTS_DIR, f"lambda_{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = run_rie(args) if args.rie else run(args)
+    report = {"started_at": datetime.datetime.utcnow().isoformat() + "Z", "config": vars(args), **report}
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report, baseline)
+    print(f"\nSaved report to {out}")
+
+
+if __name__ == "__main__":
+    main()
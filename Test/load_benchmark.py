@@ -0,0 +1,219 @@
+"""
+Offline load/latency benchmark for the FastAPI app.
+
+Runs `main.app` in-process (httpx ASGI transport) against FakeGemini (or
+recorded Gemini traffic via --llm-replay),
+FakeGitHub and mongomock (or a local mongod via --mongo-uri), drives a
+concurrent mixed workload and writes per-endpoint p50/p95/p99 and req/s
+to JSON so runs can be compared:
+
+    python Test/load_benchmark.py --concurrency 16 --requests 400
+    python Test/load_benchmark.py --compare Test/bench_results/load_<old>.json
+
+Needs `httpx` and `mongomock` (see Test/requirements-bench.txt).
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fakes import SAMPLE_CODE, TINY_PNG, FakeGemini, FakeGitHub, install_fake_gemini, prepare_environment
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: list[tuple[float, int]], elapsed: float) -> dict:
+    latencies = sorted(s[0] * 1000 for s in samples)
+    statuses: dict[str, int] = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "count": len(samples),
+        "errors": sum(1 for _, status in samples if status >= 400),
+        "status_counts": statuses,
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def make_code(rng: random.Random) -> str:
+    # Mix of tiny snippets and ~2,000-line files
+    repeat = rng.choice([1, 1, 5, 20, 300])
+    return SAMPLE_CODE * repeat
+
+
+async def run(args) -> dict:
+    import httpx
+
+    github = FakeGitHub(latency=args.github_latency).start()
+    workdir = tempfile.mkdtemp(prefix="codereview-bench-")
+    prepare_environment(github, mongo_uri=args.mongo_uri, workdir=workdir)
+
+    import Database
+    import main
+
+    if args.llm_replay:
+        from llm_backend import ReplayBackend
+        gemini = ReplayBackend(record_dir=args.llm_replay, seed=args.seed)
+    else:
+        gemini = FakeGemini(latency=args.gemini_latency, jitter=args.gemini_jitter,
+                            rate_limit_ratio=args.rate_limit_ratio, seed=args.seed)
+    install_fake_gemini(gemini)
+
+    if not Database.get_user(BENCH_EMAIL):
+        Database.create_user({"username": "bench", "email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        login = await client.post("/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        login.raise_for_status()
+        auth = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        rng = random.Random(args.seed)
+        github_files = list(next(iter(github.repos.values())).keys())
+        repo_url = f"https://github.com/{next(iter(github.repos))}"
+
+        async def do_login():
+            return await client.post("/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+
+        async def do_code_review():
+            return await client.post("/code-review/", headers=auth,
+                                     json={"code": make_code(rng), "language": "python"})
+
+        async def do_github_review():
+            return await client.get("/github/review", headers=auth,
+                                    params={"url": repo_url, "file_path": rng.choice(github_files)})
+
+        async def do_image_review():
+            return await client.post("/image-code-review/", headers=auth,
+                                     files={"photo": ("code.png", TINY_PNG, "image/png")})
+
+        workloads = {
+            "login": do_login,
+            "code_review": do_code_review,
+            "github_review": do_github_review,
+            "image_review": do_image_review,
+        }
+        mix = parse_mix(args.mix)
+        unknown = set(mix) - set(workloads)
+        if unknown:
+            raise SystemExit(f"Unknown workload(s) in --mix: {', '.join(sorted(unknown))}")
+        names = [name for name, weight in mix.items() for _ in range(weight)]
+        plan = [rng.choice(names) for _ in range(args.requests)]
+
+        samples: dict[str, list[tuple[float, int]]] = {name: [] for name in mix}
+        queue: asyncio.Queue = asyncio.Queue()
+        for name in plan:
+            queue.put_nowait(name)
+
+        async def worker():
+            while True:
+                try:
+                    name = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    status = (await workloads[name]()).status_code
+                except Exception:
+                    status = 599
+                samples[name].append((time.perf_counter() - start, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    github.stop()
+    everything = [s for values in samples.values() for s in values]
+    return {
+        "started_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(everything, elapsed),
+        "endpoints": {name: summarize(values, elapsed) for name, values in samples.items() if values},
+        "fakes": {
+            "llm_backend": type(gemini).__name__,
+            "gemini_calls": getattr(gemini, "calls", None),
+            "gemini_rate_limited": getattr(gemini, "rate_limited", None),
+            "github_requests": github.requests,
+        },
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None):
+    print(f"{'endpoint':<16}{'count':>7}{'err':>6}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = dict(report["endpoints"], total=report["total"])
+    for name, stats in rows.items():
+        line = (f"{name:<16}{stats['count']:>7}{stats['errors']:>6}{stats['rps']:>9.1f}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+        old = (baseline or {}).get("endpoints", {}).get(name) if name != "total" else (baseline or {}).get("total")
+        if old and old.get("p95_ms"):
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {change:+.1f}% vs baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="total requests across all workloads")
+    parser.add_argument("--mix", default="login=4,code_review=3,github_review=2,image_review=1")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="mean fake Gemini latency (s)")
+    parser.add_argument("--gemini-jitter", type=float, default=0.2)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.02, help="fraction of Gemini calls answered with 429")
+    parser.add_argument("--llm-replay", default=None, metavar="DIR",
+                        help="serve Gemini from recordings (LLM_BACKEND=record) instead of FakeGemini")
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument("--mongo-uri", default=None, help="use a local mongod instead of mongomock")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default=None, help="where to write the JSON report")
+    parser.add_argument("--compare", default=None, help="previous JSON report to compare p95 against")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out) if args.out else os.path.join(
+        RESULTS_DIR, f"load_{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = asyncio.run(run(args))
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report, baseline)
+    print(f"\nSaved report to {out}")
+
+
+if __name__ == "__main__":
+    main()
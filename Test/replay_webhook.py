@@ -0,0 +1,128 @@
+"""
+Replays a recorded GitHub push delivery against /github/webhook.
+
+Offline (default): runs `main.app` in-process against FakeGitHub serving the
+pushed repo, FakeGemini and mongomock. A user reviews one file of the repo
+(which makes them one of its recent reviewers), the signed push is delivered,
+and once the pre-warm queue is idle every changed file is opened through
+/github/review to check it is served from the cache:
+
+    python Test/replay_webhook.py
+    python Test/replay_webhook.py --payload my_push.json --budget 2
+
+Against a running server, the payload is only signed and posted:
+
+    GITHUB_WEBHOOK_SECRET=... python Test/replay_webhook.py --url http://localhost:5600
+
+Needs `httpx` and `mongomock` (see Test/requirements-bench.txt).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fakes import SAMPLE_CODE, FakeGemini, FakeGitHub, install_fake_gemini, prepare_environment
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "github_push.json")
+REPLAY_EMAIL = "replay@example.com"
+REPLAY_PASSWORD = "replay-password"
+
+
+def sign(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def delivery_headers(body: bytes, secret: str, event: str = "push") -> dict:
+    return {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": event,
+        "X-GitHub-Delivery": "replay-" + hashlib.sha1(body).hexdigest()[:12],
+        "X-Hub-Signature-256": sign(body, secret),
+    }
+
+
+def post_to_server(url: str, body: bytes, secret: str):
+    request = urllib.request.Request(f"{url.rstrip('/')}/github/webhook", data=body,
+                                     headers=delivery_headers(body, secret), method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as res:
+            print(res.status, res.read().decode())
+    except urllib.error.HTTPError as e:
+        print(e.code, e.read().decode())
+
+
+async def replay_offline(payload: dict, body: bytes, args):
+    import httpx
+
+    full_name = payload["repository"]["full_name"]
+    pushed = {path for commit in payload["commits"] for path in commit.get("added", []) + commit.get("modified", [])}
+    # The repo after the push: every touched file plus one untouched file the user reviews first
+    files = {path: SAMPLE_CODE for path in pushed}
+    files["payments/__init__.py"] = "from .refunds import refund\n"
+    github = FakeGitHub(repos={full_name: files}, head_sha=payload["before"]).start()
+
+    os.environ["GITHUB_WEBHOOK_SECRET"] = args.secret
+    os.environ["PREWARM_REPO_BUDGET"] = str(args.budget)
+    prepare_environment(github, workdir=tempfile.mkdtemp(prefix="codereview-webhook-"))
+
+    import Database
+    import github_webhook
+    import main
+    from metrics import GITHUB_REVIEW_CACHE
+
+    gemini = FakeGemini(latency=0.05, jitter=0.0)
+    install_fake_gemini(gemini)
+    Database.create_user({"username": "replay", "email": REPLAY_EMAIL, "password": REPLAY_PASSWORD})
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=120) as client:
+        login = await client.post("/auth/login", json={"email": REPLAY_EMAIL, "password": REPLAY_PASSWORD})
+        auth = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        repo_url = f"https://github.com/{full_name}"
+        await client.get("/github/review", headers=auth, params={"url": repo_url, "file_path": "payments/__init__.py"})
+
+        github.head_sha = payload["after"]
+        calls_before = gemini.calls
+        res = await client.post("/github/webhook", content=body, headers=delivery_headers(body, args.secret))
+        print(f"webhook -> {res.status_code} {res.json()}")
+        await asyncio.to_thread(github_webhook.wait_idle)
+        outcomes = {o: int(github_webhook.PREWARM_REVIEWS.value(outcome=o))
+                    for o in ("reviewed", "cached", "over_budget", "rate_limited", "failed")}
+        print(f"pre-warm made {gemini.calls - calls_before} Gemini call(s); {outcomes}")
+
+        for path in res.json().get("paths", []):
+            misses = GITHUB_REVIEW_CACHE.value(result="miss")
+            review = await client.get("/github/review", headers=auth, params={"url": repo_url, "file_path": path})
+            hit = GITHUB_REVIEW_CACHE.value(result="miss") == misses
+            print(f"  {path:<28} {review.status_code} {'cache hit' if hit else 'MISS'}")
+
+    github.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload", default=FIXTURE, help="recorded push payload (JSON)")
+    parser.add_argument("--secret", default=os.getenv("GITHUB_WEBHOOK_SECRET") or "replay-webhook-secret")
+    parser.add_argument("--url", default=None, help="post to a running server instead of replaying offline")
+    parser.add_argument("--budget", type=int, default=50, help="offline: PREWARM_REPO_BUDGET for the replay")
+    args = parser.parse_args()
+
+    with open(args.payload, "rb") as f:
+        body = f.read()
+    if args.url:
+        post_to_server(args.url, body, args.secret)
+    else:
+        asyncio.run(replay_offline(json.loads(body), body, args))
+
+
+if __name__ == "__main__":
+    main()
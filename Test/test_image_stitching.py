@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import Image_LLM
+from Image_LLM import stitch_fragments
+
+
+def test_shared_lines_are_written_once():
+    assert stitch_fragments(["a = 1\nb = 2\nc = 3", "b = 2\nc = 3\nd = 4"]) == "a = 1\nb = 2\nc = 3\nd = 4"
+
+
+def test_overlap_ignores_whitespace_and_keeps_the_first_transcription():
+    first = "def f():\n    x = 1\n    return x"
+    second = "  x  =  1\t\nreturn x\ny = 2"
+    assert stitch_fragments([first, second]) == "def f():\n    x = 1\n    return x\ny = 2"
+
+
+def test_longest_overlap_wins_over_a_repeated_line():
+    assert stitch_fragments(["x\ny\nx\ny", "x\ny\nz"]) == "x\ny\nx\ny\nz"
+
+
+def test_fragments_without_overlap_are_concatenated():
+    assert stitch_fragments(["a\nb", "c\nd", "e"]) == "a\nb\nc\nd\ne"
+
+
+def test_blank_only_overlap_is_kept():
+    # Blank lines carry no evidence that the screenshots overlap
+    assert stitch_fragments(["a\n\n", "\n\nb"]) == "a\n\n\n\nb"
+
+
+def test_overlap_past_the_limit_is_not_removed(monkeypatch):
+    monkeypatch.setattr(Image_LLM, "STITCH_MAX_OVERLAP_LINES", 2)
+    assert stitch_fragments(["a\nb\nc", "a\nb\nc\nd"]) == "a\nb\nc\na\nb\nc\nd"
+    assert stitch_fragments(["a\nb\nc", "b\nc\nd"]) == "a\nb\nc\nd"
+
+
+def test_single_and_no_fragments():
+    assert stitch_fragments(["only\ncode"]) == "only\ncode"
+    assert stitch_fragments([]) == ""
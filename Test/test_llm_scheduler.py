@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm_scheduler import FairScheduler, LLMQueueFull
+
+
+def _scheduler(**kwargs) -> FairScheduler:
+    return FairScheduler(**{"capacity": 1, "user_capacity": 1, "max_queue": 10, "user_max_queue": 10, **kwargs})
+
+
+async def _hold(scheduler: FairScheduler, user: str, tier: str, release: asyncio.Event, log: list | None = None):
+    async with scheduler.slot(user, tier=tier):
+        if log is not None:
+            log.append(tier)
+        await release.wait()
+
+
+def test_tiers_are_served_in_order():
+    async def scenario():
+        scheduler = _scheduler()
+        order, go = [], asyncio.Event()
+        go.set()
+        async with scheduler.slot("holder"):
+            waiting = [asyncio.create_task(_hold(scheduler, user, tier, go, order))
+                       for user, tier in (("b", "background"), ("c", "batch"), ("d", "interactive"))]
+            await asyncio.sleep(0)
+            assert scheduler.stats()["queued"] == {"interactive": 1, "batch": 1, "background": 1}
+        await asyncio.gather(*waiting)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "batch", "background"]
+
+
+def test_user_cap_leaves_slots_to_others():
+    async def scenario():
+        scheduler = _scheduler(capacity=4, user_capacity=2)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_hold(scheduler, "heavy", "interactive", release)) for _ in range(3)]
+        tasks.append(asyncio.create_task(_hold(scheduler, "light", "interactive", release)))
+        await asyncio.sleep(0)
+        heavy, light = scheduler.stats("heavy"), scheduler.stats("light")
+        release.set()
+        await asyncio.gather(*tasks)
+        return heavy, light, scheduler.stats()
+
+    heavy, light, after = asyncio.run(scenario())
+    assert heavy["running"] == 3
+    assert (heavy["user"]["running"], heavy["user"]["queued"]) == (2, 1)
+    assert (light["user"]["running"], light["user"]["queued"]) == (1, 0)
+    assert after["running"] == 0
+
+
+def test_full_queue_is_refused_with_retry_after():
+    async def scenario():
+        scheduler = _scheduler(max_queue=3, user_max_queue=1)
+        release = asyncio.Event()
+        # "a" runs; "b" and "c" queue
+        tasks = [asyncio.create_task(_hold(scheduler, user, "interactive", release)) for user in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        with pytest.raises(LLMQueueFull) as own_queue:
+            async with scheduler.slot("b"):
+                pass
+        tasks.append(asyncio.create_task(_hold(scheduler, "d", "interactive", release)))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMQueueFull) as full_queue:
+            async with scheduler.slot("e"):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return own_queue.value, full_queue.value
+
+    own_queue, full_queue = asyncio.run(scenario())
+    assert own_queue.status_code == full_queue.status_code == 429
+    assert "You have too many" in own_queue.detail
+    assert "You have too many" not in full_queue.detail
+    assert int(own_queue.headers["Retry-After"]) >= 1 and int(full_queue.headers["Retry-After"]) >= 1
+
+
+def test_cancelled_waiters_give_up_their_place_and_slot():
+    async def scenario():
+        scheduler = _scheduler()
+        release = asyncio.Event()
+        release.set()
+        async with scheduler.slot("holder"):
+            queued = asyncio.create_task(_hold(scheduler, "a", "interactive", release))
+            await asyncio.sleep(0)
+            queued.cancel()
+            await asyncio.gather(queued, return_exceptions=True)
+            withdrawn = scheduler.stats()["queued"]["interactive"]
+
+            granted = asyncio.create_task(_hold(scheduler, "b", "interactive", release))
+            await asyncio.sleep(0)
+        # The slot went to "b" on release, but "b" is cancelled before it runs
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        return withdrawn, scheduler.stats()
+
+    withdrawn, after = asyncio.run(scenario())
+    assert withdrawn == 0
+    assert after["running"] == 0
+    assert sum(after["queued"].values()) == 0
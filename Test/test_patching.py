@@ -0,0 +1,76 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from patching import apply_minimized_edits, apply_unified_diff, unified_diff
+from prompt_budget import OMITTED_MARKER, minimize_code
+
+
+def _edit(find: str, replace: str) -> dict:
+    return {"find": find, "replace": replace}
+
+
+def test_edit_spanning_trailing_whitespace_and_crlf_applies_to_original():
+    code = "def f(x):  \r\n    y = x + 1\t\r\n    return y\r\n"
+    minimized = minimize_code(code, "python")
+
+    patched, applied, rejected = apply_minimized_edits(
+        code, minimized, [_edit("    y = x + 1\n    return y", "    return x + 1")])
+
+    assert (applied, rejected) == (1, 0)
+    # The untouched first line keeps its trailing spaces and CRLF
+    assert patched == "def f(x):  \r\n    return x + 1\r\n"
+    assert apply_unified_diff(code, unified_diff(code, patched)) == patched
+
+
+def test_collapsed_blank_lines_outside_the_edit_are_kept():
+    code = "a = 1\n\n\n\nb = 2   \nc = 3\n"
+    minimized = minimize_code(code, "python")
+
+    patched, applied, _ = apply_minimized_edits(code, minimized, [_edit("b = 2\nc = 3", "b = 20\nc = 30")])
+
+    assert applied == 1
+    assert patched == "a = 1\n\n\n\nb = 20\nc = 30\n"
+
+
+def test_no_trailing_newline_is_preserved():
+    code = "x = 1   \ny = 2"
+    minimized = minimize_code(code, "python")
+
+    patched, applied, _ = apply_minimized_edits(code, minimized, [_edit("y = 2", "y = 3")])
+
+    assert applied == 1
+    assert patched == "x = 1   \ny = 3"
+
+
+def test_omitted_regions_are_restored_around_edits():
+    comments = "".join(f"    # note {n}\n" for n in range(20))
+    code = "def f():\n" + comments + "    return 1  \n"
+    minimized = minimize_code(code, "python")
+    assert OMITTED_MARKER in minimized.text
+
+    patched, applied, _ = apply_minimized_edits(code, minimized, [_edit("    return 1", "    return 2")])
+
+    assert applied == 1
+    assert patched == "def f():\n" + comments + "    return 2\n"
+
+
+def test_edited_line_with_inline_marker_gets_its_tail_back():
+    code = "short = 1\nlong = '" + "x" * 400 + "'\n"
+    minimized = minimize_code(code, "python")
+    assert OMITTED_MARKER in minimized.text.splitlines()[1]
+
+    patched, applied, _ = apply_minimized_edits(code, minimized, [_edit("short = 1\nlong = '", "short = 2\nlong = '")])
+
+    assert applied == 1
+    assert patched == "short = 2\nlong = '" + "x" * 400 + "'\n"
+
+
+def test_unmatched_edits_leave_code_untouched():
+    code = "a = 1\r\n"
+    minimized = minimize_code(code, "python")
+
+    patched, applied, rejected = apply_minimized_edits(code, minimized, [_edit("nope", "b")])
+
+    assert (patched, applied, rejected) == (code, 0, 1)
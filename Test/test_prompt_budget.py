@@ -0,0 +1,126 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt_budget import (COMMENT_RUN_KEEP, DATA_RUN_KEEP, LONG_LINE_KEEP, OMITTED_MARKER, estimate_tokens,
+                           minimize_code)
+
+
+LICENSE = "\n".join([
+    "# Copyright (c) 2024 Example Corp.",
+    "# Licensed under the Apache License, Version 2.0.",
+    "# you may not use this file except in compliance with the License.",
+])
+
+BODY = "\n".join([
+    "import os",
+    "",
+    "",
+    "",
+    "def handler(event):",
+] + [f"    # step {n}: explain what happens" for n in range(12)] + [
+    "    return os.getenv('X')",
+])
+
+
+def _line_of(text: str, needle: str) -> int:
+    return next(i + 1 for i, line in enumerate(text.splitlines()) if needle in line)
+
+
+def test_small_code_loses_nothing():
+    code = "def add(a, b):\n    return a + b\n"
+    minimized = minimize_code(code, "python")
+    assert minimized.text.rstrip("\n") == code.rstrip("\n")
+    assert minimized.omitted == {}
+    assert minimized.original_line(2) == 2
+    assert minimized.expand("anything") == "anything"
+
+
+def test_license_header_and_comment_run_are_collapsed_and_mapped():
+    code = LICENSE + "\n" + BODY
+    minimized = minimize_code(code, "python")
+
+    assert minimized.text.startswith(f"{OMITTED_MARKER} 3 license header line(s) from L1")
+    assert "step 0" in minimized.text and "step 11" not in minimized.text
+    assert minimized.tokens_after < minimized.tokens_before
+
+    # Lines after both collapsed regions still map onto the original code
+    ret = _line_of(minimized.text, "return os.getenv")
+    assert minimized.original_line(ret) == _line_of(code, "return os.getenv")
+    # The comment marker points at the first omitted comment line
+    marker = _line_of(minimized.text, "comment line(s)")
+    assert minimized.original_line(marker) == _line_of(code, f"step {COMMENT_RUN_KEEP}")
+
+
+def test_blank_runs_collapse_without_breaking_the_map():
+    code = "a = 1\n\n\n\n\nb = 2\n" + "# filler comment line\n" * 20
+    minimized = minimize_code(code, "python")
+    assert minimized.original_line(_line_of(minimized.text, "b = 2")) == 6
+
+
+def test_original_line_edge_cases():
+    minimized = minimize_code(LICENSE + "\n" + BODY, "python")
+    assert minimized.original_line(None) == 0
+    assert minimized.original_line("not a number") == 0
+    assert minimized.original_line("0") == 0
+    assert minimized.original_line(str(len(minimized.line_map) + 5)) == len(minimized.line_map) + 5
+
+
+def test_data_literal_run_is_collapsed():
+    code = "TABLE = [\n" + "".join(f"    {n},\n" for n in range(40)) + "]\nprint(TABLE)\n"
+    minimized = minimize_code(code, "python")
+    assert "data literal line(s)" in minimized.text
+    marker = _line_of(minimized.text, "data literal")
+    assert minimized.original_line(marker) == 2 + DATA_RUN_KEEP
+
+
+def test_long_line_keeps_its_head():
+    code = "x = '" + "a" * 1000 + "'\nprint(x)\n"
+    minimized = minimize_code(code, "python")
+    first = minimized.text.splitlines()[0]
+    assert first.startswith(code[:LONG_LINE_KEEP]) and OMITTED_MARKER in first
+    assert minimized.original_line(2) == 2
+
+
+def test_expand_restores_omitted_regions_in_a_rewrite():
+    code = LICENSE + "\n" + BODY + "\nz = '" + "b" * 1000 + "'\n"
+    minimized = minimize_code(code, "python")
+    rewrite = minimized.text.replace("return os.getenv('X')", "return os.environ.get('X')")
+
+    expanded = minimized.expand(rewrite)
+    assert expanded is not None
+    assert OMITTED_MARKER not in expanded
+    assert expanded.startswith(LICENSE)
+    assert "# step 11: explain what happens" in expanded
+    assert "b" * 1000 in expanded
+    assert "return os.environ.get('X')" in expanded
+
+
+def test_expand_rejects_rewrites_that_lost_a_marker():
+    minimized = minimize_code(LICENSE + "\n" + BODY, "python")
+    without_marker = "\n".join(l for l in minimized.text.splitlines() if "comment line(s)" not in l)
+    assert minimized.expand(without_marker) is None
+    assert minimized.expand(minimized.text + f"\n{OMITTED_MARKER} 9 made up line(s) ⟫") is None
+
+
+def test_token_budget_keeps_the_head_and_expands_the_tail():
+    code = "".join(f"value_{n} = compute({n})\n" for n in range(400))
+    minimized = minimize_code(code, "python", budget=200)
+
+    assert minimized.truncated
+    assert minimized.tokens_after <= 200 + estimate_tokens(minimized.text.splitlines()[-1])
+    tail_marker = len(minimized.text.splitlines())
+    dropped_from = minimized.original_line(tail_marker)
+    assert minimized.text.splitlines()[-1].startswith(f"{OMITTED_MARKER} {400 - dropped_from + 1} trailing")
+
+    expanded = minimized.expand(minimized.text)
+    assert expanded == code.rstrip("\n")
+
+
+def test_markers_for_identical_regions_stay_distinct():
+    block = "\n".join(f"# note {n}" for n in range(12))
+    code = f"a = 1\n{block}\nb = 2\n{block}\nc = 3\n"
+    minimized = minimize_code(code, "python")
+    assert len(minimized.omitted) == 2
+    assert minimized.expand(minimized.text) == code.rstrip("\n")
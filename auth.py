@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import uuid
 from jose import jwt, JWTError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -30,7 +31,8 @@ def create_refresh_token(data: dict, expires_days: int | None = None):
     expire = datetime.utcnow() + timedelta(days=expires_days if expires_days else 7)
     to_encode.update({
         "exp": expire,
-        "type": "refresh"
+        "type": "refresh",
+        "jti": to_encode.get("jti") or new_jti()
         })
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -64,7 +66,7 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
 
     return user
 
-def decode_refresh_token(token: str) -> str:
+def decode_refresh_payload(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
@@ -75,21 +77,23 @@ def decode_refresh_token(token: str) -> str:
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token payload")
 
-        return email.strip().lower()
+        payload["sub"] = email.strip().lower()
+        return payload
 
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
+def decode_refresh_token(token: str) -> str:
+    return decode_refresh_payload(token)["sub"]
+
+def new_jti() -> str:
+    return uuid.uuid4().hex
+
     
     
 def create_otp() -> str:
     import random
     return str(random.randint(100000, 999999))
 
-def hash_OTP(otp: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed_otp = bcrypt.hashpw(otp.encode(), salt)
-    return hashed_otp.decode()
-
 def normalize_email(email: str) -> str:
     return email.strip().lower()
\ No newline at end of file
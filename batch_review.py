@@ -0,0 +1,213 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from fastapi import HTTPException
+
+from Gemini import generate_structured
+from LLM import _build_result, github_review_key, language_for, link_shared_github_review, review_github_file
+from Models import BatchReviewOutput, CodeReviewResult
+from github import get_file_content, get_latest_commit_sha, parseUrl
+from github_tokens import bulk_requests
+from metrics import counter
+from model_router import route
+from prompt_budget import OMITTED_MARKER, MinimizedCode, estimate_tokens, minimize_code
+from review_cache import cache_github_review, lookup_github_review, review_scope
+from singleflight import single_flight
+from static_analysis import analyze_code
+from tracing import propagate
+
+
+# Files at or under this many (minimized) tokens are packed together
+SMALL_FILE_TOKENS = int(os.getenv("BATCH_SMALL_FILE_TOKENS", "1500"))
+# Upper bound on the code tokens packed into one Gemini request
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "12000"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+# Concurrent GitHub requests (commit SHAs, file contents) per batch review
+BATCH_FETCH_WORKERS = int(os.getenv("BATCH_FETCH_WORKERS", "8"))
+
+BATCHED_FILES = counter(
+    "review_batched_files_total", "Files reviewed as part of a packed multi-file Gemini request.", ("outcome",))
+BATCH_REQUESTS = counter(
+    "review_batch_requests_total", "Packed multi-file Gemini requests.")
+
+BATCH_REVIEW_SYSTEM_PROMPT = """
+You are an expert senior software engineer and code reviewer.
+
+You are given SEVERAL source files. Review each one independently:
+find bugs, security issues, performance problems, and style issues.
+
+You MUST respond with a single JSON object in this exact structure:
+
+{
+  "files": [
+    {
+      "path": "exact path as given in the FILE header",
+      "codeLanguage": "string",
+      "suggestions": ["list", "of", "general", "suggestions"],
+      "improved_code": "string"
+    }
+  ],
+  "issues": [
+    {
+      "file": "exact path of the file the issue belongs to",
+      "id": "string",
+      "line": number,
+      "severity": "critical" | "warning" | "info",
+      "category": "bug" | "security" | "performance" | "style" | "maintainability" | "other",
+      "title": "short title of the issue",
+      "explanation": "clear explanation of what is wrong and why",
+      "suggestedFix": "code snippet showing the improved version"
+    }
+  ]
+}
+
+Rules:
+- Include one entry in "files" for EVERY file given, even if it has no issues.
+- "line" is the line number within that file, counting from 1.
+- Do NOT include any text before or after the JSON.
+"""
+
+
+def pack_files(files: List[tuple[str, MinimizedCode]], budget: int = BATCH_TOKEN_BUDGET,
+               max_files: int = BATCH_MAX_FILES) -> List[List[tuple[str, MinimizedCode]]]:
+    """First-fit-decreasing packing of small files into batches under `budget` tokens."""
+    batches: List[List[tuple[str, MinimizedCode]]] = []
+    used: List[int] = []
+    for path, minimized in sorted(files, key=lambda f: f[1].tokens_after, reverse=True):
+        cost = minimized.tokens_after + estimate_tokens(path) + 8   # FILE header
+        for i, batch in enumerate(batches):
+            if used[i] + cost <= budget and len(batch) < max_files:
+                batch.append((path, minimized))
+                used[i] += cost
+                break
+        else:
+            batches.append([(path, minimized)])
+            used.append(cost)
+    return batches
+
+
+def _batch_prompt(batch: List[tuple[str, MinimizedCode]]) -> str:
+    sections = [f"Markers starting with '{OMITTED_MARKER}' replace regions removed before review; do not report issues on them "
+                f"and copy each marker line unchanged into improved_code."]
+    for path, minimized in batch:
+        sections.append(f"=== FILE: {path} (language: {language_for(path) or 'auto'}) ===\n```{minimized.text}```")
+    return "\n\n".join(sections)
+
+
+def review_batch(batch: List[tuple[str, MinimizedCode, str]], user_id: str) -> Dict[str, CodeReviewResult]:
+    """
+    Reviews several small files in one Gemini call and splits the answer back
+    into one CodeReviewResult per file. `batch` holds (path, minimized, code).
+    Files the model left out are returned as missing so the caller can fall
+    back to a single-file review.
+    """
+    prompt = _batch_prompt([(path, minimized) for path, minimized, _ in batch])
+    BATCH_REQUESTS.inc()
+    model = None
+    try:
+        # The light model only if every file of the batch would be routed to it
+        parsed, _, model = generate_structured([BATCH_REVIEW_SYSTEM_PROMPT, prompt], BatchReviewOutput, call="batch",
+                                               model_name=route(*(code for _, _, code in batch)))
+    except Exception as e:
+        if "429" in str(e):
+            raise HTTPException(status_code=429, detail="AI Quota exhausted. Please try again later.")
+        # Every file of this batch is then reviewed on its own
+        logging.error(f"Batch AI Review Error: {e}")
+        parsed = {}
+
+    file_meta: Dict[str, Dict[str, Any]] = {}
+    for entry in parsed.get("files") or []:
+        if isinstance(entry, dict) and entry.get("path"):
+            file_meta[str(entry["path"])] = entry
+    issues_by_file: Dict[str, List[Dict[str, Any]]] = {}
+    for issue in parsed.get("issues") or []:
+        if isinstance(issue, dict) and issue.get("file"):
+            issues_by_file.setdefault(str(issue["file"]), []).append(issue)
+
+    results: Dict[str, CodeReviewResult] = {}
+    for path, minimized, code in batch:
+        if path not in file_meta:
+            BATCHED_FILES.inc(outcome="missing")
+            continue
+        data = dict(file_meta[path], issues=issues_by_file.get(path, []))
+        local_issues = analyze_code(code, language_for(path)).issues
+        results[path] = _build_result(data, code, language_for(path), user_id, minimized, local_issues, model)
+        BATCHED_FILES.inc(outcome="ok")
+    return results
+
+
+def review_github_files(url: str, file_paths: List[str], user_id: str) -> List[dict]:
+    """
+    Multi-file GitHub review. Cached files (own or shared) are served from
+    the review cache. Misses go through the same single-flight keys as
+    `/github/review`: files someone else is already reviewing are waited
+    for, the rest are led by this call, where small files are packed into
+    shared Gemini requests and large and trivial ones (empty, unparseable)
+    are reviewed on their own. Every file is cached independently, exactly
+    like a single `/github/review`.
+    """
+    owner, repo = parseUrl(url)
+    paths = list(dict.fromkeys(file_paths))
+    scope = review_scope(user_id, owner, repo)
+
+    # Many files at once: bulk work for the GitHub token pool, behind single /github/review calls
+    with bulk_requests(), ThreadPoolExecutor(max_workers=max(1, min(BATCH_FETCH_WORKERS, len(paths)))) as pool:
+        shas = dict(zip(paths, pool.map(propagate(lambda path: get_latest_commit_sha(owner, repo, path)), paths)))
+
+        results: Dict[str, dict] = {}
+        misses: Dict[str, str] = {}
+        for path in paths:
+            cached = lookup_github_review(user_id, owner, repo, path, shas[path])
+            if cached:
+                results[path] = dict(cached, file_path=path)
+            else:
+                misses[github_review_key(scope, owner, repo, path, shas[path])] = path
+
+        def review_led(keys: List[str]) -> Dict[str, dict]:
+            led = [misses[key] for key in keys]
+            contents = dict(zip(led, pool.map(propagate(lambda path: get_file_content(owner, repo, path)), led)))
+            reviews = _review_contents(owner, repo, shas, contents, user_id)
+            return {key: reviews[misses[key]] for key in keys}
+
+        single = {key: (lambda path=path: review_github_file(owner, repo, path, shas[path], user_id))
+                  for key, path in misses.items()}
+        for key, (review, shared) in single_flight.do_many(single, review_led, kind="github").items():
+            path = misses[key]
+            if shared:
+                review = link_shared_github_review(scope, user_id, owner, repo, path, shas[path], review)
+            results[path] = dict(review, file_path=path)
+
+    return [results[path] for path in paths]
+
+
+def _review_contents(owner: str, repo: str, shas: Dict[str, str], contents: Dict[str, str],
+                     user_id: str) -> Dict[str, dict]:
+    """Reviews and caches the given files, packing the small ones; returns path -> cached review."""
+    small, large = [], []
+    for path, content in contents.items():
+        if analyze_code(content, language_for(path)).trivial:
+            large.append(path)   # answered locally by code_review
+            continue
+        minimized = minimize_code(content, language_for(path))
+        if minimized.tokens_after <= SMALL_FILE_TOKENS:
+            small.append((path, minimized))
+        else:
+            large.append(path)
+
+    reviewed: Dict[str, dict] = {}
+    for packed in pack_files(small):
+        if len(packed) == 1:
+            large.append(packed[0][0])
+            continue
+        reviews = review_batch([(path, minimized, contents[path]) for path, minimized in packed], user_id)
+        for path, _ in packed:
+            if path in reviews:
+                reviewed[path] = cache_github_review(user_id, owner, repo, path, shas[path], reviews[path])
+            else:
+                large.append(path)
+
+    for path in large:
+        reviewed[path] = review_github_file(owner, repo, path, shas[path], user_id, content=contents[path])
+    return reviewed
@@ -1,34 +1,199 @@
 import base64
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from pathlib import PurePosixPath
 import requests
 import os
 import dotenv
-from typing import Optional
+from typing import Iterator, Optional
+
+from github_tokens import GitHubRateLimited, bulk_requests, current_priority, token_pool
+from metrics import record_github_response
+from tracing import span
 
 
 dotenv.load_dotenv()
 
-HEADERS = {
-    "Authorization": f"Bearer {os.getenv('GITHUB_TOKEN')}",
-    "Accept": "application/vnd.github+json"
-}
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
+
+def _get(endpoint: str, url: str, **kwargs):
+    """GET through the token pool; a rate-limited response is retried on another token, at most once per token (then 429)."""
+    priority = current_priority()
+    with span(f"GitHub GET {endpoint}", kind="CLIENT", **{
+            "http.request.method": "GET", "url.full": url, "github.endpoint": endpoint, "github.priority": priority}) as s:
+        waited = 0.0
+        for _ in range(len(token_pool)):
+            start = time.perf_counter()
+            token = token_pool.acquire(priority)
+            # Bulk requests may be paced by the pool before they go out
+            waited += time.perf_counter() - start
+            start = time.perf_counter()
+            res = requests.get(url, headers=token_pool.headers(token), **kwargs)
+            record_github_response(endpoint, res, time.perf_counter() - start)
+            limited = token_pool.update(token, res)
+            if s is not None:
+                s.set(**{"http.response.status_code": res.status_code, "github.token": token.name,
+                         "github.pool_wait_ms": round(waited * 1000, 1)})
+                if limited:
+                    s.event("rate_limited", **{"github.token": token.name})
+            if not limited:
+                return res
+        raise GitHubRateLimited(token_pool.retry_after())
+
+
+# Repo metadata (visibility, default branch) changes rarely; cache it per process
+REPO_VISIBILITY_TTL_SECONDS = int(os.getenv("REPO_VISIBILITY_TTL_SECONDS", "600"))
+_repo_metadata: dict[tuple[str, str], tuple[int, Optional[dict], float]] = {}
+
+
+def get_repo_metadata(owner: str, repo: str) -> tuple[int, Optional[dict]]:
+    """
+    `(status, repo document)` from GitHub; the document is None unless the
+    status is 200. Only definite answers are cached: 401/403/429 (bad token,
+    rate limit) are transient and must not pin a public repo as private.
+    """
+    cached = _repo_metadata.get((owner, repo))
+    if cached and cached[2] > time.monotonic():
+        return cached[0], cached[1]
+
+    res = _get("repos", f"{GITHUB_API_URL}/repos/{owner}/{repo}")
+    metadata = res.json() if res.status_code == 200 else None
+    if res.status_code in (200, 404):
+        _repo_metadata[(owner, repo)] = (res.status_code, metadata, time.monotonic() + REPO_VISIBILITY_TTL_SECONDS)
+    return res.status_code, metadata
+
+
+def is_public_repo(owner: str, repo: str) -> bool:
+    """
+    True only if GitHub reports the repo as public. Anything else (private,
+    not found, errors) is treated as private so its reviews stay per-user.
+    """
+    _, metadata = get_repo_metadata(owner, repo)
+    return metadata is not None and metadata.get("private") is False
+
+
+def get_default_branch(owner: str, repo: str) -> str:
+    status, metadata = get_repo_metadata(owner, repo)
+    if metadata is None:
+        raise Exception(f"Failed to fetch repo {owner}/{repo}: {status}")
+    return metadata.get("default_branch") or "main"
 
 
 def parseUrl(url : str) : 
     parts = url.replace("https://github.com/", "").split("/")
     return parts[0], parts[1]
 
-def get_repo_tree(owner: str, repo: str):
-    url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/main?recursive=1"
-    
-    res = requests.get(url , headers=HEADERS)
+# Trees are immutable per sha: cache the most recent ones (a monorepo's recursive tree is several MB)
+REPO_TREE_CACHE_SIZE = int(os.getenv("REPO_TREE_CACHE_SIZE", "64"))
+# How long a branch's head tree sha is trusted before asking GitHub again (paging, repeated listings)
+REPO_HEAD_TTL_SECONDS = int(os.getenv("REPO_HEAD_TTL_SECONDS", "30"))
+_trees: OrderedDict[tuple[str, str, str, bool], tuple[list, bool]] = OrderedDict()
+_branch_heads: dict[tuple[str, str, str], tuple[str, float]] = {}
+_tree_lock = threading.Lock()
+
+
+def _head_tree_sha(owner: str, repo: str, branch: str) -> str:
+    cached = _branch_heads.get((owner, repo, branch))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    res = _get("branches", f"{GITHUB_API_URL}/repos/{owner}/{repo}/branches/{branch}")
+    if res.status_code != 200:
+        raise Exception(f"Failed to fetch branch {branch}: {res.status_code} - {res.text}")
+    tree_sha = res.json()["commit"]["commit"]["tree"]["sha"]
+    _branch_heads[(owner, repo, branch)] = (tree_sha, time.monotonic() + REPO_HEAD_TTL_SECONDS)
+    return tree_sha
+
+
+def _fetch_tree(owner: str, repo: str, tree_sha: str, recursive: bool) -> tuple[list, bool]:
+    """`(entries, truncated)` of one tree, cached by (owner, repo, tree_sha)."""
+    key = (owner, repo, tree_sha, recursive)
+    with _tree_lock:
+        if key in _trees:
+            _trees.move_to_end(key)
+            return _trees[key]
+
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/{tree_sha}" + ("?recursive=1" if recursive else "")
+    res = _get("trees", url)
     if res.status_code != 200:
         raise Exception(f"Failed to fetch repo tree: {res.status_code} - {res.text}")
-    return res.json()["tree"]
+    data = res.json()
+    tree = (data["tree"], bool(data.get("truncated")))
+
+    with _tree_lock:
+        _trees[key] = tree
+        while len(_trees) > REPO_TREE_CACHE_SIZE:
+            _trees.popitem(last=False)
+    return tree
+
+
+def _walk_tree(owner: str, repo: str, tree_sha: str, base: str, prefix: str) -> Iterator[dict]:
+    entries, truncated = _fetch_tree(owner, repo, tree_sha, recursive=True)
+    if not truncated:
+        for entry in entries:
+            path = base + entry["path"]
+            if path.startswith(prefix):
+                yield dict(entry, path=path) if base else entry
+        return
+
+    # GitHub cut the recursive listing short: list this level and walk each
+    # subtree only when the caller iterates that far (and only under `prefix`)
+    entries, _ = _fetch_tree(owner, repo, tree_sha, recursive=False)
+    for entry in entries:
+        path = base + entry["path"]
+        if entry["type"] == "tree":
+            directory = path + "/"
+            if not (directory.startswith(prefix) or prefix.startswith(directory)):
+                continue
+            if path.startswith(prefix):
+                yield dict(entry, path=path)
+            yield from _walk_tree(owner, repo, entry["sha"], directory, prefix)
+        elif path.startswith(prefix):
+            yield dict(entry, path=path)
+
+
+def iter_repo_tree(owner: str, repo: str, prefix: str = "") -> Iterator[dict]:
+    """Entries (full paths) of the default branch's tree, lazily; only paths under `prefix`."""
+    branch = get_default_branch(owner, repo)
+    yield from _walk_tree(owner, repo, _head_tree_sha(owner, repo, branch), "", prefix)
+
+
+def get_repo_tree(owner: str, repo: str):
+    return list(iter_repo_tree(owner, repo))
+
+
+def list_repo_files(owner: str, repo: str, extensions: Optional[list[str]] = None, prefix: str = "",
+                    glob: Optional[str] = None, max_size: Optional[int] = None,
+                    offset: int = 0, limit: Optional[int] = None) -> tuple[list[str], bool]:
+    """
+    Blob paths of the default branch matching every given filter, sliced to
+    `[offset, offset + limit)`; returns `(paths, has_more)`. `glob` is a
+    shell pattern over the whole path (`*` also matches `/`). The walk stops
+    as soon as the page is known to be full.
+    """
+    suffixes = {"." + ext.lower().lstrip(".") for ext in extensions or [] if ext}
+    matched: list[str] = []
+    for entry in iter_repo_tree(owner, repo, prefix):
+        if entry["type"] != "blob":
+            continue
+        path = entry["path"]
+        if suffixes and PurePosixPath(path).suffix.lower() not in suffixes:
+            continue
+        if glob and not fnmatch.fnmatchcase(path, glob):
+            continue
+        if max_size is not None and entry.get("size", 0) > max_size:
+            continue
+        matched.append(path)
+        if limit is not None and len(matched) > offset + limit:
+            return matched[offset:offset + limit], True
+    return matched[offset:] if limit is None else matched[offset:offset + limit], False
 
 
 def get_file_content(owner, repo, path):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-    res = requests.get(url, headers=HEADERS)
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/contents/{path}"
+    res = _get("contents", url)
     res.raise_for_status()
     data = res.json()
     return base64.b64decode(data["content"]).decode("utf-8")
@@ -40,28 +205,35 @@ def get_file_content(owner, repo, path):
 
 
 def get_github_file(url: str):
+    """
+    Every file of the default branch, fetched as bulk work. Fails (naming the
+    files) rather than returning part of the repo; rate limits raise at once.
+    """
     owner, repo = parseUrl(url)
-    tree = get_repo_tree(owner, repo)
-    
-    files = {}
-    for item in tree:
-        if item["type"] == "blob":
-            file_path = item["path"]
+    files, failed = {}, {}
+    with bulk_requests():
+        for item in iter_repo_tree(owner, repo):
+            if item["type"] != "blob":
+                continue
             try:
-                content = get_file_content(owner, repo, file_path)
-                files[file_path] = content
+                files[item["path"]] = get_file_content(owner, repo, item["path"])
+            except GitHubRateLimited:
+                raise
             except Exception as e:
-                print(f"Failed to fetch content for {file_path}: {e}")
+                failed[item["path"]] = e
+    if failed:
+        names = ", ".join(sorted(failed)[:10]) + (" ..." if len(failed) > 10 else "")
+        raise Exception(f"Failed to fetch {len(failed)} of {len(files) + len(failed)} files: {names}")
     return files
 
 def get_latest_commit_sha(owner: str, repo: str, path: Optional[str] = None):
     """
     Fetches the latest commit SHA for a repository or a specific file.
     """
-    url = f"https://api.github.com/repos/{owner}/{repo}/commits"
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/commits"
     params = {"path": path, "per_page": 1} if path else {"per_page": 1}
     
-    res = requests.get(url, headers=HEADERS, params=params)
+    res = _get("commits", url, params=params)
     if res.status_code != 200:
         raise Exception(f"Failed to fetch commits: {res.status_code} - {res.text}")
     
@@ -0,0 +1,195 @@
+"""
+GitHub token pool: picks which token each GitHub API request goes out with.
+
+Tokens come from GITHUB_TOKENS (comma separated) plus GITHUB_TOKEN; with
+none configured requests go out unauthenticated (60 an hour). Every response's
+X-RateLimit-* headers update its token's quota, and each request takes the
+token with the most quota left.
+
+Requests are interactive unless made inside `bulk_requests()` (batch reviews,
+push pre-warming, whole-repo downloads). Bulk requests:
+- leave GITHUB_INTERACTIVE_RESERVE requests per token to interactive ones;
+- once a token is below GITHUB_PACE_BELOW of its limit, are spaced out so
+  what's left lasts until the reset, instead of spending it in one burst
+  (waiting at most GITHUB_BULK_MAX_WAIT_SECONDS).
+
+When no token can take a request, GitHubRateLimited is raised: a 429
+HTTPException whose Retry-After is the earliest reset.
+"""
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+
+import dotenv
+from fastapi import HTTPException
+
+from metrics import counter, gauge
+
+
+dotenv.load_dotenv()
+
+GITHUB_INTERACTIVE_RESERVE = int(os.getenv("GITHUB_INTERACTIVE_RESERVE", "200"))
+GITHUB_PACE_BELOW = float(os.getenv("GITHUB_PACE_BELOW", "0.25"))
+GITHUB_BULK_MAX_WAIT_SECONDS = float(os.getenv("GITHUB_BULK_MAX_WAIT_SECONDS", "30"))
+# Secondary rate limits (abuse detection) may come without Retry-After
+GITHUB_SECONDARY_LIMIT_SECONDS = int(os.getenv("GITHUB_SECONDARY_LIMIT_SECONDS", "60"))
+
+AUTHENTICATED_LIMIT = 5000
+ANONYMOUS_LIMIT = 60
+
+GITHUB_TOKEN_REMAINING = gauge(
+    "github_token_rate_limit_remaining", "Requests left per pooled GitHub token.", ("token",))
+GITHUB_SCHEDULED = counter(
+    "github_scheduled_requests_total", "GitHub requests by priority and how the pool handled them.",
+    ("priority", "outcome"))
+
+
+class GitHubRateLimited(HTTPException):
+    def __init__(self, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=429, detail="GitHub API rate limit reached. Please try again later.",
+                         headers={"Retry-After": str(self.retry_after)})
+
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("github_priority", default="interactive")
+
+
+@contextlib.contextmanager
+def bulk_requests():
+    """GitHub requests made inside this block (this thread/task, and pool threads via tracing.propagate) are background bulk work."""
+    reset = _priority.set("bulk")
+    try:
+        yield
+    finally:
+        _priority.reset(reset)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class _Token:
+    def __init__(self, name: str, secret: str | None, limit: int):
+        self.name = name
+        self.secret = secret
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = 0.0        # epoch seconds, from X-RateLimit-Reset
+        self.blocked_until = 0.0   # epoch seconds; set by 403/429 rate-limit responses
+        self.next_bulk_at = 0.0    # epoch seconds; when the next paced bulk request may go
+
+    def reserve(self) -> int:
+        return min(GITHUB_INTERACTIVE_RESERVE, self.limit // 10)
+
+    def available_at(self) -> float:
+        return max(self.blocked_until, self.reset_at if self.remaining <= 0 else 0.0)
+
+
+class TokenPool:
+    def __init__(self, secrets: list[str]):
+        if secrets:
+            self._tokens = [_Token(f"token{i}", secret, AUTHENTICATED_LIMIT) for i, secret in enumerate(secrets)]
+        else:
+            self._tokens = [_Token("anonymous", None, ANONYMOUS_LIMIT)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def retry_after(self) -> float:
+        """Seconds until the first token can take a request again."""
+        with self._lock:
+            return min(t.available_at() for t in self._tokens) - time.time()
+
+    def headers(self, token: _Token) -> dict:
+        headers = {"Accept": "application/vnd.github+json"}
+        if token.secret:
+            headers["Authorization"] = f"Bearer {token.secret}"
+        return headers
+
+    def acquire(self, priority: str) -> _Token:
+        """The token for the next request, after any pacing wait; raises GitHubRateLimited."""
+        with self._lock:
+            now = time.time()
+            for token in self._tokens:
+                if token.reset_at and now >= token.reset_at:
+                    token.remaining, token.reset_at = token.limit, 0.0
+            bulk = priority == "bulk"
+            usable = [t for t in self._tokens
+                      if t.blocked_until <= now and t.remaining > (t.reserve() if bulk else 0)]
+            if not usable:
+                GITHUB_SCHEDULED.inc(priority=priority, outcome="rejected")
+                if bulk:
+                    retry_at = min(max(t.blocked_until, t.reset_at) for t in self._tokens)
+                else:
+                    retry_at = min(t.available_at() for t in self._tokens)
+                raise GitHubRateLimited(retry_at - now)
+
+            if not bulk:
+                token = max(usable, key=lambda t: t.remaining)
+                delay = 0.0
+            else:
+                token = min(usable, key=lambda t: (t.next_bulk_at, -t.remaining))
+                delay = max(0.0, token.next_bulk_at - now)
+                if delay > GITHUB_BULK_MAX_WAIT_SECONDS:
+                    GITHUB_SCHEDULED.inc(priority=priority, outcome="rejected")
+                    raise GitHubRateLimited(delay)
+                token.next_bulk_at = max(now, token.next_bulk_at) + self._bulk_interval(token, now)
+            # Counted now so concurrent callers see it; the response headers correct it
+            token.remaining -= 1
+
+        GITHUB_SCHEDULED.inc(priority=priority, outcome="paced" if delay else "sent")
+        if delay:
+            time.sleep(delay)
+        return token
+
+    @staticmethod
+    def _bulk_interval(token: _Token, now: float) -> float:
+        if token.remaining > token.limit * GITHUB_PACE_BELOW or not token.reset_at:
+            return 0.0
+        return max(0.0, token.reset_at - now) / max(1, token.remaining - token.reserve())
+
+    def update(self, token: _Token, res) -> bool:
+        """Records the response's quota headers; True if the token was rate limited (retry elsewhere)."""
+        headers = res.headers
+        now = time.time()
+        limited = False
+        with self._lock:
+            if headers.get("X-RateLimit-Limit"):
+                token.limit = int(headers["X-RateLimit-Limit"])
+            if headers.get("X-RateLimit-Reset"):
+                token.reset_at = float(headers["X-RateLimit-Reset"])
+            if headers.get("X-RateLimit-Remaining"):
+                token.remaining = int(headers["X-RateLimit-Remaining"])
+            if res.status_code in (403, 429):
+                # Never unblocked at once: the caller would re-send on this token in a tight loop
+                if headers.get("Retry-After"):
+                    token.blocked_until = now + max(float(headers["Retry-After"]), 1.0)
+                    limited = True
+                elif headers.get("X-RateLimit-Remaining") == "0":
+                    token.blocked_until = token.reset_at if token.reset_at > now else now + GITHUB_SECONDARY_LIMIT_SECONDS
+                    limited = True
+                elif "rate limit" in res.text.lower():
+                    token.blocked_until = now + GITHUB_SECONDARY_LIMIT_SECONDS
+                    limited = True
+            remaining = token.remaining
+        GITHUB_TOKEN_REMAINING.set(remaining, token=token.name)
+        return limited
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+
+def _configured_tokens() -> list[str]:
+    tokens = [t.strip() for t in os.getenv("GITHUB_TOKENS", "").split(",") if t.strip()]
+    single = os.getenv("GITHUB_TOKEN")
+    if single and single not in tokens:
+        tokens.append(single)
+    return tokens
+
+
+token_pool = TokenPool(_configured_tokens())
+os.register_at_fork(after_in_child=token_pool._after_fork)
@@ -0,0 +1,191 @@
+"""
+GitHub push webhooks: pre-warm the review cache for the files a push changed.
+
+Configure the repo (or org) webhook with content type application/json, the
+"push" event and the secret in GITHUB_WEBHOOK_SECRET, pointing at
+POST /github/webhook.
+
+Pre-warm reviews take the same cache path as `/github/review`
+(lookup, then `coalesced_github_review` on a miss) for the users who most recently reviewed the repo. They run
+on one background thread per worker, one review at a time, so a push never
+takes more than a single Gemini slot from interactive requests; their GitHub
+calls are bulk work for the token pool (github_tokens) and their reviews the
+background tier of the LLM queue (llm_scheduler). Every review
+that needs the model is charged to a per-repo budget shared by all workers.
+Pre-warming is best effort: queued pushes are dropped when the worker stops.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+
+from fastapi import HTTPException
+
+from Database import recent_repo_reviewers, take_prewarm_budget
+from LLM import coalesced_github_review, language_for
+from github import get_latest_commit_sha
+from github_tokens import GitHubRateLimited, bulk_requests
+from llm_scheduler import llm_scheduler
+from metrics import counter, gauge
+from review_cache import lookup_github_review
+from tracing import start_trace
+
+
+WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+# Model reviews a repo's pushes may trigger per budget window, across workers
+PREWARM_REPO_BUDGET = int(os.getenv("PREWARM_REPO_BUDGET", "50"))
+PREWARM_BUDGET_WINDOW_SECONDS = int(os.getenv("PREWARM_BUDGET_WINDOW_SECONDS", "3600"))
+# Whose cache a push warms: the repo's most recent reviewers
+PREWARM_MAX_USERS = int(os.getenv("PREWARM_MAX_USERS", "5"))
+PREWARM_MAX_FILES = int(os.getenv("PREWARM_MAX_FILES", "50"))
+# Pushes waiting for the background thread; further pushes are refused with 503
+PREWARM_QUEUE_SIZE = int(os.getenv("PREWARM_QUEUE_SIZE", "100"))
+
+WEBHOOK_EVENTS = counter(
+    "github_webhook_events_total", "GitHub webhook deliveries by event and outcome.", ("event", "outcome"))
+PREWARM_REVIEWS = counter(
+    "review_prewarm_total", "Pre-warm reviews triggered by push webhooks.", ("outcome",))
+PREWARM_QUEUE_DEPTH = gauge(
+    "review_prewarm_queue_depth", "Pushes waiting to be pre-warmed in this worker.")
+
+
+def verify_signature(body: bytes, signature: str | None):
+    """Checks X-Hub-Signature-256 (HMAC-SHA256 of the raw body with the webhook secret)."""
+    if not WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="GitHub webhook is not configured")
+    expected = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    if not signature or not hmac.compare_digest(expected, signature):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+
+def changed_paths(payload: dict) -> list[str]:
+    """Files added or modified by the pushed commits (in order) and still present after the push."""
+    changed: dict[str, None] = {}
+    for commit in payload.get("commits") or []:
+        for path in (commit.get("added") or []) + (commit.get("modified") or []):
+            changed[path] = None
+        for path in commit.get("removed") or []:
+            changed.pop(path, None)
+    return list(changed)
+
+
+def handle_event(event: str, payload: dict) -> dict:
+    if event == "ping":
+        WEBHOOK_EVENTS.inc(event=event, outcome="ok")
+        return {"status": "pong"}
+    if event != "push":
+        WEBHOOK_EVENTS.inc(event=event or "unknown", outcome="ignored")
+        return {"status": "ignored", "reason": f"event {event!r} is not handled"}
+
+    repository = payload.get("repository") or {}
+    owner, _, repo = (repository.get("full_name") or "").partition("/")
+    if not owner or not repo:
+        WEBHOOK_EVENTS.inc(event=event, outcome="invalid")
+        raise HTTPException(status_code=400, detail="Push payload has no repository.full_name")
+    # Reviews are keyed on the default branch's history (get_latest_commit_sha)
+    if payload.get("deleted") or payload.get("ref") != f"refs/heads/{repository.get('default_branch')}":
+        WEBHOOK_EVENTS.inc(event=event, outcome="ignored")
+        return {"status": "ignored", "reason": "not a push to the default branch"}
+
+    paths = [path for path in changed_paths(payload) if language_for(path)][:PREWARM_MAX_FILES]
+    users = recent_repo_reviewers(owner, repo, PREWARM_MAX_USERS) if paths else []
+    if not paths or not users:
+        WEBHOOK_EVENTS.inc(event=event, outcome="ignored")
+        return {"status": "ignored", "reason": "no reviewable changes" if not paths else "no reviewers for this repo"}
+
+    try:
+        _queue.put_nowait((owner, repo, paths, users))
+    except queue.Full:
+        WEBHOOK_EVENTS.inc(event=event, outcome="dropped")
+        raise HTTPException(status_code=503, detail="Pre-warm queue is full")
+    PREWARM_QUEUE_DEPTH.set(_queue.qsize())
+    _ensure_worker()
+    WEBHOOK_EVENTS.inc(event=event, outcome="queued")
+    return {"status": "queued", "repository": f"{owner}/{repo}", "paths": paths, "users": len(users)}
+
+
+def prewarm(owner: str, repo: str, paths: list[str], users: list[str]):
+    try:
+        # Its own trace: pre-warming runs after the webhook's request has finished
+        with start_trace("github.prewarm", kind="INTERNAL", **{"github.repo": f"{owner}/{repo}", "prewarm.paths": len(paths)}), \
+                bulk_requests():
+            _prewarm_paths(owner, repo, paths, users)
+    except GitHubRateLimited as e:
+        PREWARM_REVIEWS.inc(outcome="rate_limited")
+        print(f"⏸️ GitHub quota too low to pre-warm {owner}/{repo} (retry in {e.retry_after}s); skipping the rest of this push")
+
+
+def _prewarm_paths(owner: str, repo: str, paths: list[str], users: list[str]):
+    for path in paths:
+        try:
+            commit_sha = get_latest_commit_sha(owner, repo, path)
+        except GitHubRateLimited:
+            raise
+        except Exception as e:
+            PREWARM_REVIEWS.inc(outcome="failed")
+            logging.warning("Pre-warm of %s/%s:%s skipped: %s", owner, repo, path, e)
+            continue
+        for user_id in users:
+            # A hit (or another user's shared public review) only needs its link
+            if lookup_github_review(user_id, owner, repo, path, commit_sha, record=False):
+                PREWARM_REVIEWS.inc(outcome="cached")
+                continue
+            if not take_prewarm_budget(owner, repo, PREWARM_REPO_BUDGET, PREWARM_BUDGET_WINDOW_SECONDS):
+                PREWARM_REVIEWS.inc(outcome="over_budget")
+                print(f"⏸️ Pre-warm budget for {owner}/{repo} used up; skipping the rest of this push")
+                return
+            try:
+                # Background tier: only runs when no interactive or batch review is waiting
+                with llm_scheduler.slot_sync(user_id, tier="background"):
+                    coalesced_github_review(owner, repo, path, commit_sha, user_id)
+                PREWARM_REVIEWS.inc(outcome="reviewed")
+            except GitHubRateLimited:
+                raise
+            except Exception as e:
+                PREWARM_REVIEWS.inc(outcome="failed")
+                logging.warning("Pre-warm review of %s/%s:%s failed: %s", owner, repo, path, e)
+
+
+# --- background worker (one per process, started on first push) ---
+
+_queue: queue.Queue = queue.Queue(maxsize=PREWARM_QUEUE_SIZE)
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+def _run():
+    while True:
+        job = _queue.get()
+        try:
+            prewarm(*job)
+        except Exception as e:
+            logging.error("Pre-warm job failed: %s", e)
+        finally:
+            _queue.task_done()
+            PREWARM_QUEUE_DEPTH.set(_queue.qsize())
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="review-prewarm", daemon=True)
+            _worker.start()
+
+
+def wait_idle():
+    """Blocks until every queued push has been pre-warmed (tests, replay script)."""
+    _queue.join()
+
+
+def _after_fork():
+    # Threads don't survive fork; the child starts its own worker on first use
+    global _queue, _worker, _worker_lock
+    _queue = queue.Queue(maxsize=PREWARM_QUEUE_SIZE)
+    _worker = None
+    _worker_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,60 @@
+"""
+Serverless entrypoint: the FastAPI app on AWS Lambda through Mangum (API
+Gateway REST/HTTP APIs, function URLs, ALB).
+
+    Handler: lambda_handler.handler
+    python lambda_handler.py --ensure-indexes      # deploy step, see below
+
+What a cold start pays for is kept to the app itself:
+- The app runs with lifespan off. Mangum runs the lifespan around every
+  invocation, so startup would ping Mongo on each request and shutdown would
+  close the client that warm invocations are meant to reuse.
+- Route groups (review, image, GitHub) import google-genai / requests on
+  their first request (see main._RouteGroup); auth and user routes never do.
+- The Mongo client (Database.get_client) and Gemini backend
+  (llm_backend.get_backend) are module globals created on first use and
+  reused by every warm invocation of the container.
+- Index creation is not run at init; run it once per deploy with
+  --ensure-indexes (the long-running server does it in its startup hook).
+
+Lambda's code directory is read-only, so the process works from
+LAMBDA_WORKDIR (default /tmp), where main mounts ./uploads. Files written
+there live only as long as the container.
+
+Environment:
+    LAMBDA_WORKDIR          writable working directory (/tmp)
+"""
+import os
+import sys
+import time
+
+_init_start = time.perf_counter()
+
+# main and its modules import from the code directory whatever the working directory is
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = os.getenv("LAMBDA_WORKDIR", "/tmp")
+os.makedirs(os.path.join(WORKDIR, "uploads"), exist_ok=True)
+os.chdir(WORKDIR)
+
+from mangum import Mangum
+
+import main
+
+handler = Mangum(main.app, lifespan="off")
+
+# Module init time of this container (imports + app construction), for cold-start budgets
+INIT_SECONDS = time.perf_counter() - _init_start
+print(f"Lambda init finished in {INIT_SECONDS * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import Database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ensure-indexes", action="store_true", help="create the Mongo indexes every module registers")
+    args = parser.parse_args()
+    if args.ensure_indexes:
+        Database.ensure_indexes()
+        print("Indexes ensured")
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import weakref
+from collections import deque
+from pathlib import Path
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+
+load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+
+# gemini (default) | record | replay
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+LLM_RECORD_DIR = os.getenv("LLM_RECORD_DIR", str(Path(__file__).parent / "llm_recordings"))
+# 1.0 replays at recorded speed, 0 answers instantly
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))
+# strict: unknown requests raise. nearest: serve a recording for the same model
+LLM_REPLAY_MISS = os.getenv("LLM_REPLAY_MISS", "nearest").strip().lower()
+# Optional simulated quota; requests past this many tokens/minute get a 429
+LLM_REPLAY_TPM = int(os.getenv("LLM_REPLAY_TPM", "0"))
+
+
+_gemini_backends: "weakref.WeakSet[GeminiBackend]" = weakref.WeakSet()
+
+
+def _reset_clients_after_fork():
+    for backend in list(_gemini_backends):
+        backend._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+
+class LLMBackend:
+    """
+    Minimal surface every LLM call in the app goes through. It mirrors
+    `genai.Client.models.generate_content` so call sites and response handling
+    (`.text`, `.usage_metadata`) don't care which backend is active.
+    """
+
+    name = "base"
+
+    def generate_content(self, model: str, contents, config=None):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Live Gemini API. The client is created on first use, not at import, and
+    dropped in forked children so workers never share the parent's connections.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str | None = None):
+        self._api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+        _gemini_backends.add(self)
+
+    def _reset_after_fork(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google import genai
+                    api_key = self._api_key or os.getenv("GEMINI_API_KEY")
+                    if not api_key:
+                        raise ValueError("GEMINI_API_KEY not found in environment variables")
+                    self._client = genai.Client(api_key=api_key)
+        return self._client
+
+    def generate_content(self, model: str, contents, config=None):
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+
+def _describe_part(part):
+    if isinstance(part, str):
+        return part
+    inline = getattr(part, "inline_data", None)
+    if inline is not None:
+        return {"inline_data": {"mime_type": inline.mime_type,
+                                "sha256": hashlib.sha256(inline.data or b"").hexdigest(),
+                                "bytes": len(inline.data or b"")}}
+    text = getattr(part, "text", None)
+    if text is not None:
+        return text
+    return repr(part)
+
+
+def _describe_config(config):
+    if config is None:
+        return None
+    if hasattr(config, "model_dump"):
+        return json.loads(json.dumps(config.model_dump(exclude_none=True), default=repr, sort_keys=True))
+    return repr(config)
+
+
+def describe_request(model: str, contents, config=None) -> dict:
+    """JSON-safe description of a request; images are reduced to their hash."""
+    contents = contents if isinstance(contents, list) else [contents]
+    return {
+        "model": model,
+        "contents": [_describe_part(p) for p in contents],
+        "config": _describe_config(config),
+    }
+
+
+def request_key(request: dict) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def _usage_dict(response) -> dict:
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "prompt_token_count": getattr(usage, "prompt_token_count", None) or 0,
+        "candidates_token_count": getattr(usage, "candidates_token_count", None) or 0,
+        "total_token_count": getattr(usage, "total_token_count", None) or 0,
+    }
+
+
+def _error_dict(e: Exception) -> dict:
+    return {
+        "code": getattr(e, "code", None) or 500,
+        "status": getattr(e, "status", None) or type(e).__name__,
+        "message": getattr(e, "message", None) or str(e),
+    }
+
+
+def _raise_recorded_error(error: dict):
+    from google.genai import errors as genai_errors
+    code = int(error.get("code") or 500)
+    body = SimpleNamespace(body_segments=[{"error": {
+        "code": code, "status": error.get("status"), "message": error.get("message")}}])
+    if code >= 500:
+        raise genai_errors.ServerError(code, body)
+    raise genai_errors.ClientError(code, body)
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Wraps another backend and writes every request/response pair (including
+    API errors) to `record_dir` as `<request-hash>.json`, together with the
+    measured latency, so ReplayBackend can serve them later.
+    """
+
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, record_dir: str = LLM_RECORD_DIR):
+        self.inner = inner
+        self.record_dir = Path(record_dir)
+        self.record_dir.mkdir(parents=True, exist_ok=True)
+
+    def generate_content(self, model: str, contents, config=None):
+        request = describe_request(model, contents, config)
+        start = time.perf_counter()
+        record = {"request": request, "recorded_at": time.time()}
+        try:
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            record.update(latency_s=time.perf_counter() - start, error=_error_dict(e))
+            self._write(request, record)
+            raise
+        record.update(
+            latency_s=time.perf_counter() - start,
+            text=getattr(response, "text", None) or "",
+            usage=_usage_dict(response),
+        )
+        self._write(request, record)
+        return response
+
+    def _write(self, request: dict, record: dict):
+        path = self.record_dir / f"{request_key(request)}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(record, indent=1))
+        tmp.replace(path)
+
+
+class _LatencyModel:
+    """
+    Per-model latency fitted from recordings as
+    latency = time_to_first_token + output_tokens / tokens_per_second,
+    used for requests that aren't an exact replay.
+    """
+
+    def __init__(self, records: list[dict]):
+        self.fits: dict[str, tuple[float, float, float]] = {}
+        by_model: dict[str, list[tuple[float, float]]] = {}
+        for r in records:
+            if "error" in r:
+                continue
+            by_model.setdefault(r["request"]["model"], []).append(
+                (float(r["usage"]["candidates_token_count"]), float(r["latency_s"])))
+
+        for model, points in by_model.items():
+            ttft, rate = 0.5, 80.0
+            if len(points) >= 2 and len({x for x, _ in points}) > 1:
+                slope, intercept = statistics.linear_regression([x for x, _ in points], [y for _, y in points])
+                if slope > 0:
+                    ttft, rate = max(0.0, intercept), 1.0 / slope
+            elif points:
+                ttft = points[0][1] / 2
+                rate = points[0][0] / max(points[0][1] - ttft, 1e-3) or rate
+            residuals = [y - (ttft + x / rate) for x, y in points]
+            spread = statistics.pstdev(residuals) if len(residuals) > 1 else 0.0
+            self.fits[model] = (ttft, rate, spread)
+
+    def estimate(self, model: str, output_tokens: int, rng: random.Random) -> float:
+        ttft, rate, spread = self.fits.get(model, (0.5, 80.0, 0.0))
+        return max(0.0, ttft + output_tokens / rate + rng.gauss(0, spread))
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves responses recorded by RecordingBackend with no network access.
+    Exact request matches replay the recorded latency; misses (when
+    LLM_REPLAY_MISS=nearest) are answered with a recording for the same model
+    and a latency from the fitted TTFT + tokens/s model. LLM_REPLAY_TPM adds a
+    sliding one-minute token quota that answers with 429 once exceeded.
+    """
+
+    name = "replay"
+
+    def __init__(self, record_dir: str = LLM_RECORD_DIR, speed: float = LLM_REPLAY_SPEED,
+                 miss: str = LLM_REPLAY_MISS, tokens_per_minute: int = LLM_REPLAY_TPM, seed: int | None = None):
+        self.record_dir = Path(record_dir)
+        self.speed = speed
+        self.miss = miss
+        self.tokens_per_minute = tokens_per_minute
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window: deque[tuple[float, int]] = deque()
+
+        self.records: dict[str, dict] = {}
+        for path in sorted(self.record_dir.glob("*.json")):
+            self.records[path.stem] = json.loads(path.read_text())
+        self._by_model: dict[str, list[dict]] = {}
+        for r in self.records.values():
+            if "error" not in r:
+                self._by_model.setdefault(r["request"]["model"], []).append(r)
+        self.latency = _LatencyModel(list(self.records.values()))
+
+    def _pick(self, request: dict):
+        record = self.records.get(request_key(request))
+        if record is not None:
+            return record, True
+        if self.miss != "nearest":
+            raise LookupError(f"No recording for request to {request['model']} in {self.record_dir}")
+        candidates = self._by_model.get(request["model"]) or [r for rs in self._by_model.values() for r in rs]
+        if not candidates:
+            raise LookupError(f"No recordings in {self.record_dir}")
+        # Prefer a recording with the same shape (text-only vs image request)
+        has_image = any(isinstance(p, dict) and "inline_data" in p for p in request["contents"])
+        same_shape = [r for r in candidates
+                      if any(isinstance(p, dict) and "inline_data" in p for p in r["request"]["contents"]) == has_image]
+        with self._lock:
+            return self._rng.choice(same_shape or candidates), False
+
+    def _admit(self, tokens: int):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0][0] > 60:
+                self._window.popleft()
+            used = sum(t for _, t in self._window)
+            if used + tokens > self.tokens_per_minute:
+                _raise_recorded_error({"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                       "message": "Simulated tokens-per-minute quota exhausted"})
+            self._window.append((now, tokens))
+
+    def generate_content(self, model: str, contents, config=None):
+        request = describe_request(model, contents, config)
+        record, exact = self._pick(request)
+
+        usage = dict(record.get("usage") or {})
+        if not exact and "error" not in record:
+            # Scale prompt tokens to this request so quota simulation stays honest
+            prompt_chars = sum(len(p) for p in request["contents"] if isinstance(p, str))
+            usage["prompt_token_count"] = prompt_chars // 4
+            usage["total_token_count"] = usage["prompt_token_count"] + usage.get("candidates_token_count", 0)
+        self._admit(usage.get("total_token_count", 0))
+
+        if exact:
+            delay = float(record.get("latency_s", 0.0))
+        else:
+            delay = self.latency.estimate(model, usage.get("candidates_token_count", 0), self._rng)
+        if self.speed:
+            time.sleep(delay * self.speed)
+
+        if "error" in record:
+            _raise_recorded_error(record["error"])
+        return SimpleNamespace(text=record.get("text", ""), usage_metadata=SimpleNamespace(**usage))
+
+
+_backend: LLMBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def _create_backend() -> LLMBackend:
+    if LLM_BACKEND == "replay":
+        return ReplayBackend()
+    if LLM_BACKEND == "record":
+        return RecordingBackend(GeminiBackend())
+    return GeminiBackend()
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def set_backend(backend: LLMBackend | None):
+    """Swap the active backend (tests, benchmarks). None resets to the env default."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
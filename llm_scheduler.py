@@ -0,0 +1,256 @@
+"""
+Admission control and per-user fair queuing for LLM work (code, image and
+batch reviews, push pre-warming).
+
+Each worker process runs at most LLM_MAX_CONCURRENCY model-backed requests
+at a time, and one user at most LLM_USER_MAX_CONCURRENCY of them. The rest
+wait here, without holding a worker thread:
+
+- Tiers are served in strict order: interactive, then batch, then background.
+- Within a tier users are served by start-time fair queuing: each request is
+  tagged with its user's virtual finish time (cost / weight added per
+  request), so someone submitting many or large reviews only gets their
+  weighted share while others are waiting. Weights default to 1 and can be
+  set per user id in LLM_USER_WEIGHTS ("id:2,other:0.5").
+- Past LLM_MAX_QUEUE waiting requests (or LLM_USER_MAX_QUEUE for one user)
+  new ones are refused with 429 and a Retry-After estimated from recent
+  service times, instead of queueing behind work they would time out on.
+"""
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from metrics import counter, gauge, histogram
+from prompt_budget import estimate_tokens
+from tracing import span
+
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_USER_MAX_CONCURRENCY = int(os.getenv("LLM_USER_MAX_CONCURRENCY", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_USER_MAX_QUEUE = int(os.getenv("LLM_USER_MAX_QUEUE", "8"))
+# Users whose wait statistics are kept per worker (least recently seen are dropped)
+LLM_WAIT_STATS_USERS = int(os.getenv("LLM_WAIT_STATS_USERS", "10000"))
+
+TIERS = ("interactive", "batch", "background")
+# Prompt tokens that count as one unit of cost
+COST_TOKENS = 1000
+
+LLM_QUEUE_WAIT = histogram(
+    "llm_queue_wait_seconds", "Time LLM requests waited for a slot.", ("tier",))
+LLM_ADMISSIONS = counter(
+    "llm_admissions_total", "LLM requests by tier and admission outcome.", ("tier", "outcome"))
+LLM_QUEUE_DEPTH = gauge(
+    "llm_queue_depth", "LLM requests waiting for a slot in this worker.", ("tier",))
+LLM_RUNNING = gauge(
+    "llm_running", "LLM requests holding a slot in this worker.")
+
+
+def _parse_weights(raw: str) -> dict[str, float]:
+    weights = {}
+    for item in raw.split(","):
+        user, _, weight = item.strip().rpartition(":")
+        if user and weight:
+            weights[user] = float(weight)
+    return weights
+
+
+USER_WEIGHTS = _parse_weights(os.getenv("LLM_USER_WEIGHTS", ""))
+
+
+class LLMQueueFull(HTTPException):
+    def __init__(self, retry_after: float, detail: str = "Too many reviews queued. Please try again later."):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+
+def code_cost(code: str) -> float:
+    """Queue cost of reviewing `code`: one unit per COST_TOKENS prompt tokens, at least 1."""
+    return max(1.0, estimate_tokens(code) / COST_TOKENS)
+
+
+class _Waiter:
+    __slots__ = ("user", "tier", "tag", "wake", "granted", "enqueued_at")
+
+    def __init__(self, user: str, tier: str, tag: float, wake):
+        self.user = user
+        self.tier = tier
+        self.tag = tag
+        self.wake = wake
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    def __init__(self, capacity: int = LLM_MAX_CONCURRENCY, user_capacity: int = LLM_USER_MAX_CONCURRENCY,
+                 max_queue: int = LLM_MAX_QUEUE, user_max_queue: int = LLM_USER_MAX_QUEUE):
+        self.capacity = capacity
+        self.user_capacity = user_capacity
+        self.max_queue = max_queue
+        self.user_max_queue = user_max_queue
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._queues: dict[str, list[_Waiter]] = {tier: [] for tier in TIERS}
+        self._running: dict[str, int] = {}
+        self._active = 0
+        self._vtime = {tier: 0.0 for tier in TIERS}
+        self._finish: dict[tuple[str, str], float] = {}
+        # Moving average of how long a slot is held, for Retry-After
+        self._service_seconds = 5.0
+        self._waits: OrderedDict[str, list] = OrderedDict()
+
+    # --- public API ---
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user: str, tier: str = "interactive", cost: float = 1.0):
+        """Holds one LLM slot for `user` around the block; waits on the event loop, never in a thread."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(user, tier, cost, wake)
+        try:
+            with span("llm.queue_wait", **{"llm.tier": tier, "llm.cost": cost}):
+                await granted
+        except BaseException:
+            # Client gone (cancelled) while queued: give the slot back if it was granted meanwhile
+            if not self._withdraw(waiter):
+                self._release(waiter, 0.0)
+            raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.monotonic() - start)
+
+    @contextlib.contextmanager
+    def slot_sync(self, user: str, tier: str = "background", cost: float = 1.0):
+        """`slot` for plain threads (the pre-warm worker)."""
+        granted = threading.Event()
+        waiter = self._enqueue(user, tier, cost, granted.set)
+        with span("llm.queue_wait", **{"llm.tier": tier, "llm.cost": cost}):
+            granted.wait()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.monotonic() - start)
+
+    def stats(self, user: str | None = None) -> dict:
+        with self._lock:
+            out = {
+                "capacity": self.capacity,
+                "running": self._active,
+                "queued": {tier: len(queue) for tier, queue in self._queues.items()},
+            }
+            if user is not None:
+                count, total, longest = self._waits.get(user, (0, 0.0, 0.0))
+                out["user"] = {
+                    "running": self._running.get(user, 0),
+                    "queued": sum(w.user == user for queue in self._queues.values() for w in queue),
+                    "requests": count,
+                    "avg_wait_seconds": round(total / count, 3) if count else 0.0,
+                    "max_wait_seconds": round(longest, 3),
+                }
+        return out
+
+    # --- queueing ---
+
+    def _enqueue(self, user: str, tier: str, cost: float, wake) -> _Waiter:
+        with self._lock:
+            queued = sum(len(queue) for queue in self._queues.values())
+            if queued >= self.max_queue:
+                LLM_ADMISSIONS.inc(tier=tier, outcome="rejected")
+                raise LLMQueueFull(self._service_seconds * (queued + 1) / max(1, self.capacity))
+            own = sum(w.user == user for queue in self._queues.values() for w in queue)
+            if own >= self.user_max_queue:
+                LLM_ADMISSIONS.inc(tier=tier, outcome="rejected")
+                raise LLMQueueFull(self._service_seconds * (own + 1) / max(1, self.user_capacity),
+                                   detail="You have too many reviews queued. Please try again later.")
+
+            tag = max(self._vtime[tier], self._finish.get((tier, user), 0.0))
+            self._finish[(tier, user)] = tag + cost / USER_WEIGHTS.get(user, 1.0)
+            waiter = _Waiter(user, tier, tag, wake)
+            self._queues[tier].append(waiter)
+            woken = self._dispatch()
+            LLM_ADMISSIONS.inc(tier=tier, outcome="admitted" if waiter.granted else "queued")
+            self._publish()
+        for w in woken:
+            w.wake()
+        return waiter
+
+    def _dispatch(self) -> list[_Waiter]:
+        """Grants free slots (lock held); returns the waiters to wake."""
+        woken = []
+        while self._active < self.capacity:
+            chosen = None
+            for tier in TIERS:
+                eligible = [w for w in self._queues[tier] if self._running.get(w.user, 0) < self.user_capacity]
+                if eligible:
+                    chosen = min(eligible, key=lambda w: w.tag)
+                    break
+            if chosen is None:
+                break
+            self._queues[chosen.tier].remove(chosen)
+            self._vtime[chosen.tier] = chosen.tag
+            self._active += 1
+            self._running[chosen.user] = self._running.get(chosen.user, 0) + 1
+            chosen.granted = True
+            self._record_wait(chosen)
+            woken.append(chosen)
+        if not any(self._queues.values()):
+            # Idle: forget virtual time so tags don't grow without bound
+            self._vtime = {tier: 0.0 for tier in TIERS}
+            self._finish.clear()
+        return woken
+
+    def _record_wait(self, waiter: _Waiter):
+        waited = time.monotonic() - waiter.enqueued_at
+        LLM_QUEUE_WAIT.observe(waited, tier=waiter.tier)
+        count, total, longest = self._waits.pop(waiter.user, (0, 0.0, 0.0))
+        self._waits[waiter.user] = (count + 1, total + waited, max(longest, waited))
+        while len(self._waits) > LLM_WAIT_STATS_USERS:
+            self._waits.popitem(last=False)
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Removes a waiter that never got its slot; False if it already had one."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queues[waiter.tier].remove(waiter)
+            self._publish()
+            return True
+
+    def _release(self, waiter: _Waiter, held_seconds: float):
+        with self._lock:
+            self._active -= 1
+            running = self._running.get(waiter.user, 1) - 1
+            if running:
+                self._running[waiter.user] = running
+            else:
+                self._running.pop(waiter.user, None)
+            if held_seconds:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * held_seconds
+            woken = self._dispatch()
+            self._publish()
+        for w in woken:
+            w.wake()
+
+    def _publish(self):
+        LLM_RUNNING.set(self._active)
+        for tier, queue in self._queues.items():
+            LLM_QUEUE_DEPTH.set(len(queue), tier=tier)
+
+
+llm_scheduler = FairScheduler()
+os.register_at_fork(after_in_child=llm_scheduler._reset)
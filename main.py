@@ -1,29 +1,84 @@
 import base64
 import datetime
-from argon2 import hash_password
+import importlib
+import json
 import bcrypt
 from bson import ObjectId
-from fastapi import Depends, FastAPI, HTTPException, BackgroundTasks, File , UploadFile , Form
+from fastapi import Depends, FastAPI, HTTPException, BackgroundTasks, File , UploadFile , Form, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from Database import change_user_password, create_user, delete_all_refresh_tokens, delete_otp, get_user, store_otp, store_review, update_user, delete_user, upsert_refresh_token,users_collection, get_all_users, refresh_tokens , is_valid_refresh_token , store_refresh_token, delete_refresh_token, verify_otp
-from auth import create_access_token, create_otp, create_refresh_token, get_current_user, hash_OTP, normalize_email, verify_password, decode_refresh_token
-import Image_LLM
-from Models import CodeReviewRequest, ImageCodeReviewRequest, ImageReview, RefreshRequest, User, CodeReviewResult , LoginRequest, TokenResponse, UserCreate, UserCreate, UserOut, UserUpdate , ForgotPasswordRequest , ResetPasswordRequest
-import uvicorn
-from LLM import code_review, get_code_review
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
+from Database import change_user_password, create_user, get_user, store_review, update_user, delete_user, users_collection, get_all_users, is_valid_refresh_token , store_refresh_token, delete_refresh_token, review_cache_stats
+from auth import create_access_token, create_otp, create_refresh_token, get_current_user, new_jti, normalize_email, verify_password, decode_refresh_payload
+from Models import CodeReviewRequest, GitHubBatchReviewRequest, GitHubFileReviewResponse, GitHubReviewResponse, ImageCodeReviewRequest, ImprovedCodeRequest, ImageReview, RefreshRequest, User, CodeReviewResult , LoginRequest, TokenResponse, UserCreate, UserCreate, UserOut, UserUpdate , ForgotPasswordRequest , ResetPasswordRequest
 from email_service import send_email
-import uuid, os, shutil
-
-from github import get_file_content, get_github_file, get_repo_tree, parseUrl
-
+import refresh_index
+from otp_store import delete_otp, store_otp, verify_otp
+import uuid, os, shutil, time, zlib
+import metrics
+import profiling
+import tracing
+from metrics import REVIEW_RESPONSE_BYTES
+from profiling import run_in_threadpool
+from patching import PatchError, apply_unified_diff
+from llm_scheduler import code_cost, llm_scheduler
+
+from contextlib import asynccontextmanager
+import Database
+from singleflight import single_flight
+
+
+class _RouteGroup:
+    """
+    A module that route handlers import on first use. The review, image and
+    GitHub modules pull in google-genai and requests, which auth and user
+    routes never need; a serverless cold start only pays for what it serves.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def load(self):
+        return importlib.import_module(self._name)
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+# 💤 Route groups, loaded lazily
+LLM = _RouteGroup("LLM")                    # /code-review/, /github/review
+batch_review = _RouteGroup("batch_review")  # /github/review/batch
+Image_LLM = _RouteGroup("Image_LLM")        # /image-code-review/
+github = _RouteGroup("github")              # /github/files, /github/file/
+github_webhook = _RouteGroup("github_webhook")  # /github/webhook
+ROUTE_GROUPS = (LLM, batch_review, Image_LLM, github, github_webhook)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 🚀 Startup runs in every worker, after the fork: clients are created here, not in the master.
+    # Long-running servers load every route group up front so no request pays for the imports
+    for group in ROUTE_GROUPS:
+        group.load()
+    await run_in_threadpool(Database.ping)
+    await run_in_threadpool(Database.ensure_indexes)
+    print(f"Worker {os.getpid()} ready")
+    yield
+    # 🛑 Shutdown runs once the server has drained in-flight requests (or hit its graceful timeout)
+    released = await run_in_threadpool(single_flight.release_owned)
+    if released:
+        print(f"Worker {os.getpid()} released {released} unfinished review lease(s)")
+    await run_in_threadpool(Database.close_client)
+    print(f"Worker {os.getpid()} stopped")
 
 
 app = FastAPI(
     title="Code Review",
     description="Backend API for Code Review managing users and issues.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -36,6 +91,70 @@ app.add_middleware(
 
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+def model_response(model: BaseModel) -> Response:
+    # Review models are already validated; serialize them once with
+    # pydantic-core's native JSON encoder instead of going back through
+    # response_model validation and jsonable_encoder.
+    return Response(content=model.model_dump_json(by_alias=True), media_type="application/json")
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/github/review), not the raw URL, to keep cardinality bounded
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    # 🧭 Root span per request; exported when sampled, slow or failed (see tracing.py)
+    with tracing.start_trace(f"{request.method} {request.url.path}", traceparent=request.headers.get("traceparent"),
+                             **{"http.request.method": request.method, "url.path": request.url.path}) as root:
+        response = await call_next(request)
+        if root is not None:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            root.name = f"{request.method} {route}"
+            root.set(**{"http.route": route, "http.response.status_code": response.status_code})
+            if response.status_code >= 500:
+                root.fail(f"HTTP {response.status_code}")
+            response.headers["X-Trace-Id"] = root.trace.trace_id
+        return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    # 🔬 Opt-in (X-Profile + token) or sampled CPU and wall-clock profile, stored for /profiles
+    session, skipped = profiling.begin(request.headers)
+    if session is None:
+        response = await call_next(request)
+        if skipped:
+            response.headers["X-Profile"] = f"skipped: {skipped}"
+        return response
+    with profiling.running(session):
+        response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    try:
+        # Building the profile (merging pstats, compressing) stays off the event loop
+        await run_in_threadpool(lambda: Database.store_profile(
+            profiling.profile_document(session, request.method, route, response.status_code)))
+        response.headers["X-Profile-Id"] = session.id
+    except Exception as e:
+        print(f"❌ Could not store profile {session.id}: {e}")
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get('/')
 async def root():
     return {"message": "Welcome to the CodeReview Backend API"}
@@ -47,11 +166,21 @@ async def get_endpoints():
             "/" : "Root endpoint",
             "/endpoints" : "List all endpoints",
             "/test" : "Test endpoint",
+            "/metrics" : "Prometheus metrics",
             "/auth/register" : "Register a new user",
             "/auth/login" : "Login a user",
             "/auth/refresh" : "Refresh access token",
             "/auth/profile" : "View user profile",
             "/auth/logout" : "Logout a user",
+            "/code-review/improved-code" : "Apply a diff-mode review patch to get the full improved file",
+            "/llm/queue" : "LLM slots and queue of this worker, with your own queue wait times",
+            "/github/cache/stats" : "Storage and savings of the shared GitHub review cache",
+            "/github/review/batch" : "Review several files of a repo in packed requests",
+            "/github/webhook" : "GitHub push webhook that pre-warms reviews of changed files",
+            "/profiles" : "Stored request profiles (X-Profile-Token)",
+            "/profiles/summary" : "Slowest frames per route across recent profiles",
+            "/profiles/{profile_id}/pstats" : "Download a profile for pstats or snakeviz",
+            "/profiles/{profile_id}/folded" : "Download a profile's folded stacks for a flame graph",
             "/users" : "List all users",
             "/users/changedata" : "Update user data",
             "/users/delete" : "Delete a user"
@@ -138,11 +267,12 @@ async def login_user(login_request: LoginRequest):
         expires_minutes= 15
     )
 
+    jti = new_jti()
     refresh_token = create_refresh_token(
-        {"sub": user.email},
+        {"sub": user.email, "jti": jti},
         expires_days=7
     )
-    upsert_refresh_token(user.email, refresh_token)
+    refresh_index.issue_refresh_token(user.email, jti)
     return {
     "access_token": access_token,
     "refresh_token": refresh_token,
@@ -153,11 +283,15 @@ async def login_user(login_request: LoginRequest):
 async def refresh_access_token(data: RefreshRequest):
 
     # 1️⃣ Decode & validate refresh token 
-    unemail = decode_refresh_token(data.refresh_token)
-    email = normalize_email(unemail)
+    payload = decode_refresh_payload(data.refresh_token)
+    email = normalize_email(payload["sub"])
+    old_jti = payload.get("jti")
     
-    # 2️⃣ Check token exists in DB (not revoked)
-    if not is_valid_refresh_token(email, data.refresh_token):
+    # 2️⃣ Check token is still live (in-process index, no DB read on a hit)
+    if old_jti and not refresh_index.is_current(email, old_jti):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if not old_jti and not is_valid_refresh_token(email, data.refresh_token):
+        # Tokens issued before jti existed are still checked against the DB
         raise HTTPException(status_code=401, detail="Token revoked")
 
     # 3️⃣ Issue new access token
@@ -165,12 +299,18 @@ async def refresh_access_token(data: RefreshRequest):
         {"sub": email},
         expires_minutes=15
     )
+    jti = new_jti()
     new_refresh_token = create_refresh_token(
-        {"sub": email},
+        {"sub": email, "jti": jti},
         expires_days=7
     )
     
-    upsert_refresh_token(email, new_refresh_token)
+    # 4️⃣ Rotate with a single compare-and-swap write
+    if old_jti:
+        if not refresh_index.rotate(email, old_jti, jti):
+            raise HTTPException(status_code=401, detail="Token revoked")
+    else:
+        refresh_index.issue_refresh_token(email, jti)
 
     return {
         "access_token": new_access_token,
@@ -185,7 +325,7 @@ async def read_user_profile(current_user = Depends(get_current_user)):
 
 @app.post("/auth/logout")
 async def logout(current_user = Depends(get_current_user)):
-    refresh_tokens.delete_many({"email": normalize_email(current_user.email)})
+    refresh_index.revoke(current_user.email)
     return {"message": "Logged out successfully"}
 
 
@@ -215,11 +355,7 @@ async def forget_password(data : ForgotPasswordRequest):
     
     reset_otp = create_otp()
     
-    delete_otp(data.email)
-    
-    hash_otp = hash_OTP(reset_otp)
-    
-    store_otp(user.email, hash_otp)
+    store_otp(user.email, reset_otp)
     
     sent = send_email(user.email, reset_otp)
     
@@ -246,7 +382,7 @@ async def reset_password(data : ResetPasswordRequest):
     
     delete_otp(email)
     
-    delete_all_refresh_tokens(email)
+    refresh_index.revoke(email)
     
     return "Password reset successfully"
 
@@ -254,7 +390,7 @@ async def reset_password(data : ResetPasswordRequest):
 async def delete_existing_user(current_user = Depends(get_current_user)):
 
     deleted_count = delete_user(current_user.email)
-    delete_all_refresh_tokens(current_user.email)
+    refresh_index.revoke(current_user.email)
 
     if deleted_count:
         return {
@@ -334,25 +470,44 @@ async def update_profile_photo(
 async def code_review_endpoint(payload: CodeReviewRequest , background_tasks: BackgroundTasks , current_user = Depends(get_current_user)):
     try:
         uid = str(current_user.id)
-        review_result = code_review(
-            user_id=uid,
-            code=payload.code,
-            language=payload.language,
-        )
-        background_tasks.add_task(store_review, review_result)
-        return review_result
+        # ⚖️ Waits for a fair share of the worker's Gemini slots (429 when the queue is full)
+        async with llm_scheduler.slot(uid, cost=code_cost(payload.code)):
+            review_result, shared = await run_in_threadpool(
+                LLM.coalesced_code_review,
+                user_id=uid,
+                code=payload.code,
+                language=payload.language,
+                output=payload.output,
+            )
+        if not shared:
+            background_tasks.add_task(store_review, review_result)
+        response = model_response(review_result)
+        REVIEW_RESPONSE_BYTES.observe(len(response.body), mode="diff" if review_result.improved_diff is not None else "full")
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/image-code-review/",response_model=CodeReviewResult)
+@app.post("/code-review/improved-code")
+async def improved_code_endpoint(payload: ImprovedCodeRequest, current_user = Depends(get_current_user)):
+    # 🩹 Diff-mode reviews only carry a patch; materialize the full file on request
+    try:
+        return {"improved_code": apply_unified_diff(payload.raw_code, payload.improved_diff)}
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+MAX_IMAGES_PER_REVIEW = int(os.getenv("MAX_IMAGES_PER_REVIEW", "10"))
+
+@app.post("/image-code-review/",response_model=ImageReview)
 async def image_code_review_endpoint(
     background_tasks : BackgroundTasks , 
     current_user  = Depends(get_current_user),
-    photo : UploadFile = File(...),
+    photo : UploadFile | None = File(None),
+    photos : list[UploadFile] | None = File(None, description="screenshots of one file, in reading order"),
 ):
 
 
-    photo_url = None
     ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "heic"}
     ALLOWED_MIME_TYPES = {
         "image/jpeg",
@@ -362,35 +517,51 @@ async def image_code_review_endpoint(
     }
     
     try:
-        if photo:
+        uploads = ([photo] if photo else []) + (photos or [])
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No image uploaded")
+        if len(uploads) > MAX_IMAGES_PER_REVIEW:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_IMAGES_PER_REVIEW} images per review")
+
+        upload_dir = "uploads/codereview"
+        os.makedirs(upload_dir, exist_ok=True)
+        img_paths, photo_urls = [], []
+        for upload in uploads:
             # 1️⃣ filename must exist
-            if not photo.filename:
+            if not upload.filename:
                 raise HTTPException(status_code=400, detail="Invalid file")
 
             # 2️⃣ validate extension (PRIMARY)
-            ext = photo.filename.rsplit(".", 1)[-1].lower()
+            ext = upload.filename.rsplit(".", 1)[-1].lower()
             if ext not in ALLOWED_EXTENSIONS:
                 raise HTTPException(status_code=400, detail="Invalid image format")
 
             # 3️⃣ validate mime type (SECONDARY, only if provided)
-            if photo.content_type and photo.content_type not in ALLOWED_MIME_TYPES:
+            if upload.content_type and upload.content_type not in ALLOWED_MIME_TYPES:
                 raise HTTPException(status_code=400, detail="Invalid image format")
 
             # 4️⃣ save file
             filename = f"{uuid.uuid4()}.{ext}"
-            upload_dir = "uploads/codereview"
-            os.makedirs(upload_dir, exist_ok=True)
-
             with open(os.path.join(upload_dir, filename), "wb") as buffer:
-                shutil.copyfileobj(photo.file, buffer)
-
-            photo_url = f"/uploads/codereview/{filename}"
-            image_result = Image_LLM.img_code(user_id=str(current_user.id), img_path=photo_url)  # returns ImageReview dict
-            # store only the review (not the whole ImageReview) because store_review expects CodeReviewResult
-            review_only = image_result.get("review")
-            if isinstance(review_only, dict):  # Ensure review_only is a dictionary
-                background_tasks.add_task(store_review, review_only)
-            return image_result
+                shutil.copyfileobj(upload.file, buffer)
+            img_paths.append(os.path.join(upload_dir, filename))
+            photo_urls.append(f"/uploads/codereview/{filename}")
+
+        # ⚖️ Extraction (all images at once) + one review take an LLM slot; run off the event loop
+        async with llm_scheduler.slot(str(current_user.id), cost=1 + len(img_paths)):
+            image_result = await run_in_threadpool(
+                Image_LLM.img_code_many, user_id=str(current_user.id), img_paths=img_paths)  # returns ImageReview dict
+        if "error" in image_result:
+            raise HTTPException(status_code=502, detail=image_result["error"])
+        image_result["image_path"] = photo_urls[0]
+        image_result["image_paths"] = photo_urls
+        # store only the review (not the whole ImageReview) because store_review expects CodeReviewResult
+        review_only = image_result.get("review")
+        if isinstance(review_only, dict):  # Ensure review_only is a dictionary
+            background_tasks.add_task(store_review, review_only)
+        return image_result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -399,38 +570,149 @@ async def get_uploaded_file():
     return {"message": "Use /uploads/<file_path> to access files :)."}
 
 
+GITHUB_FILES_PER_PAGE = int(os.getenv("GITHUB_FILES_PER_PAGE", "500"))
+GITHUB_FILES_MAX_PER_PAGE = int(os.getenv("GITHUB_FILES_MAX_PER_PAGE", "5000"))
+
 @app.get("/github/files")
-async def github_files(url: str):
+async def github_files(
+    request: Request,
+    url: str,
+    ext: list[str] | None = Query(None, description="file extensions to keep, e.g. ext=py&ext=ts"),
+    prefix: str = Query("", description="only paths under this directory, e.g. src/"),
+    glob: str | None = Query(None, description="shell pattern over the full path, e.g. src/*.py"),
+    max_size: int | None = Query(None, ge=0, description="skip blobs larger than this many bytes"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(GITHUB_FILES_PER_PAGE, ge=1, le=GITHUB_FILES_MAX_PER_PAGE),
+):
+    # 🗂️ Default-branch tree, cached per tree sha; the next page is announced in a Link header
     try:
-        owner, repo = parseUrl(url)
-        tree = get_repo_tree(owner, repo)
-        return [
-            item["path"] for item in tree if item["type"] == "blob"
-        ]
+        owner, repo = github.parseUrl(url)
+        paths, has_more = await run_in_threadpool(
+            github.list_repo_files, owner, repo,
+            extensions=ext, prefix=prefix, glob=glob, max_size=max_size,
+            offset=(page - 1) * per_page, limit=per_page,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    response = ORJSONResponse(paths)
+    if has_more:
+        response.headers["Link"] = f'<{request.url.include_query_params(page=page + 1)}>; rel="next"'
+    return response
     
 @app.get("/github/file/")
 async def github_file_content(url: str, file_path: str):
     try:
-        owner, repo = parseUrl(url)
-        content = get_file_content(owner, repo, file_path)
+        owner, repo = github.parseUrl(url)
+        content = github.get_file_content(owner, repo, file_path)
         return {"path": file_path, "content": content}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))    
     
-@app.get("/github/review", response_model=CodeReviewResult)
+@app.get("/github/review", response_model=GitHubReviewResponse)
 async def github_file_review(url: str, file_path: str , current_user = Depends(get_current_user)):
     try:
-        review = get_code_review(
+        uid = str(current_user.id)
+        review, (owner, repo, commit_sha) = await run_in_threadpool(
+            LLM.find_code_review,
             url=url,
             file_path=file_path,
-            user_id=str(current_user.id)
+            user_id=uid
         )
-        return review
+        if review is None:
+            # ⚖️ Only a miss calls Gemini: it waits for a fair share of the worker's slots like /code-review/
+            async with llm_scheduler.slot(uid):
+                review = await run_in_threadpool(LLM.coalesced_github_review, owner, repo, file_path, commit_sha, uid)
+        # Cached results are stored in response shape already
+        return ORJSONResponse(review)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/llm/queue")
+async def llm_queue_stats(current_user = Depends(get_current_user)):
+    # ⚖️ This worker's LLM slots and queue, plus the caller's own queue waits
+    return llm_scheduler.stats(str(current_user.id))
+
+@app.get("/github/cache/stats")
+async def github_cache_stats(current_user = Depends(get_current_user)):
+    # 📦 Shared review bodies, per-user links and what sharing saved
+    return await run_in_threadpool(review_cache_stats)
+
+@app.post("/github/review/batch", response_model=list[GitHubFileReviewResponse])
+async def github_batch_review(payload: GitHubBatchReviewRequest, current_user = Depends(get_current_user)):
+    try:
+        async with llm_scheduler.slot(str(current_user.id), tier="batch", cost=len(payload.file_paths)):
+            reviews = await run_in_threadpool(
+                batch_review.review_github_files,
+                url=payload.url,
+                file_paths=payload.file_paths,
+                user_id=str(current_user.id)
+            )
+        return ORJSONResponse(reviews)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/github/webhook", status_code=202)
+async def github_push_webhook(request: Request):
+    # 🪝 Signed GitHub deliveries; pushes queue background reviews of the changed files
+    body = await request.body()
+    github_webhook.verify_signature(body, request.headers.get("X-Hub-Signature-256"))
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+    return await run_in_threadpool(github_webhook.handle_event, request.headers.get("X-GitHub-Event", ""), payload)
+
+@app.get("/profiles")
+async def list_profiles(route: str | None = None, limit: int = Query(50, ge=1, le=500),
+                        x_profile_token: str | None = Header(None)):
+    # 🔬 Newest first; `route` is a route template such as /github/review
+    profiling.require_token(x_profile_token)
+    return ORJSONResponse(await run_in_threadpool(Database.recent_profiles, route, limit))
+
+@app.get("/profiles/summary")
+async def profiles_summary(route: str | None = None, limit: int = Query(200, ge=1, le=1000),
+                           top: int = Query(profiling.PROFILE_TOP_N, ge=1, le=100),
+                           x_profile_token: str | None = Header(None)):
+    # 🐢 Per route, the frames with the most wall-clock time across the last `limit` profiles
+    profiling.require_token(x_profile_token)
+    profiles = await run_in_threadpool(Database.recent_profiles, route, limit)
+    return profiling.route_summary(profiles, top)
+
+async def _stored_profile(profile_id: str, with_blobs: bool = False) -> dict:
+    profile = await run_in_threadpool(Database.get_profile, profile_id, with_blobs)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_profile_token: str | None = Header(None)):
+    profiling.require_token(x_profile_token)
+    return ORJSONResponse(await _stored_profile(profile_id))
+
+@app.get("/profiles/{profile_id}/pstats")
+async def download_profile_pstats(profile_id: str, x_profile_token: str | None = Header(None)):
+    profiling.require_token(x_profile_token)
+    profile = await _stored_profile(profile_id, with_blobs=True)
+    if not profile["pstats"]:
+        raise HTTPException(status_code=404, detail="Profile has no CPU data")
+    return Response(zlib.decompress(profile["pstats"]), media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'})
+
+@app.get("/profiles/{profile_id}/folded")
+async def download_profile_folded(profile_id: str, x_profile_token: str | None = Header(None)):
+    profiling.require_token(x_profile_token)
+    profile = await _stored_profile(profile_id, with_blobs=True)
+    return PlainTextResponse(zlib.decompress(profile["folded"]).decode(),
+                             headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,244 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+
+# Latency buckets (seconds) wide enough for both Mongo round-trips and
+# multi-second Gemini generations.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., +Inf count], sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][idx] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            items = [(k, (list(v[0]), v[1])) for k, v in self._values.items()]
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+_registry: list[_Metric] = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def counter(name: str, doc: str, labels: tuple = ()) -> Counter:
+    return _register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: tuple = ()) -> Gauge:
+    return _register(Gauge(name, doc, labels))
+
+
+def histogram(name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, doc, labels, buckets))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+HTTP_REQUEST_DURATION = histogram(
+    "http_request_duration_seconds", "Request latency per route.", ("method", "route", "status"))
+
+# --- Mongo ---
+MONGO_COMMAND_DURATION = histogram(
+    "mongo_command_duration_seconds", "Mongo command latency per collection.", ("collection", "command", "outcome"))
+
+# --- GitHub ---
+GITHUB_REQUEST_DURATION = histogram(
+    "github_request_duration_seconds", "GitHub API call latency.", ("endpoint", "status"))
+GITHUB_RATE_LIMIT_REMAINING = gauge(
+    "github_rate_limit_remaining", "Last X-RateLimit-Remaining seen from GitHub.", ("resource",))
+GITHUB_REVIEW_CACHE = counter(
+    "github_review_cache_requests_total", "GitHub review cache lookups.", ("result",))
+GITHUB_REVIEW_CACHE_HIT_RATIO = gauge(
+    "github_review_cache_hit_ratio", "Hit ratio of the GitHub review cache since start.")
+
+# --- Gemini ---
+GEMINI_REQUEST_DURATION = histogram(
+    "gemini_request_duration_seconds", "Gemini generate_content latency per attempt.", ("model", "call", "outcome"))
+GEMINI_RETRIES = counter(
+    "gemini_retries_total", "Gemini calls retried after a transient error.", ("model", "call"))
+GEMINI_TOKENS = counter(
+    "gemini_tokens_total", "Tokens reported by Gemini usage_metadata.", ("model", "call", "kind"))
+
+
+# --- Review output (full improved_code vs unified diff) ---
+REVIEW_OUTPUT_TOKENS = histogram(
+    "review_output_tokens", "Gemini output tokens per code review.", ("mode",),
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+REVIEW_GENERATION_SECONDS = histogram(
+    "review_generation_seconds", "Gemini time per code review, retries included.", ("mode",))
+REVIEW_RESPONSE_BYTES = histogram(
+    "review_response_bytes", "Serialized /code-review/ response size.", ("mode",),
+    buckets=(1_000, 4_000, 16_000, 64_000, 256_000, 1_000_000, 4_000_000))
+REVIEW_PARSES = counter(
+    "review_parses_total", "Schema-constrained Gemini replies by call and parse outcome.", ("call", "outcome"))
+REVIEW_PARSE_FAILURES = counter(
+    "review_parse_failures_total", "Reply portions (whole reply, field, list entries) that failed to parse.",
+    ("call", "portion"))
+REVIEW_PARSE_WASTED_TOKENS = counter(
+    "review_parse_wasted_tokens_total", "Output tokens of reply portions that had to be requested again.", ("call",))
+REVIEW_EDITS = counter(
+    "review_edits_total", "Model edits in diff mode, by whether they applied cleanly.", ("outcome",))
+
+
+def record_cache_lookup(result: str):
+    """`result` is hit (own link), shared (another user's review) or miss."""
+    GITHUB_REVIEW_CACHE.inc(result=result)
+    hits = GITHUB_REVIEW_CACHE.value(result="hit") + GITHUB_REVIEW_CACHE.value(result="shared")
+    total = hits + GITHUB_REVIEW_CACHE.value(result="miss")
+    GITHUB_REVIEW_CACHE_HIT_RATIO.set(hits / total)
+
+
+def record_gemini_usage(model: str, call: str, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"),
+                       ("output", "candidates_token_count"),
+                       ("total", "total_token_count")):
+        value = getattr(usage, attr, None)
+        if value:
+            GEMINI_TOKENS.inc(value, model=model, call=call, kind=kind)
+
+
+def record_github_response(endpoint: str, res, elapsed: float):
+    GITHUB_REQUEST_DURATION.observe(elapsed, endpoint=endpoint, status=res.status_code)
+    remaining = res.headers.get("X-RateLimit-Remaining")
+    if remaining is not None:
+        GITHUB_RATE_LIMIT_REMAINING.set(
+            float(remaining), resource=res.headers.get("X-RateLimit-Resource", "core"))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener feeding MONGO_COMMAND_DURATION. The collection is
+    only known on the started event, so it's kept per request_id until the
+    matching succeeded/failed event arrives.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple, str] = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.database_name
+        self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome: str):
+        collection = self._pending.pop((event.connection_id, event.request_id), "unknown")
+        MONGO_COMMAND_DURATION.observe(
+            event.duration_micros / 1_000_000,
+            collection=collection, command=event.command_name, outcome=outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
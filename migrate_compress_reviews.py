@@ -0,0 +1,89 @@
+"""
+Compresses raw_code/improved_code in review documents written before
+compressed storage, and reports the space reclaimed per collection.
+
+    python migrate_compress_reviews.py [--dry-run] [--batch-size 500]
+
+Sizes are logical BSON bytes (what Mongo keeps in its cache). WiredTiger only
+returns freed disk space to the OS after `compact` on the collection.
+"""
+import argparse
+
+import bson
+
+from Database import code_reviews_collection, github_review_bodies, github_review_collection, images_collection
+from review_compression import COMPRESSED_FIELDS, REVIEW_COMPRESS_MIN_BYTES, compress_review
+
+
+# (collection, dotted prefix of the review inside each document)
+TARGETS = [
+    (code_reviews_collection, ""),
+    (images_collection, ""),
+    (github_review_bodies, "result"),
+    (github_review_collection, "result"),   # cache entries from before shared bodies
+]
+
+
+def _paths(prefix: str) -> list[str]:
+    return [f"{prefix}.{field}" if prefix else field for field in COMPRESSED_FIELDS]
+
+
+def _review_part(doc: dict, prefix: str) -> dict:
+    return doc.get(prefix) or {} if prefix else doc
+
+
+def migrate_collection(collection, prefix: str, dry_run: bool, batch_size: int) -> dict:
+    paths = _paths(prefix)
+    query = {"$or": [{path: {"$type": "string"}} for path in paths]}
+    # Shared bodies record the BSON size of their whole stored result, so
+    # those documents are fetched in full to recompute it
+    projection = {prefix: 1} if collection is github_review_bodies else {path: 1 for path in paths}
+
+    stats = {"scanned": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0}
+    for doc in collection.find(query, projection, batch_size=batch_size):
+        stats["scanned"] += 1
+        review = _review_part(doc, prefix)
+        fields = {f: review[f] for f in COMPRESSED_FIELDS if isinstance(review.get(f), str)}
+        packed = {f: v for f, v in compress_review(fields).items() if v is not fields[f]}
+        if not packed:
+            continue
+
+        before = len(bson.encode(fields))
+        after = len(bson.encode({**fields, **packed}))
+        stats["rewritten"] += 1
+        stats["bytes_before"] += before
+        stats["bytes_after"] += after
+
+        if not dry_run:
+            update = {"$set": {(f"{prefix}.{f}" if prefix else f): v for f, v in packed.items()}}
+            if collection is github_review_bodies:
+                # Same formula as Database.store_review_body
+                update["$set"]["stored_bytes"] = len(bson.encode({**review, **packed}))
+            collection.update_one({"_id": doc["_id"]}, update)
+
+    stats["reclaimed"] = stats["bytes_before"] - stats["bytes_after"]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be reclaimed")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"Compressing review text fields >= {REVIEW_COMPRESS_MIN_BYTES} bytes"
+          f"{' (dry run)' if args.dry_run else ''}\n")
+    print(f"{'collection':<22}{'scanned':>9}{'rewritten':>11}{'before':>14}{'after':>14}{'reclaimed':>14}")
+    totals = {"scanned": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0, "reclaimed": 0}
+    for collection, prefix in TARGETS:
+        stats = migrate_collection(collection, prefix, args.dry_run, args.batch_size)
+        for key in totals:
+            totals[key] += stats[key]
+        print(f"{collection.name:<22}{stats['scanned']:>9}{stats['rewritten']:>11}"
+              f"{stats['bytes_before']:>14,}{stats['bytes_after']:>14,}{stats['reclaimed']:>14,}")
+    print(f"{'total':<22}{totals['scanned']:>9}{totals['rewritten']:>11}"
+          f"{totals['bytes_before']:>14,}{totals['bytes_after']:>14,}{totals['reclaimed']:>14,}")
+
+
+if __name__ == "__main__":
+    main()
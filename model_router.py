@@ -0,0 +1,112 @@
+"""
+Model routing: which Gemini model each review request goes to.
+
+Code is routed by size and complexity. Code of at most
+ROUTE_LIGHT_MAX_TOKENS prompt tokens and ROUTE_LIGHT_MAX_COMPLEXITY decision
+points (branches, loops, handlers, boolean operators: a language-agnostic
+stand-in for cyclomatic complexity) goes to the light model
+(GEMINI_LIGHT_MODEL, cheaper and faster); anything bigger or more involved
+goes to GEMINI_MODEL. A batch goes to the light model only if all its files
+would. Screenshots go to GEMINI_IMAGE_MODEL (default GEMINI_MODEL): their
+code isn't known before it is transcribed. An empty GEMINI_LIGHT_MODEL sends
+everything to GEMINI_MODEL.
+
+When a model answers 429 (quota exhausted) the request is retried on its
+alternate, and for GEMINI_FAILOVER_COOLDOWN_SECONDS new requests for it go
+straight to the alternate. By default the light and strong models stand in
+for each other; GEMINI_FAILOVER_MODELS ("model=alternate,...") overrides
+that, and an empty alternate ("model=") disables failover for a model.
+
+The model that served a review is recorded on it (CodeReviewResult.model)
+and is part of the review cache keys, so changing the configured models
+doesn't keep serving reviews written by models no longer in use.
+"""
+import os
+import re
+import time
+
+import dotenv
+from google.genai import errors as genai_errors
+
+from metrics import counter
+from prompt_budget import estimate_tokens
+
+
+dotenv.load_dotenv()
+
+STRONG_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+LIGHT_MODEL = os.getenv("GEMINI_LIGHT_MODEL", "gemini-2.5-flash-lite").strip()
+IMAGE_MODEL = os.getenv("GEMINI_IMAGE_MODEL", STRONG_MODEL)
+ROUTE_LIGHT_MAX_TOKENS = int(os.getenv("ROUTE_LIGHT_MAX_TOKENS", "1500"))
+ROUTE_LIGHT_MAX_COMPLEXITY = int(os.getenv("ROUTE_LIGHT_MAX_COMPLEXITY", "15"))
+GEMINI_FAILOVER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_FAILOVER_COOLDOWN_SECONDS", "30"))
+
+_DECISION_POINTS = re.compile(r"\b(?:if|elif|elsif|for|foreach|while|case|when|catch|except|rescue)\b|&&|\|\|")
+
+MODEL_FAILOVERS = counter(
+    "gemini_model_failovers_total", "Requests moved to an alternate model after a 429.", ("from_model", "to_model"))
+
+
+def _parse_failover(raw: str) -> dict[str, str]:
+    failover = {STRONG_MODEL: LIGHT_MODEL, LIGHT_MODEL: STRONG_MODEL} if LIGHT_MODEL else {}
+    for item in raw.split(","):
+        model, sep, alternate = item.partition("=")
+        if sep and model.strip():
+            failover[model.strip()] = alternate.strip()
+    return {model: alternate for model, alternate in failover.items() if alternate and alternate != model}
+
+
+FAILOVER_MODELS = _parse_failover(os.getenv("GEMINI_FAILOVER_MODELS", ""))
+
+# model -> monotonic time until which it is treated as out of quota
+_exhausted_until: dict[str, float] = {}
+
+
+def complexity(code: str) -> int:
+    return len(_DECISION_POINTS.findall(code))
+
+
+def is_light(code: str) -> bool:
+    return estimate_tokens(code) <= ROUTE_LIGHT_MAX_TOKENS and complexity(code) <= ROUTE_LIGHT_MAX_COMPLEXITY
+
+
+def route(*codes: str) -> str:
+    """The model for reviewing `codes` together (one file, or every file of a batch)."""
+    if LIGHT_MODEL and all(is_light(code) for code in codes):
+        return LIGHT_MODEL
+    return STRONG_MODEL
+
+
+def serving_models() -> list[str]:
+    """Every model a review may currently come from; cached reviews by any other model are stale."""
+    models = {STRONG_MODEL, IMAGE_MODEL, *FAILOVER_MODELS, *FAILOVER_MODELS.values()}
+    if LIGHT_MODEL:
+        models.add(LIGHT_MODEL)
+    return sorted(models)
+
+
+def available(model: str) -> str:
+    """`model`, or its alternate while `model` is cooling down after a 429."""
+    alternate = FAILOVER_MODELS.get(model)
+    now = time.monotonic()
+    if alternate and _exhausted_until.get(model, 0.0) > now >= _exhausted_until.get(alternate, 0.0):
+        return alternate
+    return model
+
+
+def is_quota_error(error: Exception) -> bool:
+    return isinstance(error, genai_errors.APIError) and (
+        error.code == 429 or "RESOURCE_EXHAUSTED" in str(error))
+
+
+def failover(model: str, error: Exception, tried: set[str]) -> str | None:
+    """The alternate to retry on after `model` failed with `error`, or None to give up."""
+    if not is_quota_error(error):
+        return None
+    _exhausted_until[model] = time.monotonic() + GEMINI_FAILOVER_COOLDOWN_SECONDS
+    alternate = FAILOVER_MODELS.get(model)
+    if not alternate or alternate in tried:
+        return None
+    MODEL_FAILOVERS.inc(from_model=model, to_model=alternate)
+    print(f"🔀 {model} is out of quota; failing over to {alternate}")
+    return alternate
@@ -0,0 +1,87 @@
+import datetime
+import hashlib
+import hmac
+import os
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from Database import otp_collection, normalize_email, register_indexes
+
+
+load_dotenv()
+
+OTP_SECRET = os.getenv("OTP_SECRET")
+if not OTP_SECRET:
+    # A default secret would be public, making stored digests brute-forceable offline
+    raise ValueError("OTP_SECRET not found in environment variables")
+OTP_EXPIRE_MINUTES = 10
+OTP_MAX_ATTEMPTS = 5
+
+
+@register_indexes
+def ensure_otp_indexes():
+    # Mongo's TTL monitor removes a record once `expires_at` is in the past,
+    # so expired OTPs never need to be cleaned up (or checked) in Python.
+    try:
+        otp_collection.create_index("expires_at", expireAfterSeconds=0)
+        otp_collection.create_index("email", unique=True)
+    except Exception as e:
+        print(e)
+
+
+def hash_otp(email: str, otp: str) -> str:
+    """
+    Keyed HMAC-SHA256 of the OTP, bound to the email it was issued for.
+    A 6-digit code that lives 10 minutes doesn't need a slow KDF: without the
+    server secret the digest can't be brute-forced offline.
+    """
+    message = f"{normalize_email(email)}:{otp.strip()}".encode()
+    return hmac.new(OTP_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+def store_otp(email: str, otp: str):
+    email = normalize_email(email)
+    now = datetime.datetime.utcnow()
+
+    otp_collection.update_one(
+        {"email": email},
+        {"$set": {
+            "email": email,
+            "otp": hash_otp(email, otp),
+            "attempt": 0,
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(minutes=OTP_EXPIRE_MINUTES)
+        }},
+        upsert=True
+    )
+
+
+def verify_otp(email: str, otp: str) -> bool:
+    """
+    Counts the attempt and checks expiry in a single round-trip. The filter
+    only matches a live record that still has attempts left, so an expired or
+    exhausted OTP comes back as None without any Python-side date handling.
+    """
+    email = normalize_email(email)
+    record = otp_collection.find_one_and_update(
+        {
+            "email": email,
+            "expires_at": {"$gt": datetime.datetime.utcnow()},
+            "attempt": {"$lt": OTP_MAX_ATTEMPTS}
+        },
+        {"$inc": {"attempt": 1}},
+        projection={"otp": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not record:
+        return False
+    return hmac.compare_digest(record["otp"], hash_otp(email, otp))
+
+
+def delete_otp(email: str):
+    result = otp_collection.delete_one({
+        "email": normalize_email(email),
+    })
+    return result.deleted_count
+
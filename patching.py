@@ -0,0 +1,133 @@
+import dataclasses
+import difflib
+import re
+from typing import Any, Dict, List
+
+from prompt_budget import OMITTED_MARKER, MinimizedCode
+
+
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_NO_NEWLINE = "\\ No newline at end of file\n"
+
+
+class PatchError(ValueError):
+    pass
+
+
+def apply_edits(original: str, edits: List[Dict[str, Any]]) -> tuple[str, int, int]:
+    """
+    Applies the model's find/replace edits in order. An edit is only applied
+    if its `find` text occurs exactly once in the current text; anything else
+    (missing, ambiguous, touching an omitted region) is rejected.
+    Returns `(patched, applied, rejected)`.
+    """
+    text, applied, rejected = original, 0, 0
+    for edit in edits:
+        if not isinstance(edit, dict):
+            rejected += 1
+            continue
+        find, replace = edit.get("find"), edit.get("replace")
+        if not isinstance(find, str) or not find or not isinstance(replace, str) \
+                or OMITTED_MARKER in find or text.count(find) != 1:
+            rejected += 1
+            continue
+        text = text.replace(find, replace, 1)
+        applied += 1
+    return text, applied, rejected
+
+
+def apply_minimized_edits(code: str, minimized: MinimizedCode, edits: List[Dict[str, Any]]) -> tuple[str, int, int]:
+    """
+    apply_edits for edits written against `minimized.text` (what the model
+    saw), returning the patched original `code`. The edits are applied to the
+    minimized text; each changed run of minimized lines then replaces the
+    original lines it stands for, so untouched lines keep their exact bytes
+    (trailing whitespace, CRLF, collapsed blank lines, omitted regions).
+    If a change would drop an omitted region, nothing is applied.
+    """
+    seen = minimized.text.splitlines()
+    patched, applied, rejected = apply_edits("\n".join(seen), edits)
+    if not applied:
+        return code, applied, rejected
+
+    raw = code.splitlines(keepends=True)
+    newline = "\r\n" if "\r\n" in code else "\n"
+    # Original line index each minimized line starts at; the last one runs to the end
+    starts = [line - 1 for line in minimized.line_map] + [len(raw)]
+    out: List[str] = []
+    pos = 0
+    matcher = difflib.SequenceMatcher(None, seen, patched.splitlines(), autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        first, end = starts[i1], starts[i2]
+        replaced = "\n".join(seen[i1:i2])
+        chunk = "\n".join(matcher.b[j1:j2])
+        # Markers of the replaced lines must survive and are put back as the original code
+        markers = {m: v for m, v in minimized.omitted.items() if m in replaced}
+        if markers:
+            chunk = dataclasses.replace(minimized, omitted=markers).expand(chunk)
+            if chunk is None:
+                return code, 0, applied + rejected
+        out.extend(raw[pos:first])
+        out.extend(line + newline for line in chunk.splitlines())
+        if end == len(raw) and raw and not raw[-1].endswith(("\n", "\r")) and out:
+            out[-1] = out[-1].rstrip("\r\n")
+        pos = end
+    out.extend(raw[pos:])
+    return "".join(out), applied, rejected
+
+
+def unified_diff(original: str, patched: str, name: str = "code") -> str:
+    """Unified diff of `original` -> `patched`; empty if they are identical."""
+    out = []
+    for line in difflib.unified_diff(original.splitlines(keepends=True), patched.splitlines(keepends=True),
+                                     f"a/{name}", f"b/{name}"):
+        out.append(line if line.endswith("\n") else line + "\n" + _NO_NEWLINE)
+    return "".join(out)
+
+
+def apply_unified_diff(original: str, diff: str) -> str:
+    """Inverse of unified_diff: rebuilds the patched text from `original` and a diff."""
+    if not diff:
+        return original
+    src = original.splitlines(keepends=True)
+    lines = diff.splitlines(keepends=True)
+    out: List[str] = []
+    pos, i = 0, 0
+
+    while i < len(lines):
+        match = _HUNK_RE.match(lines[i])
+        i += 1
+        if not match:
+            continue  # ---/+++ headers
+        start, count = int(match.group(1)), int(match.group(2) or 1)
+        target = start - 1 if count else start
+        if target < pos or target > len(src):
+            raise PatchError(f"Hunk at line {start} is out of order or past the end of the code")
+        out.extend(src[pos:target])
+        pos = target
+
+        last = None
+        while i < len(lines) and not lines[i].startswith("@@"):
+            line = lines[i]
+            i += 1
+            if line.startswith("\\"):
+                if last in ("+", " ") and out:
+                    out[-1] = out[-1].rstrip("\r\n")
+                continue
+            tag, text = line[:1], line[1:]
+            if tag in (" ", "-"):
+                if pos >= len(src) or src[pos].rstrip("\r\n") != text.rstrip("\r\n"):
+                    raise PatchError(f"Diff does not match the code at line {pos + 1}")
+                if tag == " ":
+                    out.append(src[pos])
+                pos += 1
+            elif tag == "+":
+                out.append(text)
+            else:
+                raise PatchError(f"Malformed diff line: {line!r}")
+            last = tag
+
+    out.extend(src[pos:])
+    return "".join(out)
@@ -0,0 +1,344 @@
+"""
+Opt-in request profiling, for finding out why one route is slow in
+production without adding prints and redeploying.
+
+A request is profiled when it carries `X-Profile: 1` with the
+`X-Profile-Token` set in PROFILE_TOKEN, or is picked by PROFILE_SAMPLE_RATE.
+With no PROFILE_TOKEN configured, profiling is off. A profile has two parts:
+- CPU: cProfile, timed in thread CPU time, on the event loop thread for the
+  whole request (which includes sync calls an async route makes without a
+  threadpool) and on each worker thread running the request's
+  `run_in_threadpool` calls;
+- wall clock: a sampler thread records the stacks of those same threads
+  every PROFILE_INTERVAL_MS, so time spent blocked (Mongo, GitHub, Gemini,
+  locks) shows up next to CPU time. Samples of the loop sitting idle in its
+  selector are dropped.
+On the loop thread, both parts also see other requests' coroutines that run
+in between, so profile under low concurrency where possible.
+
+Overhead is capped per worker: one profile at a time, at most
+PROFILE_MAX_SECONDS of sampling per request, and profiled requests may
+take at most PROFILE_MAX_SHARE of each PROFILE_WINDOW_SECONDS. Requests
+over the cap run unprofiled. A profiled response carries X-Profile-Id. The
+profile is stored for PROFILE_TTL_DAYS and can be downloaded from /profiles
+(same token) as pstats (snakeviz, `pstats.Stats`) or folded stacks
+(speedscope, flamegraph.pl), together with its top-N slowest frames.
+"""
+import contextlib
+import contextvars
+import cProfile
+import hmac
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import dotenv
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+from metrics import counter
+
+
+dotenv.load_dotenv()
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+PROFILE_MAX_SHARE = float(os.getenv("PROFILE_MAX_SHARE", "0.05"))
+PROFILE_WINDOW_SECONDS = float(os.getenv("PROFILE_WINDOW_SECONDS", "600"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "20"))
+
+REQUEST_PROFILES = counter(
+    "request_profiles_total", "Requests that asked or were sampled for profiling, by outcome.", ("trigger", "outcome"))
+
+_ROOT = str(Path(__file__).parent) + os.sep
+
+
+def _short(path: str) -> str:
+    """`path` relative to the repo or to site-packages."""
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):]
+    if "site-packages" + os.sep in path:
+        return path.split("site-packages" + os.sep, 1)[1]
+    return path
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _idle(frame) -> bool:
+    # The event loop waiting for I/O: not time the request spent
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+
+class ProfileSession:
+    def __init__(self, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.truncated = False
+        self.samples = 0
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self._own_code: set[str] = set()
+        self._threads: set[int] = set()
+        self._loop_thread = threading.get_ident()
+        self._profilers: list[cProfile.Profile] = []
+        self._loop_profiler: cProfile.Profile | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.id[:8]}", daemon=True)
+
+    # --- CPU ---
+
+    def _enable(self) -> cProfile.Profile | None:
+        # Thread CPU time, not wall time: waiting is what the sampler measures
+        profiler = cProfile.Profile(time.thread_time)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one profiler per process; the loop thread's already covers every thread
+            return None
+        with self._lock:
+            self._profilers.append(profiler)
+        return profiler
+
+    def start(self):
+        self._threads.add(self._loop_thread)
+        self._loop_profiler = self._enable()
+        self._sampler.start()
+
+    def wrap(self, fn):
+        """`fn` profiled (CPU and wall clock) in whichever worker thread runs it."""
+        def run(*args, **kwargs):
+            tid = threading.get_ident()
+            self._threads.add(tid)
+            profiler = self._enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                self._threads.discard(tid)
+        return run
+
+    def stop(self):
+        if self._loop_profiler is not None:
+            self._loop_profiler.disable()
+        self._stop.set()
+        if self._sampler.ident is not None:
+            self._sampler.join()
+        self.duration = time.monotonic() - self.started
+
+    # --- wall clock ---
+
+    def _sample(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            if time.monotonic() - self.started > PROFILE_MAX_SECONDS:
+                self.truncated = True
+                return
+            frames = sys._current_frames()
+            for tid in list(self._threads):
+                frame = frames.get(tid)
+                if frame is None or (tid == self._loop_thread and _idle(frame)):
+                    continue
+                stack = []
+                while frame is not None:
+                    label = _label(frame.f_code)
+                    if frame.f_code.co_filename.startswith(_ROOT):
+                        self._own_code.add(label)
+                    stack.append(label)
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+    # --- results ---
+
+    def cpu_stats(self) -> pstats.Stats | None:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def folded(self) -> str:
+        """Collapsed stacks, one `root;...;leaf count` line each."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_frames(self, n: int = PROFILE_TOP_N) -> list[dict]:
+        """
+        The `n` frames the request's threads spent the most wall-clock time
+        in (self time: running or blocked there), each with the innermost
+        frame of this repo's code that led to it and its total time.
+        """
+        total, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            site = next((label for label in reversed(stack) if label in self._own_code), None)
+            own[stack[-1], site] += count
+            for label in set(stack):
+                total[label] += count
+        ms = PROFILE_INTERVAL_MS
+        return [{"frame": label, "called_from": site, "self_ms": round(count * ms, 1),
+                 "total_ms": round(total[site] * ms, 1) if site else None}
+                for (label, site), count in own.most_common(n)]
+
+    def top_cpu(self, stats: pstats.Stats | None, n: int = PROFILE_TOP_N) -> list[dict]:
+        if stats is None:
+            return []
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:n]
+        return [{"frame": f"{func} ({_short(path)}:{line})", "calls": calls,
+                 "self_ms": round(tottime * 1000, 1), "total_ms": round(cumtime * 1000, 1)}
+                for (path, line, func), (_, calls, tottime, cumtime, _) in rows]
+
+
+_active: contextvars.ContextVar[ProfileSession | None] = contextvars.ContextVar("profile_session", default=None)
+
+# One profile at a time per worker, and a bounded share of its wall time
+_busy = threading.Lock()
+_window_start = time.monotonic()
+_window_used = 0.0
+
+
+def _authorized(token: str | None) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(PROFILE_TOKEN, token)
+
+
+def require_token(token: str | None):
+    """Guards the /profiles download routes."""
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=503, detail="Profiling is not configured")
+    if not _authorized(token):
+        raise HTTPException(status_code=401, detail="Invalid profile token")
+
+
+def _within_budget() -> bool:
+    global _window_start, _window_used
+    now = time.monotonic()
+    if now - _window_start >= PROFILE_WINDOW_SECONDS:
+        _window_start, _window_used = now, 0.0
+    return _window_used < PROFILE_MAX_SHARE * PROFILE_WINDOW_SECONDS
+
+
+def begin(headers) -> tuple[ProfileSession | None, str | None]:
+    """
+    `(session, None)` when this request is to be profiled (run it under
+    `running(session)`), else `(None, reason)`; the reason is None if
+    profiling was neither asked for nor sampled.
+    """
+    if not PROFILE_TOKEN:
+        return None, None
+    if headers.get("X-Profile") in ("1", "true"):
+        if not _authorized(headers.get("X-Profile-Token")):
+            REQUEST_PROFILES.inc(trigger="header", outcome="denied")
+            return None, "denied"
+        trigger = "header"
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = "sampled"
+    else:
+        return None, None
+
+    if not _within_budget():
+        REQUEST_PROFILES.inc(trigger=trigger, outcome="over_budget")
+        return None, "over_budget"
+    if not _busy.acquire(blocking=False):
+        REQUEST_PROFILES.inc(trigger=trigger, outcome="busy")
+        return None, "busy"
+    return ProfileSession(trigger), None
+
+
+@contextlib.contextmanager
+def running(session: ProfileSession):
+    """Profiles the block (the request) and everything it runs through `run_in_threadpool`."""
+    global _window_used
+    reset, outcome = None, "failed"
+    try:
+        # Inside the try: a profiler or sampler thread that fails to start must still free _busy
+        session.start()
+        reset = _active.set(session)
+        outcome = "profiled"
+        yield session
+    finally:
+        if reset is not None:
+            _active.reset(reset)
+        try:
+            session.stop()
+        finally:
+            _window_used += session.duration
+            _busy.release()
+            REQUEST_PROFILES.inc(trigger=session.trigger, outcome=outcome)
+
+
+def profile_document(session: ProfileSession, method: str, route: str, status: int) -> dict:
+    """What gets stored for download (see Database.store_profile)."""
+    stats = session.cpu_stats()
+    return {
+        "_id": session.id,
+        "method": method,
+        "route": route,
+        "status": status,
+        "trigger": session.trigger,
+        "duration_ms": round(session.duration * 1000, 1),
+        "cpu_ms": round(stats.total_tt * 1000, 1) if stats else None,
+        "samples": session.samples,
+        "interval_ms": PROFILE_INTERVAL_MS,
+        "truncated": session.truncated,
+        "top_frames": session.top_frames(),
+        "top_cpu": session.top_cpu(stats),
+        # pstats.Stats.dump_stats format (loadable with pstats.Stats(path) or snakeviz), compressed
+        "pstats": zlib.compress(marshal.dumps(stats.stats)) if stats else b"",
+        "folded": zlib.compress(session.folded().encode()),
+    }
+
+
+def route_summary(profiles: list[dict], n: int = PROFILE_TOP_N) -> dict:
+    """Per route: profile count, mean duration and CPU, and the top-n frames by mean self time."""
+    routes: dict[str, dict] = {}
+    for profile in profiles:
+        key = f"{profile['method']} {profile['route']}"
+        entry = routes.setdefault(key, {"profiles": 0, "duration_ms": 0.0, "cpu_ms": 0.0, "frames": Counter()})
+        entry["profiles"] += 1
+        entry["duration_ms"] += profile["duration_ms"]
+        entry["cpu_ms"] += profile.get("cpu_ms") or 0.0
+        for frame in profile.get("top_frames") or []:
+            entry["frames"][frame["frame"], frame["called_from"]] += frame["self_ms"]
+    return {
+        key: {
+            "profiles": entry["profiles"],
+            "mean_duration_ms": round(entry["duration_ms"] / entry["profiles"], 1),
+            "mean_cpu_ms": round(entry["cpu_ms"] / entry["profiles"], 1),
+            "top_frames": [{"frame": frame, "called_from": site, "mean_self_ms": round(total / entry["profiles"], 1)}
+                           for (frame, site), total in entry["frames"].most_common(n)],
+        }
+        for key, entry in routes.items()
+    }
+
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    """starlette's run_in_threadpool; under a profiled request the worker thread is profiled too."""
+    session = _active.get()
+    if session is not None:
+        fn = session.wrap(fn)
+    return await _run_in_threadpool(fn, *args, **kwargs)
+
+
+def _after_fork():
+    global _busy, _window_start, _window_used
+    _busy = threading.Lock()
+    _window_start, _window_used = time.monotonic(), 0.0
+
+
+os.register_at_fork(after_in_child=_after_fork)
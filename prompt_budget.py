@@ -0,0 +1,237 @@
+import math
+import os
+import re
+from dataclasses import dataclass, field
+
+
+# Rough local estimate: Gemini tokenizes source code at ~4 characters per
+# token, which is close enough to budget without a network round-trip.
+CHARS_PER_TOKEN = 4
+REVIEW_TOKEN_BUDGET = int(os.getenv("REVIEW_TOKEN_BUDGET", "30000"))
+
+LONG_LINE_CHARS = 400           # minified bundles, inline data blobs
+LONG_LINE_KEEP = 200
+COMMENT_RUN_LINES = 8           # comment blocks longer than this are collapsed
+COMMENT_RUN_KEEP = 2
+DATA_RUN_LINES = 20             # vendored tables / literal arrays
+DATA_RUN_KEEP = 3
+
+OMITTED_MARKER = "⟪omitted"
+
+HASH_COMMENT_LANGUAGES = {"python", "py", "ruby", "rb", "shell", "bash", "sh", "yaml", "yml", "toml", "r", "perl"}
+SLASH_COMMENT_LANGUAGES = {"c", "cpp", "c++", "java", "javascript", "js", "typescript", "ts", "go", "rust",
+                           "kotlin", "swift", "dart", "csharp", "c#", "php", "scala"}
+PREPROCESSOR = re.compile(r"#\s*(include|define|if|ifdef|ifndef|else|elif|endif|pragma|import|undef)\b|#!")
+DATA_LINE = re.compile(r"""^\s*(?:(?:-?\d[\w.]*|"[^"]*"|'[^']*'|true|false|null|None|True|False)\s*[,:]?\s*)+[\[\]{}(),]*\s*,?\s*$""")
+LICENSE_WORDS = re.compile(r"licen[cs]e|copyright|spdx-license-identifier|all rights reserved", re.IGNORECASE)
+
+
+@dataclass
+class MinimizedCode:
+    text: str
+    line_map: list[int] = field(default_factory=list)   # minimized line index -> original 1-based line
+    tokens_before: int = 0
+    tokens_after: int = 0
+    truncated: bool = False
+    # marker text -> (original text it stands for, marker is inline in a kept line)
+    omitted: dict[str, tuple[str, bool]] = field(default_factory=dict)
+
+    def expand(self, text: str) -> str | None:
+        """
+        Puts the original code back in place of every marker in `text` (the
+        model's rewrite of the minimized code). Returns None if a marker was
+        dropped or mangled, since the result would then silently lose code.
+        """
+        for marker, (original, inline) in self.omitted.items():
+            if inline:
+                if f" {marker}" not in text:
+                    return None
+                text = text.replace(f" {marker}", original, 1)
+                continue
+            # The whole line holding the marker is replaced; the original
+            # region carries its own indentation
+            pattern = re.compile(rf"^[^\n]*{re.escape(marker)}[^\n]*$", re.MULTILINE)
+            if not pattern.search(text):
+                return None
+            text = pattern.sub(lambda _: original, text, count=1)
+        if OMITTED_MARKER in text:
+            return None
+        return text
+
+    def original_line(self, line) -> int:
+        """Maps a 1-based line number from the model back onto the original code."""
+        try:
+            line = int(line)
+        except (TypeError, ValueError):
+            return 0
+        if 1 <= line <= len(self.line_map):
+            return self.line_map[line - 1]
+        return line
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _comment_style(language: str | None):
+    lang = (language or "").strip().lower()
+    if lang in HASH_COMMENT_LANGUAGES:
+        return ("#",)
+    if lang in SLASH_COMMENT_LANGUAGES:
+        return ("//", "/*", "*")
+    return ("#", "//", "/*", "*")
+
+
+def _is_comment(line: str, prefixes) -> bool:
+    stripped = line.lstrip()
+    if not stripped:
+        return False
+    if stripped.startswith("#") and PREPROCESSOR.match(stripped):
+        return False
+    if stripped.startswith("*") and "*" in prefixes:
+        # Continuation of a /* */ block, not a pointer dereference
+        return stripped == "*" or stripped[1] in " \t/"
+    return stripped.startswith(tuple(p for p in prefixes if p != "*"))
+
+
+def _marker(count: int, what: str, first_line: int) -> str:
+    # The original line number keeps every marker unique, so it can be expanded again
+    return f"{OMITTED_MARKER} {count} {what} line(s) from L{first_line} ⟫"
+
+
+def _license_header_end(lines: list[str], prefixes) -> int:
+    """Returns how many leading lines form a license/copyright header (0 if none)."""
+    end = 0
+    if lines and lines[0].startswith("#!"):
+        end = 1
+    start = end
+
+    in_block = False
+    while end < len(lines):
+        stripped = lines[end].strip()
+        if in_block:
+            end += 1
+            if "*/" in stripped or stripped.endswith(('"""', "'''")):
+                in_block = False
+            continue
+        if stripped.startswith("/*") and "*/" not in stripped[2:]:
+            in_block = True
+        elif stripped.startswith(('"""', "'''")) and (len(stripped) == 3 or not stripped.endswith(stripped[:3])):
+            in_block = True
+        elif not (stripped == "" or _is_comment(lines[end], prefixes)):
+            break
+        end += 1
+
+    header = "\n".join(lines[start:end])
+    return end if end > start and LICENSE_WORDS.search(header) else 0
+
+
+def minimize_code(code: str, language: str | None = None, budget: int = REVIEW_TOKEN_BUDGET) -> MinimizedCode:
+    """
+    Drops or collapses regions that cost input tokens but carry no review value
+    (license headers, long comment blocks, vendored data literals, minified
+    lines, trailing whitespace, blank-line runs). Every emitted line keeps a
+    pointer to its original line number so issue lines can be mapped back.
+    """
+    prefixes = _comment_style(language)
+    raw = code.splitlines()
+    lines = [line.rstrip() for line in raw]
+    out: list[str] = []
+    line_map: list[int] = []
+    omitted: dict[str, tuple[str, bool]] = {}
+
+    def omit(first: int, end: int, what: str):
+        """Replaces original lines [first, end) (0-based) by one marker line."""
+        marker = _marker(end - first, what, first + 1)
+        omitted[marker] = ("\n".join(raw[first:end]), False)
+        emit(marker, first + 1)
+
+    def emit(text: str, original: int):
+        out.append(text)
+        line_map.append(original)
+
+    i = 0
+    header_end = _license_header_end(lines, prefixes)
+    if header_end:
+        start = 0
+        if lines[0].startswith("#!"):
+            emit(lines[0], 1)
+            start = 1
+        omit(start, header_end, "license header")
+        i = header_end
+
+    while i < len(lines):
+        line = lines[i]
+
+        if _is_comment(line, prefixes):
+            j = i
+            while j < len(lines) and _is_comment(lines[j], prefixes):
+                j += 1
+            if j - i > COMMENT_RUN_LINES:
+                for k in range(i, i + COMMENT_RUN_KEEP):
+                    emit(lines[k], k + 1)
+                omit(i + COMMENT_RUN_KEEP, j, "comment")
+            else:
+                for k in range(i, j):
+                    emit(lines[k], k + 1)
+            i = j
+            continue
+
+        if DATA_LINE.match(line):
+            j = i
+            while j < len(lines) and DATA_LINE.match(lines[j]):
+                j += 1
+            if j - i > DATA_RUN_LINES:
+                for k in range(i, i + DATA_RUN_KEEP):
+                    emit(lines[k], k + 1)
+                omit(i + DATA_RUN_KEEP, j, "data literal")
+                i = j
+                continue
+
+        if not line:
+            if out and not out[-1]:
+                i += 1
+                continue
+        elif len(line) > LONG_LINE_CHARS:
+            marker = f"{OMITTED_MARKER} {len(line) - LONG_LINE_KEEP} chars from L{i + 1} ⟫"
+            omitted[marker] = (raw[i][LONG_LINE_KEEP:], True)
+            line = f"{line[:LONG_LINE_KEEP]} {marker}"
+
+        emit(line, i + 1)
+        i += 1
+
+    text = "\n".join(out)
+    if len(text) >= len(code):
+        # Nothing worth collapsing: send the code untouched with an identity map
+        out, line_map, text, omitted = code.splitlines(), list(range(1, len(lines) + 1)), code, {}
+
+    result = MinimizedCode(
+        text=text,
+        line_map=line_map,
+        tokens_before=estimate_tokens(code),
+        tokens_after=estimate_tokens(text),
+        omitted=omitted,
+    )
+
+    if budget and result.tokens_after > budget:
+        # Keep the head of the file: imports and top-level definitions give the
+        # model the most context per token.
+        kept, used = 0, 0
+        for line in out:
+            cost = estimate_tokens(line + "\n")
+            if used + cost > budget:
+                break
+            used += cost
+            kept += 1
+        dropped_from = line_map[kept] if kept < len(line_map) else len(lines)
+        tail = _marker(len(lines) - dropped_from + 1, "trailing (token budget)", dropped_from)
+        kept_text = "\n".join(out[:kept])
+        result.omitted = {m: v for m, v in omitted.items() if m in kept_text}
+        result.omitted[tail] = ("\n".join(raw[dropped_from - 1:]), False)
+        out = out[:kept] + [tail]
+        result.line_map = line_map[:kept] + [dropped_from]
+        result.text = "\n".join(out)
+        result.tokens_after = estimate_tokens(result.text)
+        result.truncated = True
+
+    return result
@@ -0,0 +1,118 @@
+import datetime
+import os
+import threading
+import time
+
+from Database import normalize_email, refresh_tokens, register_indexes, revoke_refresh_tokens, rotate_refresh_token, upsert_refresh_token
+
+
+REFRESH_INDEX_POLL_SECONDS = float(os.getenv("REFRESH_INDEX_POLL_SECONDS", "2"))
+
+
+class RefreshTokenIndex:
+    """
+    In-process view of the live refresh-token `jti` per email.
+
+    Each worker keeps its own copy and catches up with writes made by other
+    workers by polling `refresh_tokens` for documents whose `updated_at` is at
+    or past the last watermark it saw. A `jti` that matches the index is
+    accepted without touching Mongo; a miss or mismatch falls back to one
+    `find_one` in case this worker hasn't caught up yet. Rotation itself is a
+    compare-and-swap on the stored `jti`, so a stale index can never let a
+    revoked token be rotated.
+    """
+
+    def __init__(self, collection, poll_interval: float = REFRESH_INDEX_POLL_SECONDS):
+        self._collection = collection
+        self._poll_interval = poll_interval
+        self._entries: dict[str, tuple[str | None, datetime.datetime]] = {}
+        self._lock = threading.Lock()
+        self._watermark = datetime.datetime.utcnow() - datetime.timedelta(seconds=poll_interval)
+        self._last_poll = 0.0
+
+    def _remember(self, doc: dict):
+        with self._lock:
+            self._entries[doc["email"]] = (doc.get("jti"), doc["expires_at"])
+
+    def remember(self, email: str, jti: str | None, days: int = 7):
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(days=days)
+        with self._lock:
+            self._entries[normalize_email(email)] = (jti, expires_at)
+
+    def forget(self, email: str):
+        with self._lock:
+            self._entries.pop(normalize_email(email), None)
+
+    def _maybe_poll(self):
+        now = time.monotonic()
+        if now - self._last_poll < self._poll_interval:
+            return
+        self._last_poll = now
+
+        try:
+            # `$gte` rather than `$gt`: several writes can share a millisecond,
+            # and re-applying a document we've already seen is harmless.
+            docs = self._collection.find(
+                {"updated_at": {"$gte": self._watermark}},
+                projection={"email": 1, "jti": 1, "expires_at": 1, "updated_at": 1}
+            )
+            for doc in docs:
+                self._remember(doc)
+                if doc["updated_at"] > self._watermark:
+                    self._watermark = doc["updated_at"]
+        except Exception as e:
+            print(f"Refresh index poll failed: {e}")
+
+    def is_current(self, email: str, jti: str) -> bool:
+        email = normalize_email(email)
+        self._maybe_poll()
+
+        entry = self._entries.get(email)
+        if entry and entry[0] == jti and entry[1] > datetime.datetime.utcnow():
+            return True
+
+        doc = self._collection.find_one(
+            {"email": email},
+            projection={"email": 1, "jti": 1, "expires_at": 1}
+        )
+        if not doc:
+            self.forget(email)
+            return False
+        self._remember(doc)
+        return doc.get("jti") == jti and doc["expires_at"] > datetime.datetime.utcnow()
+
+
+refresh_index = RefreshTokenIndex(refresh_tokens)
+
+
+@register_indexes
+def ensure_refresh_token_indexes():
+    try:
+        refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+        refresh_tokens.create_index("updated_at")
+        refresh_tokens.create_index("email")
+    except Exception as e:
+        print(e)
+
+
+def is_current(email: str, jti: str) -> bool:
+    return refresh_index.is_current(email, jti)
+
+
+def issue_refresh_token(email: str, jti: str):
+    upsert_refresh_token(email, jti)
+    refresh_index.remember(email, jti)
+
+
+def rotate(email: str, old_jti: str, new_jti: str) -> bool:
+    if not rotate_refresh_token(email, old_jti, new_jti):
+        refresh_index.forget(email)
+        return False
+    refresh_index.remember(email, new_jti)
+    return True
+
+
+def revoke(email: str):
+    revoke_refresh_tokens(email)
+    refresh_index.remember(email, None)
+
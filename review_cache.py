@@ -0,0 +1,111 @@
+import datetime
+from typing import Optional
+
+import orjson
+
+from Database import find_review_body, get_cached_review, record_review_body_hit, store_github_review, store_review_body
+from Models import CodeReviewResult, GitHubReviewCache
+from github import is_public_repo
+from metrics import counter, record_cache_lookup
+from model_router import serving_models
+from singleflight import review_key
+
+
+REVIEW_CACHE_BYTES = counter(
+    "github_review_cache_bytes_written_total", "Bytes of review bodies written to the GitHub review cache.", ("scope",))
+REVIEW_CACHE_TOKENS_SAVED = counter(
+    "github_review_cache_prompt_tokens_saved_total", "Gemini prompt tokens not spent thanks to a shared review body.")
+
+
+def review_scope(user_id: str, owner: str, repo: str) -> str:
+    """Public repos share review bodies across users; private ones stay per-user."""
+    return "public" if is_public_repo(owner, repo) else f"user:{user_id}"
+
+
+def body_id_for(scope: str, owner: str, repo: str, file_path: str, commit_sha: str, model: str | None) -> str:
+    if model is None:
+        # Answered locally (and reviews cached before models were recorded)
+        return review_key("github-body", scope, owner, repo, file_path, commit_sha)
+    return review_key("github-body", scope, owner, repo, file_path, commit_sha, model)
+
+
+def _for_user(result: dict, user_id: str) -> dict:
+    # A shared body carries the user_id of whoever produced it
+    return result if result.get("user_id") == user_id else dict(result, user_id=user_id)
+
+
+def lookup_github_review(user_id: str, owner: str, repo: str, file_path: str, commit_sha: str,
+                         record: bool = True) -> Optional[dict]:
+    """
+    The user's own cached review, else (public repos only) a body another user
+    already paid for, which gets linked to this user. None on a miss.
+    `record=False` keeps background lookups (pre-warming) out of the hit stats.
+    Only reviews by a model currently in use (model_router) count.
+    """
+    models = serving_models()
+    cached = get_cached_review(user_id, owner, repo, file_path, commit_sha, models)
+    if cached:
+        if record:
+            record_cache_lookup("hit")
+            if cached.body_id:
+                record_review_body_hit(cached.body_id)
+        return {"review_id": cached.review_id, "result": _for_user(cached.result, user_id), "status": "cached"}
+
+    scope = review_scope(user_id, owner, repo)
+    if scope == "public":
+        body = find_review_body([body_id_for(scope, owner, repo, file_path, commit_sha, model)
+                                 for model in [*models, None]])
+        if body:
+            body_id = body["_id"]
+            if record:
+                record_cache_lookup("shared")
+                record_review_body_hit(body_id)
+                REVIEW_CACHE_TOKENS_SAVED.inc(body.get("prompt_tokens") or 0)
+            return link_github_review(user_id, owner, repo, file_path, commit_sha, body_id, body["result"], "cached")
+
+    if record:
+        record_cache_lookup("miss")
+    return None
+
+
+def cache_github_review(user_id: str, owner: str, repo: str, file_path: str, commit_sha: str,
+                        review: CodeReviewResult) -> dict:
+    """Stores the review body once per scope and links it to `user_id`."""
+    # Cached results keep the API's JSON shape so cache hits can be served without re-validation
+    review_result = review.model_dump(mode="json", by_alias=True)
+
+    scope = review_scope(user_id, owner, repo)
+    body_id = body_id_for(scope, owner, repo, file_path, commit_sha, review.model)
+    size_bytes = len(orjson.dumps(review_result))
+    created = store_review_body(body_id, {
+        "scope": "public" if scope == "public" else "private",
+        "owner": owner,
+        "repo": repo,
+        "file_path": file_path,
+        "commit_sha": commit_sha,
+        "model": review.model,
+        "result": review_result,
+        "size_bytes": size_bytes,
+        "prompt_tokens": review.promptTokensAfter or 0,
+        "link_count": 0,
+        "hits": 0,
+        "created_at": datetime.datetime.utcnow(),
+    })
+    if created:
+        REVIEW_CACHE_BYTES.inc(size_bytes, scope="public" if scope == "public" else "private")
+    return link_github_review(user_id, owner, repo, file_path, commit_sha, body_id, review_result, "new")
+
+
+def link_github_review(user_id: str, owner: str, repo: str, file_path: str, commit_sha: str,
+                       body_id: str, result: dict, status: str) -> dict:
+    review_id = store_github_review(GitHubReviewCache(
+        user_id=user_id,
+        owner=owner,
+        repo=repo,
+        file_path=file_path,
+        commit_sha=commit_sha,
+        body_id=body_id,
+        model=result.get("model"),
+    ))
+    return {"review_id": review_id, "result": _for_user(result, user_id), "status": status}
+
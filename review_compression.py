@@ -0,0 +1,68 @@
+import os
+import zlib
+
+from bson import Binary
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is always available
+    zstandard = None
+
+
+# Text fields at least this many UTF-8 bytes are stored compressed
+REVIEW_COMPRESS_MIN_BYTES = int(os.getenv("REVIEW_COMPRESS_MIN_BYTES", "2048"))
+# zstd (needs the optional `zstandard` package) | zlib | off
+REVIEW_COMPRESSION = os.getenv("REVIEW_COMPRESSION", "zstd" if zstandard else "zlib").strip().lower()
+
+COMPRESSED_FIELDS = ("raw_code", "improved_code", "improved_diff")
+
+# User-defined BSON binary subtype; the first byte of the payload names the codec
+BINARY_SUBTYPE = 0x80
+_ZLIB, _ZSTD = b"z", b"s"
+
+
+def _compress(text: str) -> Binary | str:
+    data = text.encode("utf-8")
+    if REVIEW_COMPRESSION == "off" or len(data) < REVIEW_COMPRESS_MIN_BYTES:
+        return text
+    if REVIEW_COMPRESSION == "zstd" and zstandard is not None:
+        packed = _ZSTD + zstandard.ZstdCompressor(level=6).compress(data)
+    else:
+        packed = _ZLIB + zlib.compress(data, 6)
+    # Incompressible text (already minified, base64, ...) is kept as is
+    return Binary(packed, BINARY_SUBTYPE) if len(packed) < len(data) else text
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, Binary) and value.subtype == BINARY_SUBTYPE
+
+
+def _decompress(value: Binary) -> str:
+    codec, payload = bytes(value[:1]), bytes(value[1:])
+    if codec == _ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if codec == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Review text is zstd-compressed but the `zstandard` package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown review compression codec {codec!r}")
+
+
+def compress_review(doc: dict) -> dict:
+    """Copy of `doc` with its large code fields stored as compressed BSON binary."""
+    packed = dict(doc)
+    for field in COMPRESSED_FIELDS:
+        if isinstance(packed.get(field), str):
+            packed[field] = _compress(packed[field])
+    return packed
+
+
+def decompress_review(doc: dict) -> dict:
+    """Inverse of compress_review; plain (legacy or small) fields pass through."""
+    if not any(is_compressed(doc.get(field)) for field in COMPRESSED_FIELDS):
+        return doc
+    unpacked = dict(doc)
+    for field in COMPRESSED_FIELDS:
+        if is_compressed(unpacked.get(field)):
+            unpacked[field] = _decompress(unpacked[field])
+    return unpacked
@@ -0,0 +1,128 @@
+"""
+Production entrypoint: gunicorn managing uvicorn workers (uvloop + httptools).
+
+    python server.py                 # or: gunicorn -c server.py
+
+This file is also the gunicorn config. The app is preloaded in the master
+and forked into workers; Mongo and Gemini clients are created lazily in each
+worker (see Database.get_client / llm_backend.GeminiBackend), never shared.
+
+On SIGTERM (systemctl restart) each worker stops accepting connections,
+finishes in-flight requests for up to GRACEFUL_TIMEOUT seconds, then runs the
+app's shutdown hook. Give the systemd unit a TimeoutStopSec above that:
+
+    ExecStart=/path/to/venv/bin/python server.py
+    KillSignal=SIGTERM
+    TimeoutStopSec=180
+
+Environment:
+    HOST, PORT              bind address (0.0.0.0:5600)
+    WEB_CONCURRENCY         worker processes (default 2 x CPUs + 1, at most 8)
+    GRACEFUL_TIMEOUT        seconds to drain in-flight reviews on restart (150)
+    WORKER_TIMEOUT          seconds before a silent worker is killed and replaced (180)
+    KEEPALIVE               HTTP keep-alive seconds (5)
+    MAX_REQUESTS            recycle a worker after this many requests, 0 = never (0)
+    PRELOAD_APP             import the app once in the master before forking (1)
+    LOG_LEVEL               gunicorn/uvicorn log level (info)
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import warnings
+
+try:
+    from uvicorn_worker import UvicornWorker
+except ImportError:  # fall back to the (deprecated) worker bundled with uvicorn
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        from uvicorn.workers import UvicornWorker
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5600"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "150"))
+# Time kept back from GRACEFUL_TIMEOUT for the app's shutdown hook
+SHUTDOWN_HOOK_SECONDS = 10
+
+# --- gunicorn settings ---
+wsgi_app = "main:app"
+# main and this module must import from any working directory; the working
+# directory itself is kept (main mounts ./uploads relative to it)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+bind = f"{HOST}:{PORT}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(2 * multiprocessing.cpu_count() + 1, 8))))
+worker_class = "server.ServerWorker"
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+graceful_timeout = GRACEFUL_TIMEOUT
+timeout = int(os.getenv("WORKER_TIMEOUT", "180"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = "-"
+errorlog = "-"
+
+
+class ServerWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": "uvloop" if _installed("uvloop") else "asyncio",
+        "http": "httptools" if _installed("httptools") else "h11",
+        "lifespan": "on",
+        # uvicorn waits forever for open requests by default; stop early enough
+        # that the shutdown hook runs before gunicorn's SIGKILL
+        "timeout_graceful_shutdown": max(1, GRACEFUL_TIMEOUT - SHUTDOWN_HOOK_SECONDS),
+    }
+
+
+# --- gunicorn server hooks ---
+
+def on_starting(server):
+    server.log.info("Starting %s worker(s) on %s (loop=%s, http=%s, preload=%s)",
+                    workers, bind, ServerWorker.CONFIG_KWARGS["loop"], ServerWorker.CONFIG_KWARGS["http"], preload_app)
+
+
+def when_ready(server):
+    # Nothing at import time should open Mongo (indexes are built in each
+    # worker's startup hook); close any client anyway so no sockets or monitor
+    # threads exist when we fork
+    if preload_app:
+        import Database
+        Database.close_client()
+    server.log.info("Master %s ready", os.getpid())
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s forked", worker.pid)
+
+
+def worker_int(worker):
+    worker.log.info("Worker %s interrupted", worker.pid)
+
+
+def worker_abort(worker):
+    worker.log.warning("Worker %s aborted (timeout); in-flight requests were lost", worker.pid)
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s exited", worker.pid)
+
+
+def on_exit(server):
+    server.log.info("Master %s shut down", os.getpid())
+
+
+if __name__ == "__main__":
+    from gunicorn.app.wsgiapp import run
+
+    logging.captureWarnings(True)
+    sys.argv = ["gunicorn", "-c", os.path.abspath(__file__)]
+    sys.exit(run())
@@ -0,0 +1,282 @@
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from Database import register_indexes, review_leases
+from metrics import counter
+from tracing import span
+
+
+LEASE_SECONDS = int(os.getenv("REVIEW_LEASE_SECONDS", "180"))
+# How long a finished result stays on the lease document for late followers
+LEASE_RESULT_SECONDS = int(os.getenv("REVIEW_LEASE_RESULT_SECONDS", "30"))
+LEASE_POLL_SECONDS = float(os.getenv("REVIEW_LEASE_POLL_SECONDS", "0.25"))
+
+REVIEWS_COALESCED = counter(
+    "review_coalesced_total", "Review requests that waited on an identical in-flight review.", ("kind", "scope"))
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _new_worker_id():
+    # Forked workers must not inherit the parent's lease owner id
+    global WORKER_ID
+    WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+os.register_at_fork(after_in_child=_new_worker_id)
+
+
+def review_key(kind: str, *parts) -> str:
+    """Stable key for a review; long inputs (source code) are hashed."""
+    digest = hashlib.sha256("\x00".join(str(p) for p in parts).encode()).hexdigest()
+    return f"{kind}:{digest}"
+
+
+def _identity(value):
+    return value
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Runs one instance of `fn` per key at a time and hands its result to every
+    concurrent caller with the same key.
+
+    Within a worker, followers block on the leader's Event. Across workers the
+    leader holds a lease document in `review_leases` (`_id` = key); followers
+    in other workers poll it until the leader writes the result back, or take
+    the lease over once it has expired. If Mongo is unavailable the call
+    simply runs locally.
+    """
+
+    def __init__(self, collection=review_leases, lease_seconds: int = LEASE_SECONDS,
+                 result_seconds: int = LEASE_RESULT_SECONDS, poll_seconds: float = LEASE_POLL_SECONDS):
+        self._collection = collection
+        self._lease_seconds = lease_seconds
+        self._result_seconds = result_seconds
+        self._poll_seconds = poll_seconds
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, kind: str = "review", to_doc=None, from_doc=None, _retry: bool = True):
+        """
+        Returns `(result, shared)`; `shared` is True if another caller produced
+        it. `to_doc`/`from_doc` convert results that aren't BSON-encodable
+        (e.g. Pydantic models) for the cross-worker lease document.
+
+        A failed call publishes nothing: its lease is dropped and waiting
+        callers retry once (one of them leads the retry) instead of all
+        inheriting the failure.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            REVIEWS_COALESCED.inc(kind=kind, scope="local")
+            with span("singleflight.wait", **{"singleflight.kind": kind, "singleflight.scope": "local"}):
+                call.done.wait()
+            if call.error is not None:
+                if _retry:
+                    return self.do(key, fn, kind, to_doc, from_doc, _retry=False)
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_leased(key, fn, kind, to_doc or _identity, from_doc or _identity)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def do_many(self, calls: dict, fn_many, kind: str = "review", to_doc=None, from_doc=None) -> dict:
+        """
+        Batch form of `do`: `calls` maps key -> single-key fn. Keys no one else
+        is computing are led together by one `fn_many(keys) -> {key: result}`
+        call (keys it leaves out fall back to their own fn); keys already in
+        flight here or in another worker are followed exactly as in `do`.
+        Returns key -> `(result, shared)`.
+        """
+        to_doc, from_doc = to_doc or _identity, from_doc or _identity
+        out, led, follow = {}, {}, []
+        try:
+            for key in calls:
+                with self._lock:
+                    busy = key in self._calls
+                if busy:
+                    follow.append(key)
+                    continue
+                try:
+                    state, doc = self._acquire(key)
+                except PyMongoError as e:
+                    logging.warning("Review lease unavailable, running %s locally: %s", key, e)
+                    state = "acquired"
+                if state == "acquired":
+                    call = led[key] = _Call()
+                    with self._lock:
+                        # A local caller that raced in meanwhile polls our lease instead
+                        self._calls.setdefault(key, call)
+                elif state == "done":
+                    REVIEWS_COALESCED.inc(kind=kind, scope="remote")
+                    out[key] = (from_doc(doc["result"]), True)
+                else:
+                    follow.append(key)
+
+            results = fn_many(list(led)) if led else {}
+            for key, call in list(led.items()):
+                fn = (lambda value=results[key]: value) if key in results else calls[key]
+                call.result = self._run_as_owner(key, fn, to_doc)
+                out[key] = (call.result, False)
+                self._finish(key, led.pop(key))
+        except BaseException as e:
+            for key, call in led.items():
+                call.error = e
+                try:
+                    self._collection.delete_one({"_id": key, "owner": WORKER_ID})
+                except PyMongoError:
+                    pass
+                self._finish(key, call)
+            raise
+
+        for key in follow:
+            out[key] = self.do(key, calls[key], kind, to_doc, from_doc)
+        return out
+
+    def _finish(self, key: str, call: _Call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    # --- cross-worker lease ---
+
+    def _run_leased(self, key: str, fn, kind: str, to_doc, from_doc):
+        counted = False
+        while True:
+            try:
+                state, doc = self._acquire(key)
+            except PyMongoError as e:
+                logging.warning("Review lease unavailable, running %s locally: %s", key, e)
+                return fn(), False
+
+            if state == "acquired":
+                return self._run_as_owner(key, fn, to_doc), False
+            if state == "done":
+                if not counted:
+                    REVIEWS_COALESCED.inc(kind=kind, scope="remote")
+                return from_doc(doc["result"]), True
+
+            if not counted:
+                REVIEWS_COALESCED.inc(kind=kind, scope="remote")
+                counted = True
+            with span("singleflight.wait", **{"singleflight.kind": kind, "singleflight.scope": "remote"}):
+                doc = self._wait(key, doc["expires_at"])
+            if doc is not None:
+                return from_doc(doc["result"]), True
+            # Lease expired or was released without a result: try to take it
+
+    def _acquire(self, key: str):
+        now = datetime.datetime.utcnow()
+        lease = {
+            "_id": key,
+            "owner": WORKER_ID,
+            "status": "running",
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(seconds=self._lease_seconds),
+        }
+        try:
+            self._collection.insert_one(lease)
+            return "acquired", lease
+        except DuplicateKeyError:
+            pass
+
+        taken = self._collection.find_one_and_update(
+            {"_id": key, "status": "running", "expires_at": {"$lt": now}},
+            {"$set": {"owner": WORKER_ID, "expires_at": lease["expires_at"]}},
+        )
+        if taken is not None:
+            return "acquired", taken
+
+        doc = self._collection.find_one({"_id": key})
+        if doc is None:
+            return self._acquire(key)
+        return doc["status"], doc
+
+    def _run_as_owner(self, key: str, fn, to_doc):
+        try:
+            result = fn()
+        except BaseException:
+            try:
+                self._collection.delete_one({"_id": key, "owner": WORKER_ID})
+            except PyMongoError:
+                pass
+            raise
+        try:
+            self._collection.update_one(
+                {"_id": key, "owner": WORKER_ID},
+                {"$set": {
+                    "status": "done",
+                    "result": to_doc(result),
+                    "expires_at": datetime.datetime.utcnow() + datetime.timedelta(seconds=self._result_seconds),
+                }},
+            )
+        except PyMongoError as e:
+            logging.warning("Could not publish result for %s: %s", key, e)
+        return result
+
+    def release_owned(self) -> int:
+        """
+        Drops the running leases this worker still holds (shutdown), so
+        followers in other workers take over instead of waiting for expiry.
+        """
+        try:
+            return self._collection.delete_many({"owner": WORKER_ID, "status": "running"}).deleted_count
+        except PyMongoError as e:
+            logging.warning("Could not release review leases: %s", e)
+            return 0
+
+    def _after_fork(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _wait(self, key: str, expires_at: datetime.datetime):
+        while datetime.datetime.utcnow() < expires_at:
+            time.sleep(self._poll_seconds)
+            doc = self._collection.find_one({"_id": key})
+            if doc is None:
+                return None
+            if doc["status"] == "done":
+                return doc
+            expires_at = doc["expires_at"]
+        return None
+
+
+@register_indexes
+def ensure_lease_indexes():
+    try:
+        review_leases.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        print(e)
+
+
+single_flight = SingleFlight()
+os.register_at_fork(after_in_child=single_flight._after_fork)
@@ -0,0 +1,201 @@
+import ast
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from Models import Issue
+from metrics import counter
+
+
+# Code that fails to parse and is at most this many lines is answered locally
+TRIVIAL_MAX_LINES = int(os.getenv("STATIC_TRIVIAL_MAX_LINES", "5"))
+
+STATIC_FAST_PATH = counter(
+    "review_static_fast_path_total", "Reviews answered by local static analysis without calling the model.", ("reason",))
+STATIC_FINDINGS = counter(
+    "review_static_findings_total", "Local static-analysis findings merged into model reviews.", ("language", "outcome"))
+
+
+@dataclass
+class StaticAnalysis:
+    language: str | None
+    issues: List[Issue] = field(default_factory=list)
+    parse_error: bool = False
+    trivial: bool = False
+    reason: str | None = None          # why the model was skipped: empty | syntax_error
+    suggestions: List[str] = field(default_factory=list)
+
+
+# language -> analyzer(code) -> (issues, parse_error)
+Analyzer = Callable[[str], tuple[List[Issue], bool]]
+_ANALYZERS: Dict[str, Analyzer] = {}
+# Languages whose parse errors never skip the model (dialects we can't fully parse)
+_NO_FAST_PATH: set[str] = set()
+
+
+def register_analyzer(*languages: str, fast_path: bool = True):
+    """
+    Registers an analyzer for one or more (lower-case) language names. With
+    `fast_path=False` its findings are merged but never replace the model.
+    """
+    def decorator(fn: Analyzer) -> Analyzer:
+        for language in languages:
+            _ANALYZERS[language.lower()] = fn
+            if not fast_path:
+                _NO_FAST_PATH.add(language.lower())
+        return fn
+    return decorator
+
+
+def _issue(idx: int, line: int, severity: str, category: str, title: str, explanation: str, fix: str = "") -> Issue:
+    return Issue(id=f"static-{idx}", line=line, severity=severity, category=category,
+                 title=title, explanation=explanation, suggestedFix=fix)
+
+
+# --- Python ---
+
+class _PythonChecks(ast.NodeVisitor):
+    def __init__(self):
+        self.found: List[tuple] = []
+
+    def add(self, node, severity, category, title, explanation, fix=""):
+        self.found.append((getattr(node, "lineno", 0), severity, category, title, explanation, fix))
+
+    def visit_ExceptHandler(self, node):
+        if node.type is None:
+            self.add(node, "warning", "maintainability", "Bare except",
+                     "`except:` also catches KeyboardInterrupt and SystemExit and hides real errors.",
+                     "except Exception:")
+        self.generic_visit(node)
+
+    def _check_defaults(self, node):
+        for default in node.args.defaults + [d for d in node.args.kw_defaults if d is not None]:
+            if isinstance(default, (ast.List, ast.Dict, ast.Set)):
+                self.add(default, "warning", "bug", "Mutable default argument",
+                         f"The default value of `{node.name}` is created once and shared between calls.",
+                         "def f(arg=None):\n    if arg is None:\n        arg = []")
+        self.generic_visit(node)
+
+    visit_FunctionDef = _check_defaults
+    visit_AsyncFunctionDef = _check_defaults
+
+    def visit_Compare(self, node):
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(right, ast.Constant) and right.value is None:
+                self.add(node, "info", "style", "Comparison to None with ==",
+                         "None is a singleton; compare with `is` / `is not`.", "if value is None:")
+            elif isinstance(op, (ast.Is, ast.IsNot)) and isinstance(right, ast.Constant) \
+                    and isinstance(right.value, (str, bytes, int, float)) and not isinstance(right.value, bool):
+                self.add(node, "warning", "bug", "Identity comparison with a literal",
+                         "`is` compares object identity, not value; the result depends on interning.",
+                         "if value == literal:")
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in ("eval", "exec"):
+            self.add(node, "critical", "security", f"Use of {node.func.id}()",
+                     f"`{node.func.id}` runs arbitrary code; never pass it untrusted input.",
+                     "ast.literal_eval(value)  # for literals")
+        self.generic_visit(node)
+
+    def visit_Assert(self, node):
+        if isinstance(node.test, ast.Tuple) and node.test.elts:
+            self.add(node, "warning", "bug", "Assert on a tuple",
+                     "A non-empty tuple is always true, so this assert can never fail.",
+                     "assert condition, \"message\"")
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if any(alias.name == "*" for alias in node.names):
+            self.add(node, "info", "maintainability", "Wildcard import",
+                     f"`from {node.module} import *` hides where names come from and can shadow locals.")
+        self.generic_visit(node)
+
+
+@register_analyzer("python", "py")
+def analyze_python(code: str) -> tuple[List[Issue], bool]:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = e.lineno or 0
+        return [_issue(1, line, "critical", "bug", "Syntax error",
+                       f"The code does not parse: {e.msg} (line {line}).")], True
+    checks = _PythonChecks()
+    checks.visit(tree)
+    return [_issue(idx + 1, *found) for idx, found in enumerate(checks.found)], False
+
+
+# Strings are matched first so comment markers and commas inside them are kept
+_JSONC_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/|,(?=\s*[]}])', re.DOTALL)
+
+
+def _strip_jsonc(code: str) -> str:
+    """Drops // and /* */ comments and trailing commas (JSONC, tsconfig, VS Code settings), keeping line numbers."""
+    def blank(match):
+        token = match.group(0)
+        return token if token.startswith('"') else re.sub(r"[^\n]", " ", token)
+    return _JSONC_TOKEN.sub(blank, code)
+
+
+# JSON dialects (JSON5, templated configs) are common, so a parse error is
+# reported but the model still reviews the file
+@register_analyzer("json", "jsonc", fast_path=False)
+def analyze_json(code: str) -> tuple[List[Issue], bool]:
+    try:
+        json.loads(_strip_jsonc(code))
+    except json.JSONDecodeError as e:
+        return [_issue(1, e.lineno, "critical", "bug", "Invalid JSON", f"The document does not parse: {e.msg}.")], True
+    return [], False
+
+
+def _looks_like_python(code: str) -> bool:
+    """For unlabelled snippets: parses as Python and isn't just a bare expression."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    return any(not isinstance(stmt, ast.Expr) for stmt in tree.body)
+
+
+def analyze_code(code: str, language: str | None = None) -> StaticAnalysis:
+    """
+    Runs the local analyzer for `language` (or Python, when an unlabelled
+    snippet parses as Python). Empty input and tiny snippets that don't parse
+    are marked trivial: their review is complete without the model.
+    """
+    if not code.strip():
+        return StaticAnalysis(language=language, trivial=True, reason="empty",
+                              suggestions=["Submit some code to get a review."])
+
+    key = (language or "").lower()
+    if not key and _looks_like_python(code):
+        key = "python"
+    analyzer = _ANALYZERS.get(key)
+    if analyzer is None:
+        return StaticAnalysis(language=language)
+
+    issues, parse_error = analyzer(code)
+    analysis = StaticAnalysis(language=language or key, issues=issues, parse_error=parse_error)
+    if parse_error and key not in _NO_FAST_PATH and len(code.strip().splitlines()) <= TRIVIAL_MAX_LINES:
+        analysis.trivial = True
+        analysis.reason = "syntax_error"
+        analysis.suggestions = ["Fix the syntax error, then submit the code again for a full review."]
+    return analysis
+
+
+def merge_issues(model_issues: List[Dict], local_issues: List[Issue], language: str | None = None) -> List[Dict]:
+    """
+    Appends local findings to the model's issues, skipping any the model
+    already reported on the same line and category.
+    """
+    seen = {(str(i.get("line")), str(i.get("category"))) for i in model_issues}
+    merged = list(model_issues)
+    for issue in local_issues:
+        if (str(issue.line), issue.category) in seen:
+            STATIC_FINDINGS.inc(language=language or "unknown", outcome="duplicate")
+            continue
+        merged.append(issue.model_dump())
+        STATIC_FINDINGS.inc(language=language or "unknown", outcome="merged")
+    return merged
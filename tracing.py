@@ -0,0 +1,361 @@
+"""
+Request tracing: where a request's time went (routes, Mongo commands,
+GitHub calls, Gemini attempts and retry sleeps).
+
+Spans follow the OpenTelemetry data model (W3C trace context ids, span
+kinds, attributes, events, status) and are exported per trace as OTLP/JSON,
+so the trace file can be fed to an OpenTelemetry Collector (`otlpjsonfile`
+receiver) or read as is. No collector or SDK is needed.
+
+TRACE_EXPORTER picks where finished traces go (comma separated):
+- "none" (default): tracing is off and every hook is a no-op;
+- "file": one OTLP/JSON line per trace appended to TRACE_FILE;
+- "console": an indented span tree per trace printed to stdout.
+
+Every request under tracing records its spans in memory, but only some
+traces are exported:
+- the head-sampled ones: TRACE_SAMPLE_RATE of trace ids, or whatever an
+  incoming `traceparent` header decided;
+- slow ones (the root took TRACE_SLOW_SECONDS or longer) and failed ones,
+  whether sampled or not, since those are the ones worth reading.
+A trace keeps at most TRACE_MAX_SPANS spans. Exports are written by a
+background thread; if it falls behind, traces are dropped, never waited on.
+
+Spans only nest under an active trace: `start_trace` opens one (HTTP
+middleware, push pre-warm jobs), `span` adds a child of the current span
+and is a no-op outside a trace. Work handed to pool threads must be wrapped
+with `propagate` to stay in the caller's trace.
+"""
+import contextlib
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+
+import dotenv
+import orjson
+from pymongo import monitoring
+
+from metrics import counter
+
+
+dotenv.load_dotenv()
+
+TRACE_EXPORTERS = {name.strip() for name in os.getenv("TRACE_EXPORTER", "none").lower().split(",")} - {"", "none"}
+TRACE_FILE = os.getenv("TRACE_FILE", str(Path(__file__).parent / "traces" / "spans.jsonl"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "512"))
+TRACE_EXPORT_QUEUE = int(os.getenv("TRACE_EXPORT_QUEUE", "1000"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "codereview-backend")
+
+TRACING_ENABLED = bool(TRACE_EXPORTERS)
+
+TRACES_EXPORTED = counter(
+    "traces_exported_total", "Traces handed to the exporters, by why they were kept.", ("reason",))
+TRACES_DROPPED = counter(
+    "traces_dropped_total", "Traces not exported because the export queue was full.")
+
+_KINDS = {"INTERNAL": 1, "SERVER": 2, "CLIENT": 3}
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "lock", "error")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+        self.error = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "events",
+                 "error")
+
+    def __init__(self, trace: _Trace, name: str, kind: str, parent_id: str | None, attributes: dict):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.events: list[tuple[int, str, dict]] = []
+        self.error: str | None = None
+        with trace.lock:
+            if len(trace.spans) < TRACE_MAX_SPANS:
+                trace.spans.append(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, error: BaseException | str):
+        self.error = str(error) or type(error).__name__
+        # Client errors (HTTPException 4xx) are recorded but don't force the trace out
+        if getattr(error, "status_code", 500) >= 500:
+            self.trace.error = True
+        if isinstance(error, BaseException):
+            self.event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)})
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def _parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+
+
+@contextlib.contextmanager
+def start_trace(name: str, kind: str = "SERVER", traceparent: str | None = None, **attributes):
+    """Opens a trace (or joins the caller's from a `traceparent` header) rooted at a new span."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent = _parse_traceparent(traceparent)
+    if parent:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        # Ratio sampling on the trace id, like OpenTelemetry's TraceIdRatioBased
+        sampled = int(trace_id[16:], 16) < TRACE_SAMPLE_RATE * 2 ** 64
+    root = Span(_Trace(trace_id, sampled), name, kind, parent_id, attributes)
+    reset = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.fail(e)
+        raise
+    finally:
+        _current.reset(reset)
+        root.end()
+        _finish(root)
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "INTERNAL", **attributes):
+    """A child of the current span around the block; yields None (and costs nothing) outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, kind, parent.span_id, attributes)
+    reset = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.fail(e)
+        raise
+    finally:
+        _current.reset(reset)
+        child.end()
+
+
+def traced_sleep(seconds: float):
+    """time.sleep that shows up in the trace (retry backoffs)."""
+    with span("retry.sleep", **{"sleep.seconds": seconds}):
+        time.sleep(seconds)
+
+
+def propagate(fn):
+    """Wraps `fn` to run in a pool thread with the caller's context: trace span, GitHub request priority."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy: one Context can't be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class MongoCommandTracing(monitoring.CommandListener):
+    """
+    pymongo command listener adding a CLIENT span per command under the
+    current span. Events fire on the calling thread, so the started event
+    still sees the caller's context; the span is closed by the matching
+    succeeded/failed event.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple, Span] = {}
+
+    def started(self, event):
+        parent = _current.get()
+        if parent is None:
+            return
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = None
+        self._pending[(event.connection_id, event.request_id)] = Span(
+            parent.trace, f"{event.command_name} {collection or event.database_name}", "CLIENT", parent.span_id, {
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": collection,
+            })
+
+    def succeeded(self, event):
+        child = self._pending.pop((event.connection_id, event.request_id), None)
+        if child is not None:
+            child.end()
+
+    def failed(self, event):
+        child = self._pending.pop((event.connection_id, event.request_id), None)
+        if child is not None:
+            child.fail(f"{event.command_name} failed: {event.failure}")
+            child.end()
+
+
+# --- export ---
+
+def _finish(root: Span):
+    trace = root.trace
+    if trace.sampled:
+        reason = "sampled"
+    elif trace.error:
+        reason = "error"
+    elif TRACE_SLOW_SECONDS and root.end_ns - root.start_ns >= TRACE_SLOW_SECONDS * 1e9:
+        reason = "slow"
+    else:
+        return
+    try:
+        _queue.put_nowait((trace, root))
+    except queue.Full:
+        TRACES_DROPPED.inc()
+        return
+    TRACES_EXPORTED.inc(reason=reason)
+    _ensure_worker()
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(span: Span) -> dict:
+    out = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": _KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(span.start_ns),
+        # Spans still open at export (a pool thread outliving the request) end with the root
+        "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+        "attributes": [_attribute(k, v) for k, v in span.attributes.items() if v is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        out["parentSpanId"] = span.parent_id
+    if span.events:
+        out["events"] = [{"timeUnixNano": str(at), "name": name,
+                          "attributes": [_attribute(k, v) for k, v in attributes.items() if v is not None]}
+                         for at, name, attributes in span.events]
+    return out
+
+
+def otlp_json(trace: _Trace) -> bytes:
+    with trace.lock:
+        spans = list(trace.spans)
+    return orjson.dumps({"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "codereview.tracing"}, "spans": [_otlp_span(s) for s in spans]}],
+    }]})
+
+
+def _console_tree(trace: _Trace, root: Span) -> str:
+    with trace.lock:
+        spans = list(trace.spans)
+    children: dict[str | None, list[Span]] = {}
+    for s in spans:
+        children.setdefault(s.parent_id, []).append(s)
+    lines = [f"🧭 trace {trace.trace_id}"]
+
+    def walk(s: Span, depth: int):
+        ms = ((s.end_ns or root.end_ns) - s.start_ns) / 1e6
+        lines.append(f"{'  ' * depth}{s.name}  {ms:.1f} ms{'  ❌ ' + s.error if s.error else ''}")
+        for child in sorted(children.get(s.span_id, []), key=lambda c: c.start_ns):
+            walk(child, depth + 1)
+    walk(root, 1)
+    return "\n".join(lines)
+
+
+def _export(trace: _Trace, root: Span):
+    if "file" in TRACE_EXPORTERS:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "ab") as f:
+            # One write per trace keeps lines from concurrent workers whole
+            f.write(otlp_json(trace) + b"\n")
+    if "console" in TRACE_EXPORTERS:
+        print(_console_tree(trace, root))
+
+
+# --- background exporter (one per process, started on first export) ---
+
+_queue: queue.Queue = queue.Queue(maxsize=TRACE_EXPORT_QUEUE)
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+def _run():
+    while True:
+        trace, root = _queue.get()
+        try:
+            _export(trace, root)
+        except Exception as e:
+            print(f"⚠️ Trace export failed: {e}")
+        finally:
+            _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="trace-export", daemon=True)
+            _worker.start()
+
+
+def flush():
+    """Blocks until every queued trace is exported (tests, scripts)."""
+    _queue.join()
+
+
+def _after_fork():
+    global _queue, _worker, _worker_lock
+    _queue = queue.Queue(maxsize=TRACE_EXPORT_QUEUE)
+    _worker = None
+    _worker_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)